@@ -0,0 +1,74 @@
+"""
+Benchmarks of the data-side hot paths on synthetic inputs: action conversion, heart counting and the
+recorder's per-frame capture work.
+"""
+
+from threading import Lock
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from benchmarks.common import run_benchmark
+from find_health_bar_aspect_ratio import count_hearts, count_hearts_array
+from oasis_library.actions import ACTION_DTYPE, BUTTON_KEYS, actions_to_dicts, actions_to_one_hot
+from oasis_library.capture import FRAME_HEIGHT, FRAME_WIDTH, new_frame, process_frame
+from oasis_library.ring_buffer import RingBuffer
+from oasis_library.utils import one_hot_actions
+
+SCREEN_WIDTH, SCREEN_HEIGHT = 1920, 1080
+RING_FRAMES = 400
+
+
+def random_actions(n, seed=0):
+    rng = np.random.default_rng(seed)
+    actions = np.zeros(n, dtype=ACTION_DTYPE)
+    for key in BUTTON_KEYS:
+        actions[key] = rng.random(n) < 0.1
+    actions["camera"] = rng.integers(0, 41, size=(n, 2))
+    return actions
+
+
+def random_screen(width, height, channels, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, size=(height, width, channels), dtype=np.uint8)
+
+
+def bench_actions(results, action_counts, warmup, repeat):
+    for n in action_counts:
+        actions = random_actions(n)
+        action_dicts = actions_to_dicts(actions)
+        run_benchmark(results, "actions", "one_hot_actions", lambda: one_hot_actions(action_dicts), {"actions": n}, "actions", warmup=warmup, repeat=repeat, items=n)
+        run_benchmark(results, "actions", "actions_to_one_hot", lambda: actions_to_one_hot(actions), {"actions": n}, "actions", warmup=warmup, repeat=repeat, items=n)
+
+
+def bench_hearts(results, batch_sizes, warmup, repeat):
+    screen = random_screen(SCREEN_WIDTH, SCREEN_HEIGHT, 3)
+    image = Image.fromarray(screen)
+    params = {"width": SCREEN_WIDTH, "height": SCREEN_HEIGHT}
+    run_benchmark(results, "hearts", "count_hearts", lambda: count_hearts(image), params, "frames", warmup=warmup, repeat=repeat)
+    run_benchmark(results, "hearts", "count_hearts_array", lambda: count_hearts_array(screen), params, "frames", warmup=warmup, repeat=repeat)
+    for batch in batch_sizes:
+        # what extract_health_timeline.py and build_dataset_index.py run on decoded video chunks
+        frames = np.stack([random_screen(FRAME_WIDTH, FRAME_HEIGHT, 3, seed) for seed in range(batch)])
+        params = {"width": FRAME_WIDTH, "height": FRAME_HEIGHT, "batch": batch}
+        run_benchmark(results, "hearts", "count_hearts_array", lambda: count_hearts_array(frames), params, "frames", warmup=warmup, repeat=repeat, items=batch)
+
+
+def bench_capture(results, warmup, repeat):
+    """
+    The recorder's per-frame work (oasis_library.capture.process_frame, what process_frames runs) on a
+    synthetic BGRA screenshot: heart count of the full-resolution shot, resize, and the frame and actions
+    row appended to the rings under a lock.
+    """
+    shot = random_screen(SCREEN_WIDTH, SCREEN_HEIGHT, 4)
+    action_row = random_actions(1)[0]
+    frame_buffer = RingBuffer(RING_FRAMES, np.uint8, (FRAME_HEIGHT, FRAME_WIDTH, 3))
+    action_buffer = RingBuffer(RING_FRAMES, ACTION_DTYPE)
+    resized = new_frame()
+    lock = Lock()
+
+    params = {"width": SCREEN_WIDTH, "height": SCREEN_HEIGHT}
+    run_benchmark(
+        results, "capture", "capture_process_frame", lambda: process_frame(shot, action_row, frame_buffer, action_buffer, resized, lock), params, "frames", warmup=warmup, repeat=repeat
+    )
+    run_benchmark(results, "capture", "capture_resize", lambda: cv2.resize(shot[:, :, :3], (FRAME_WIDTH, FRAME_HEIGHT), dst=resized), params, "frames", warmup=warmup, repeat=repeat)
@@ -0,0 +1,145 @@
+"""
+DiT, VAE and sampling loop benchmarks. The models are built with random weights (no checkpoints needed)
+on whatever device is given, so they also run on CPU-only machines.
+"""
+
+import torch
+from einops import rearrange
+
+from benchmarks.common import run_benchmark
+from oasis_library.dit import DiT, DiT_models
+from oasis_library.sampling import FrameSampler
+from oasis_library.utils import sigmoid_beta_schedule
+from oasis_library.vae import VAE_models, AutoencoderKL
+
+MAX_NOISE_LEVEL = 1000
+NOISE_ABS_MAX = 20
+STABILIZATION_LEVEL = 15
+NUM_ACTIONS = 25
+
+
+def build_models(device, size="full"):
+    """
+    Random-weight DiT and VAE. size="full" are the Oasis-500M / ViT-L-20 architectures, "tiny" keeps the
+    same input/output shapes with a fraction of the layers for quick smoke runs.
+    """
+    torch.manual_seed(0)
+    if size == "full":
+        model = DiT_models["DiT-S/2"]()
+        vae = VAE_models["vit-l-20-shallow-encoder"]()
+    else:
+        model = DiT(hidden_size=128, depth=2, num_heads=4)
+        vae = AutoencoderKL(16, input_height=360, input_width=640, patch_size=20, enc_dim=128, enc_depth=1, enc_heads=4, dec_dim=128, dec_depth=1, dec_heads=4)
+    return model.to(device).eval(), vae.to(device).eval()
+
+
+def autocast_for(device, dtype):
+    return torch.autocast(device.type, dtype=dtype, enabled=dtype != torch.float32)
+
+
+def latent_shape(model):
+    H, W = model.x_embedder.img_size
+    return model.in_channels, H, W
+
+
+def make_sampler(device, ddim_noise_steps, solver="ddim"):
+    betas = sigmoid_beta_schedule(MAX_NOISE_LEVEL).float().to(device)
+    alphas_cumprod = torch.cumprod(1.0 - betas, dim=0)
+    return FrameSampler(alphas_cumprod, ddim_noise_steps, solver, MAX_NOISE_LEVEL)
+
+
+@torch.inference_mode()
+def sample_next_frame(model, x, actions, sampler, dtype):
+    """
+    Same loop as generate_video.rollout / game.sample: the context frames x[:, :-1] are prefilled into a
+    kv cache once, then the new frame x[:, -1:] is denoised by the sampler on its own.
+    """
+    B, T = x.shape[:2]
+    kv_cache = model.new_kv_cache()
+    t_ctx = torch.full((B, T - 1), STABILIZATION_LEVEL - 1, dtype=torch.long, device=x.device)
+    with autocast_for(x.device, dtype):
+        model.prefill(x[:, :-1], t_ctx, kv_cache, actions[:, :-1])
+        x[:, -1:] = sampler.sample(model, x[:, -1:], actions[:, -1:], kv_cache, autocast_dtype=None)
+    return x
+
+
+def bench_dit(results, model, device, dtypes, contexts, batch_sizes, warmup, repeat):
+    C, H, W = latent_shape(model)
+    for dtype in dtypes:
+        for batch in batch_sizes:
+            for context in contexts:
+                params = {"context": context, "batch": batch, "dtype": str(dtype).split(".")[-1]}
+                x = torch.randn(batch, context, C, H, W, device=device)
+                t = torch.randint(0, MAX_NOISE_LEVEL, (batch, context), device=device)
+                actions = torch.rand(batch, context, NUM_ACTIONS, device=device)
+
+                # Whole window at once, like training and uncached sampling
+                @torch.inference_mode()
+                def forward():
+                    with autocast_for(device, dtype):
+                        model(x, t, actions)
+
+                run_benchmark(results, "dit", "dit_forward", forward, params, "frames", device, warmup, repeat, items=batch * context)
+
+                # One new frame on top of context - 1 cached frames, the inner step of the sampling loop
+                kv_cache = model.new_kv_cache()
+                with torch.inference_mode(), autocast_for(device, dtype):
+                    model.prefill(x[:, :-1], t[:, :-1], kv_cache, actions[:, :-1])
+
+                @torch.inference_mode()
+                def cached_step():
+                    with autocast_for(device, dtype):
+                        model(x[:, -1:], t[:, -1:], actions[:, -1:], kv_cache=kv_cache)
+
+                run_benchmark(results, "dit", "dit_cached_step", cached_step, params, "frames", device, warmup, repeat, items=batch)
+
+
+def bench_vae(results, vae, device, dtypes, batch_sizes, warmup, repeat):
+    for dtype in dtypes:
+        for batch in batch_sizes:
+            params = {"batch": batch, "dtype": str(dtype).split(".")[-1]}
+            frames = torch.rand(batch, 3, vae.input_height, vae.input_width, device=device) * 2 - 1
+            latents = torch.randn(batch, vae.seq_len, vae.latent_dim, device=device)
+
+            @torch.inference_mode()
+            def encode():
+                with autocast_for(device, dtype):
+                    vae.encode(frames).mean
+
+            @torch.inference_mode()
+            def decode():
+                with autocast_for(device, dtype):
+                    vae.decode(latents)
+
+            run_benchmark(results, "vae", "vae_encode", encode, params, "frames", device, warmup, repeat, items=batch)
+            run_benchmark(results, "vae", "vae_decode", decode, params, "frames", device, warmup, repeat, items=batch)
+
+
+def bench_sampling(results, model, vae, device, dtypes, contexts, batch_sizes, ddim_steps, solvers, warmup, repeat):
+    C, H, W = latent_shape(model)
+    for dtype in dtypes:
+        for batch in batch_sizes:
+            for context in contexts:
+                x = torch.randn(batch, context, C, H, W, device=device).clamp(-NOISE_ABS_MAX, NOISE_ABS_MAX)
+                actions = torch.rand(batch, context, NUM_ACTIONS, device=device)
+                for solver in solvers:
+                    for steps in ddim_steps:
+                        params = {"context": context, "batch": batch, "dtype": str(dtype).split(".")[-1], "ddim_steps": steps, "solver": solver}
+                        sampler = make_sampler(device, steps, solver)
+
+                        def next_frame():
+                            sample_next_frame(model, x.clone(), actions, sampler, dtype)
+
+                        run_benchmark(results, "sampling", "sample_frame", next_frame, params, "frames", device, warmup, repeat, items=batch)
+
+                # The whole step of an interactive loop: sample the frame, then decode it for display
+                steps = ddim_steps[-1]
+                params = {"context": context, "batch": batch, "dtype": str(dtype).split(".")[-1], "ddim_steps": steps}
+                sampler = make_sampler(device, steps)
+
+                def sample_and_decode():
+                    x_new = sample_next_frame(model, x.clone(), actions, sampler, dtype)
+                    with torch.inference_mode(), autocast_for(device, dtype):
+                        vae.decode(rearrange(x_new[:, -1:], "b t c h w -> (b t) (h w) c"))
+
+                run_benchmark(results, "sampling", "sample_and_decode", sample_and_decode, params, "frames", device, warmup, repeat, items=batch)
@@ -0,0 +1,116 @@
+"""
+Timing, result and baseline helpers shared by the benchmarks.
+
+Every benchmark produces one result keyed by a name that includes its parameters, e.g.
+"dit_forward[context=4,batch=1,dtype=float32]":
+    {"group": "dit", "params": {...}, "latency_ms": {"mean", "p50", "p95", "min"}, "repeat": n,
+     "throughput": items per second, "unit": what an item is}
+Results files hold {"environment": {...}, "results": {name: result}}; baselines are results files too.
+"""
+
+import datetime
+import json
+import platform
+import time
+
+import numpy as np
+import torch
+
+
+def synchronize(device):
+    if device is not None and device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def benchmark_name(name, **params):
+    return f"{name}[{','.join(f'{key}={value}' for key, value in params.items())}]"
+
+
+def measure(fn, device=None, warmup=2, repeat=10, items=1):
+    """
+    Calls fn() warmup times untimed and then repeat times, synchronizing device around every timed call so
+    queued cuda work is counted. items is how many units (frames, images, actions...) one call handles.
+    Returns (latency_ms dict, throughput in items/s).
+    """
+    for _ in range(warmup):
+        fn()
+    synchronize(device)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        synchronize(device)
+        times.append(time.perf_counter() - start)
+    times = np.array(times) * 1000
+    latency = {
+        "mean": float(times.mean()),
+        "p50": float(np.percentile(times, 50)),
+        "p95": float(np.percentile(times, 95)),
+        "min": float(times.min()),
+    }
+    return latency, items / (latency["p50"] / 1000)
+
+
+def run_benchmark(results, group, name, fn, params, unit, device=None, warmup=2, repeat=10, items=1):
+    key = benchmark_name(name, **params)
+    latency, throughput = measure(fn, device=device, warmup=warmup, repeat=repeat, items=items)
+    results[key] = {"group": group, "params": params, "latency_ms": latency, "repeat": repeat, "throughput": throughput, "unit": unit}
+    print(f"{key:<70} p50 {latency['p50']:10.3f} ms   p95 {latency['p95']:10.3f} ms   {throughput:12.1f} {unit}/s")
+    return results[key]
+
+
+def environment(device):
+    env = {
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "device": str(device),
+        "torch": torch.__version__,
+        "numpy": np.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "torch_threads": torch.get_num_threads(),
+    }
+    if device.type == "cuda":
+        env["device_name"] = torch.cuda.get_device_name(device)
+    return env
+
+
+def save_results(path, results, env):
+    with open(path, "w") as f:
+        json.dump({"environment": env, "results": results}, f, indent=1)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(results, baseline, tolerance=0.15):
+    """
+    Compares the p50 latency of every benchmark that is in both results and baseline["results"].
+    A benchmark regressed if it got more than tolerance (fraction) slower. Returns a list of
+    (name, baseline_ms, current_ms, ratio, status) with status "regressed", "improved" or "ok".
+    """
+    rows = []
+    for name, result in results.items():
+        if name not in baseline["results"]:
+            continue
+        baseline_ms = baseline["results"][name]["latency_ms"]["p50"]
+        current_ms = result["latency_ms"]["p50"]
+        ratio = current_ms / baseline_ms if baseline_ms > 0 else float("inf")
+        if ratio > 1 + tolerance:
+            status = "regressed"
+        elif ratio < 1 / (1 + tolerance):
+            status = "improved"
+        else:
+            status = "ok"
+        rows.append((name, baseline_ms, current_ms, ratio, status))
+    return rows
+
+
+def print_comparison(rows, baseline):
+    baseline_env = baseline.get("environment", {})
+    print(f"\nCompared against the baseline from {baseline_env.get('time', '?')} on {baseline_env.get('device_name', baseline_env.get('device', '?'))}:")
+    for name, baseline_ms, current_ms, ratio, status in rows:
+        marker = "⚠️ " if status == "regressed" else "   "
+        print(f"{marker}{name:<70} {baseline_ms:10.3f} -> {current_ms:10.3f} ms  x{ratio:5.2f}  {status}")
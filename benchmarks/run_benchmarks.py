@@ -0,0 +1,106 @@
+"""
+Runs the benchmark suite and writes the results to JSON, optionally comparing them against a stored
+baseline (a results file from an earlier run on the same machine).
+
+    python -m benchmarks.run_benchmarks                          # everything, on cuda if available
+    python -m benchmarks.run_benchmarks --quick --device cpu     # tiny models, small grid
+    python -m benchmarks.run_benchmarks --only sampling --ddim-steps 4,10,16 --solvers ddim,dpm++2m
+    python -m benchmarks.run_benchmarks --save-baseline          # store this run as benchmarks/baseline.json
+    python -m benchmarks.run_benchmarks --baseline benchmarks/baseline.json   # exits with 1 on a regression
+
+Groups: dit, vae, sampling (random-weight models) and actions, hearts, capture (synthetic inputs).
+"""
+import argparse
+import os
+import sys
+
+import torch
+
+from benchmarks.bench_data import bench_actions, bench_capture, bench_hearts
+from benchmarks.bench_model import bench_dit, bench_sampling, bench_vae, build_models
+from benchmarks.common import compare, environment, load_results, print_comparison, save_results
+
+GROUPS = ["dit", "vae", "sampling", "actions", "hearts", "capture"]
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+def int_list(value):
+    return [int(v) for v in value.split(",")]
+
+
+def main(args):
+    device = torch.device(args.device or ("cuda:0" if torch.cuda.is_available() else "cpu"))
+    if args.dtypes is None:
+        args.dtypes = "float16,bfloat16" if device.type == "cuda" else "float32,bfloat16"
+    dtypes = [getattr(torch, name) for name in args.dtypes.split(",")]
+    if args.quick:
+        args.model_size, args.contexts, args.batch_sizes, args.ddim_steps, args.repeat = "tiny", [1, 4], [1], [4], 3
+    groups = args.only.split(",") if args.only else GROUPS
+    for group in groups:
+        assert group in GROUPS, f"unknown benchmark group {group}, expected some of {GROUPS}"
+
+    env = environment(device)
+    env["model_size"] = args.model_size
+    print(f"Benchmarking {', '.join(groups)} on {env.get('device_name', device)} ({args.model_size} models)")
+
+    results = {}
+    if {"dit", "vae", "sampling"} & set(groups):
+        model, vae = build_models(device, args.model_size)
+        if "dit" in groups:
+            bench_dit(results, model, device, dtypes, args.contexts, args.batch_sizes, args.warmup, args.repeat)
+        if "vae" in groups:
+            bench_vae(results, vae, device, dtypes, args.batch_sizes, args.warmup, args.repeat)
+        if "sampling" in groups:
+            bench_sampling(results, model, vae, device, dtypes, args.contexts, args.batch_sizes, args.ddim_steps, args.solvers.split(","), args.warmup, args.repeat)
+        del model, vae
+    if "actions" in groups:
+        bench_actions(results, args.action_counts, args.warmup, args.repeat)
+    if "hearts" in groups:
+        bench_hearts(results, [64], args.warmup, args.repeat)
+    if "capture" in groups:
+        bench_capture(results, args.warmup, args.repeat)
+
+    save_results(args.output, results, env)
+    print(f"Results saved to {args.output}")
+    if args.save_baseline:
+        save_results(args.baseline or DEFAULT_BASELINE, results, env)
+        print(f"Baseline saved to {args.baseline or DEFAULT_BASELINE}")
+        return 0
+
+    baseline_path = args.baseline or DEFAULT_BASELINE
+    if not os.path.exists(baseline_path):
+        if args.baseline is not None:
+            print(f"⚠️ Baseline {baseline_path} not found, nothing to compare against.")
+        return 0
+    baseline = load_results(baseline_path)
+    if baseline.get("environment", {}).get("model_size") != args.model_size:
+        print(f"⚠️ Baseline was measured with {baseline.get('environment', {}).get('model_size')} models, not {args.model_size}.")
+    rows = compare(results, baseline, args.tolerance)
+    print_comparison(rows, baseline)
+    regressions = [row for row in rows if row[-1] == "regressed"]
+    if regressions:
+        print(f"⚠️ {len(regressions)} of {len(rows)} benchmarks are more than {args.tolerance:.0%} slower than the baseline.")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parse = argparse.ArgumentParser()
+    parse.add_argument("--device", type=str, default=None, help="defaults to cuda:0 if available, else cpu")
+    parse.add_argument("--only", type=str, default=None, help=f"comma separated groups out of {','.join(GROUPS)}")
+    parse.add_argument("--model-size", choices=["full", "tiny"], default="full", help="full Oasis-500M/ViT-L-20 architectures or tiny ones")
+    parse.add_argument("--dtypes", type=str, default=None, help="autocast dtypes, defaults to float16,bfloat16 on cuda and float32,bfloat16 on cpu")
+    parse.add_argument("--contexts", type=int_list, default=[1, 4, 16, 32], help="context lengths (frames in the window)")
+    parse.add_argument("--batch-sizes", type=int_list, default=[1, 4])
+    parse.add_argument("--ddim-steps", type=int_list, default=[4, 10, 16])
+    parse.add_argument("--solvers", type=str, default="ddim,dpm++2m", help="samplers of the sample_frame benchmark, see oasis_library/sampling.py")
+    parse.add_argument("--action-counts", type=int_list, default=[300, 6000], help="actions converted per call")
+    parse.add_argument("--warmup", type=int, default=2)
+    parse.add_argument("--repeat", type=int, default=10)
+    parse.add_argument("--quick", action="store_true", help="tiny models, contexts 1,4, batch 1, 4 DDIM steps, 3 repeats")
+    parse.add_argument("--output", type=str, default="bench_results.json")
+    parse.add_argument("--baseline", type=str, default=None, help=f"results file to compare against, defaults to {DEFAULT_BASELINE} if it exists")
+    parse.add_argument("--save-baseline", action="store_true", help="store this run as the baseline instead of comparing")
+    parse.add_argument("--tolerance", type=float, default=0.15, help="allowed slowdown of the p50 latency before a benchmark counts as regressed")
+    args = parse.parse_args()
+    sys.exit(main(args))
@@ -0,0 +1,73 @@
+"""
+Builds (or updates) the SQLite index of a training folder, see oasis_library/dataset_index.py.
+Every new or changed replay_*.mp4 is decoded once, in a process pool, to record its per-frame brightness
+and heart count; damage and death events are derived from the hearts. Point dataset_index_path in
+train.py at the output to sample segments from the index instead of probing every video.
+"""
+import argparse
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from tqdm import tqdm
+
+from extract_health_timeline import health_timeline
+from find_health_bar_aspect_ratio import count_hearts_array
+from oasis_library.actions import find_actions_file, load_actions_array
+from oasis_library.dataset_index import DatasetIndex
+from oasis_library.video_reader import iter_frames
+
+
+def scan_video(video_path, actions_path, batch_frames):
+    brightness = []
+    health = []
+    for chunk in iter_frames(video_path, batch_frames):
+        chunk = chunk.numpy()
+        brightness.append(chunk.mean(axis=(1, 2, 3), dtype=np.float32) / 255)
+        health.append(count_hearts_array(chunk))
+    brightness = np.concatenate(brightness) if brightness else np.zeros(0, dtype=np.float32)
+    health = np.concatenate(health).astype(np.uint8) if health else np.zeros(0, dtype=np.uint8)
+    num_actions = len(load_actions_array(actions_path)) if actions_path is not None else 0
+    timeline = health_timeline(health)
+    events = [(frame, "damage") for frame in timeline["damage"]] + [(frame, "death") for frame in timeline["deaths"]]
+    return video_path, actions_path, num_actions, brightness, health, events
+
+
+def main(args):
+    index_path = args.index or os.path.join(args.data_dir, "dataset_index.sqlite")
+    index = DatasetIndex(index_path)
+    removed = index.remove_missing()
+
+    todo = []
+    for video_path in sorted(glob.glob(os.path.join(args.data_dir, "replay_*.mp4"))):
+        video_id = os.path.basename(video_path).split("replay_")[1].split(".mp4")[0]
+        actions_path = find_actions_file(args.data_dir, video_id)
+        # a changed, added or removed actions file (e.g. convert_actions.py) re-indexes the video too
+        if args.overwrite or not index.is_current(video_path, actions_path):
+            todo.append((video_path, actions_path))
+
+    start_time = time.time()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(scan_video, video_path, actions_path, args.batch_frames) for video_path, actions_path in todo]
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Indexing videos"):
+            video_path, actions_path, num_actions, brightness, health, events = future.result()
+            if actions_path is None:
+                print(f"⚠️ {os.path.basename(video_path)}: missing actions file, indexed but never sampled.")
+            index.add_video(video_path, actions_path, num_actions, brightness, health, events)
+
+    total = len(index.videos(with_actions=False))
+    print(f"Indexed {len(todo)} new or changed videos, removed {removed}, {total} in {index_path} ({time.time() - start_time:.1f}s)")
+    index.close()
+
+
+if __name__ == "__main__":
+    parse = argparse.ArgumentParser()
+    parse.add_argument("--data-dir", type=str, default="training")
+    parse.add_argument("--index", type=str, default=None, help="defaults to <data-dir>/dataset_index.sqlite")
+    parse.add_argument("--workers", type=int, default=os.cpu_count())
+    parse.add_argument("--batch-frames", type=int, default=64, help="frames decoded at once")
+    parse.add_argument("--overwrite", action="store_true", help="re-index videos that did not change")
+    args = parse.parse_args()
+    main(args)
@@ -0,0 +1,43 @@
+"""
+Converts pickled action files (the recorder's actions_<id>.pt and VPT's *.actions.pt, lists of per-frame
+dicts) into the columnar .npy format of oasis_library/actions.py, next to the originals.
+Training and generate_video.py pick up the .npy files automatically.
+"""
+import argparse
+import glob
+import os
+import time
+
+from tqdm import tqdm
+
+from oasis_library.actions import convert_actions_file
+
+
+def main(args):
+    paths = []
+    for pattern in args.paths:
+        if os.path.isdir(pattern):
+            paths += sorted(glob.glob(os.path.join(pattern, "actions_*.pt")) + glob.glob(os.path.join(pattern, "*.actions.pt")))
+        else:
+            paths += sorted(glob.glob(pattern))
+
+    start_time = time.time()
+    converted = 0
+    for path in tqdm(paths, desc="Converting actions"):
+        output_path = path[: -len(".pt")] + ".npy"
+        if os.path.exists(output_path) and not args.overwrite:
+            continue
+        convert_actions_file(path, output_path)
+        converted += 1
+        if args.remove:
+            os.remove(path)
+    print(f"Converted {converted} of {len(paths)} action files in {time.time() - start_time:.1f}s")
+
+
+if __name__ == "__main__":
+    parse = argparse.ArgumentParser()
+    parse.add_argument("paths", nargs="+", help="action files, glob patterns or folders (e.g. training)")
+    parse.add_argument("--overwrite", action="store_true", help="re-convert files that already have a .npy")
+    parse.add_argument("--remove", action="store_true", help="delete the .pt files after converting them")
+    args = parse.parse_args()
+    main(args)
@@ -0,0 +1,109 @@
+"""
+Labels existing gameplay videos with the player's health.
+
+Every frame of every mp4 goes through the same heart counter the recorder uses (count_hearts_array, 20
+pixels per frame at precomputed coordinates, a whole batch of frames at a time), with one video per worker
+process. The result is one JSON index with a compact timeline per video:
+    {
+        "replay_20250407_210153.mp4": {
+            "frames": 300,
+            "health": [[0, 20], [212, 14], [250, 0]],   # run-length encoded: [first frame, hearts]
+            "damage": [212, 250],                       # frames where health dropped
+            "deaths": [250]                             # frames where health dropped to 0
+        },
+        ...
+    }
+Damage and deaths follow the same rules as player_taking_damage in minecraft_recording.py.
+"""
+import argparse
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from tqdm import tqdm
+
+from find_health_bar_aspect_ratio import count_hearts_array
+from oasis_library.video_reader import iter_frames
+
+
+def health_per_frame(video_path, batch_frames=64):
+    """
+    (N,) uint8 heart count of every frame of a video.
+    """
+    health = [count_hearts_array(chunk.numpy()) for chunk in iter_frames(video_path, batch_frames)]
+    if not health:
+        return np.zeros(0, dtype=np.uint8)
+    return np.concatenate(health).astype(np.uint8)
+
+
+def health_timeline(health):
+    change = np.flatnonzero(health[1:] != health[:-1]) + 1
+    starts = np.concatenate([[0], change]) if len(health) else np.zeros(0, dtype=np.int64)
+    damage = np.flatnonzero(health[1:] < health[:-1]) + 1
+    deaths = np.flatnonzero((health[1:] == 0) & (health[:-1] > 0)) + 1
+    return {
+        "frames": int(len(health)),
+        "health": [[int(start), int(health[start])] for start in starts],
+        "damage": damage.tolist(),
+        "deaths": deaths.tolist(),
+    }
+
+
+def expand_health(timeline):
+    """
+    Inverse of the run-length encoding: (frames,) uint8 heart count per frame.
+    """
+    health = np.zeros(timeline["frames"], dtype=np.uint8)
+    for start, hearts in timeline["health"]:
+        health[start:] = hearts
+    return health
+
+
+def load_health_timeline(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _process_video(video_path, batch_frames):
+    return video_path, health_timeline(health_per_frame(video_path, batch_frames))
+
+
+def main(args):
+    video_paths = []
+    for pattern in args.paths:
+        if os.path.isdir(pattern):
+            video_paths += sorted(glob.glob(os.path.join(pattern, "*.mp4")))
+        else:
+            video_paths += sorted(glob.glob(pattern))
+    output = args.output or os.path.join(os.path.dirname(video_paths[0]) if video_paths else ".", "health_timeline.json")
+
+    timelines = load_health_timeline(output) if os.path.exists(output) and not args.overwrite else {}
+    todo = [path for path in video_paths if os.path.basename(path) not in timelines]
+
+    start_time = time.time()
+    total_frames = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(_process_video, path, args.batch_frames) for path in todo]
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Labelling videos"):
+            video_path, timeline = future.result()
+            timelines[os.path.basename(video_path)] = timeline
+            total_frames += timeline["frames"]
+
+    with open(output, "w") as f:
+        json.dump(timelines, f)
+    elapsed = time.time() - start_time
+    print(f"Labelled {len(todo)} videos ({total_frames} frames, {total_frames / max(elapsed, 1e-9):.0f} frames/s) into {output}")
+
+
+if __name__ == "__main__":
+    parse = argparse.ArgumentParser()
+    parse.add_argument("paths", nargs="+", help="mp4 files, glob patterns or folders")
+    parse.add_argument("--output", type=str, default=None, help="defaults to health_timeline.json next to the videos")
+    parse.add_argument("--workers", type=int, default=os.cpu_count())
+    parse.add_argument("--batch-frames", type=int, default=64, help="frames decoded and labelled at once")
+    parse.add_argument("--overwrite", action="store_true", help="relabel videos already in the output index")
+    args = parse.parse_args()
+    main(args)
@@ -1,6 +1,13 @@
 #import tkinter as tk
 #import os
 #from PIL import Image
+from functools import lru_cache
+import numpy as np
+
+# Native UI resolution (480x270), the health bar position scales with height / NATIVE_HEIGHT
+NATIVE_WIDTH = 480
+NATIVE_HEIGHT = 270
+HEART_SAMPLES = 20
 
 # Paths
 #input_folder = "./screenshots"
@@ -18,9 +25,7 @@ def count_hearts(img):
     """
     width, height = img.size
     
-    # Compute scale factor based on native UI resolution (480x270)
-    NATIVE_WIDTH = 480
-    NATIVE_HEIGHT = 270
+    # Compute scale factor based on native UI resolution
     scale_factor = height / NATIVE_HEIGHT
 
     # Health bar position in Minecraft's native resolution
@@ -50,6 +55,36 @@ def count_hearts(img):
 
     return heart_count
 
+
+@lru_cache(maxsize=16)
+def heart_sample_coords(width, height):
+    """
+    (ys, xs) full-image pixel coordinates of the 20 health bar samples count_hearts looks at, for a
+    width x height screen. Computed once per resolution.
+    """
+    scale_factor = height / NATIVE_HEIGHT
+    health_bar_x_start = int((width // 2) - 91 * scale_factor)
+    health_bar_y = int(height - 32 * scale_factor)
+    health_bar_width = int(81 * scale_factor)
+    health_bar_height = int(9 * scale_factor)
+    y_sample = health_bar_y - health_bar_height + int(4 * health_bar_height / 9)
+    xs = np.array([health_bar_x_start + int(i * health_bar_width / 20 + health_bar_width / 40) for i in range(HEART_SAMPLES)])
+    ys = np.full(HEART_SAMPLES, y_sample)
+    return ys, xs
+
+
+def count_hearts_array(img, channels=(0, 1, 2)):
+    """
+    Vectorized count_hearts for numpy images: (H, W, C) -> int, or a batch (N, H, W, C) -> (N,) array.
+    channels gives the positions of r, g and b, e.g. (2, 1, 0) for BGR(A) screenshots from mss or cv2.
+    """
+    height, width = img.shape[-3:-1]
+    ys, xs = heart_sample_coords(width, height)
+    pixels = img[..., ys, xs, :].astype(np.int16)  # (..., 20, C)
+    r, g, b = (pixels[..., c] for c in channels)
+    hearts = ((r > 150) & (g < 100) & (b < 100)).sum(axis=-1)
+    return int(hearts) if hearts.ndim == 0 else hearts
+
 # Process all images
 """
 for filename in os.listdir(input_folder):
@@ -1,4 +1,12 @@
+import argparse
+import os
+import queue
+import sys
 import time
+import traceback
+from collections import deque
+from contextlib import nullcontext
+from threading import Event, Lock, Thread
 from typing import Tuple
 
 import torch
@@ -7,21 +15,38 @@ torch._dynamo.config.suppress_errors = True
 
 from oasis_library.dit import DiT_models
 from oasis_library.vae import VAE_models
-from torchvision.io import read_video
-from oasis_library.utils import sigmoid_beta_schedule
+from oasis_library.video_reader import read_frames
+from oasis_library.utils import load_actions, sigmoid_beta_schedule
+from oasis_library.sampling import FrameSampler
+from oasis_library.session import WorldModelSession
+from oasis_library.telemetry import FrameTelemetry
 from einops import rearrange
-from torch import autocast
-import pygame
 import numpy as np
-
-assert torch.cuda.is_available()
-device = "cuda:0"
+import av
+from PIL import Image
+
+# cuda runs the models in fp16 with sampling and decoding on their own streams, the CPU fallback (slow, but
+# enough for --headless smoke tests) runs them in fp32 on plain worker threads
+device = "cuda:0" if torch.cuda.is_available() else "cpu"
+model_dtype = torch.half if device != "cpu" else torch.float
+
+# --headless runs the same sampling loop without a window or live input, for load tests and profiling:
+#   python game.py --headless --actions-path run.actions.npy --output frames.mp4
+parse = argparse.ArgumentParser()
+parse.add_argument("--headless", action="store_true", help="no window or live input, actions come from --actions-path")
+parse.add_argument("--actions-path", type=str, default=None, help="*.actions.pt, *.actions.npy or *.one_hot_actions.pt action stream for --headless")
+parse.add_argument("--num-frames", type=int, default=None, help="frames generated with --headless, defaults to the length of the action stream")
+parse.add_argument("--output", type=str, default=None, help="--headless output: a .mp4 file, a folder for PNG frames, or nothing to drop the frames")
+parse.add_argument("--fps", type=int, default=20, help="frame rate of the --output video")
+parse.add_argument("--warmup-frames", type=int, default=10, help="first frames left out of the sustained FPS (compilation, autotuning)")
+args, _ = parse.parse_known_args()
 # Sampling params
 model_path = "oasis500m.pt"
 vae_path = "vit-l-20.pt"
 B = 1
 max_noise_level = 1000
-ddim_noise_steps = 16
+ddim_noise_steps = 16  # model calls per frame, +/- in game
+sampler_solver = "ddim"  # or "dpm++2m", which needs fewer steps, see oasis_library/sampling.py
 noise_abs_max = 20
 enable_torch_compile_model = True
 enable_torch_compile_vae = True
@@ -35,6 +60,13 @@ video_id = "snippy-chartreuse-mastiff-f79998db196d-20220401-224517.chunk_001"
 stabilization_level = 15
 screen_width = 1024  # Adjust as needed
 screen_height = 1024  # Adjust as needed
+# Per-stage latency: rolling percentiles over the last telemetry_window frames (F5 toggles the overlay),
+# every frame is written to <telemetry_output>.csv/.json on exit
+telemetry_window = 300
+telemetry_output = "game_telemetry"
+# How often per second the window polls input and checks for a new frame; frames themselves come as fast
+# as the slowest pipeline stage allows
+input_poll_rate = 240
 
 # Define ACTION_KEYS
 ACTION_KEYS = [
@@ -157,116 +189,56 @@ def action_to_tensor(action):
     return actions_one_hot
 
 
-# Initialize pygame
-pygame.init()
-pygame.mouse.set_visible(True)
-pygame.event.set_grab(False)
+if not args.headless:
+    # Only the interactive window needs pygame, so headless boxes don't have to install it
+    import pygame
+
+    # Initialize pygame
+    pygame.init()
+    pygame.mouse.set_visible(True)
+    pygame.event.set_grab(False)
 
-# Set up display
-screen = pygame.display.set_mode((screen_width, screen_height))
-pygame.display.set_caption("Generated Video")
+    # Set up display
+    screen = pygame.display.set_mode((screen_width, screen_height))
+    pygame.display.set_caption("Generated Video")
 
 # Load DiT checkpoint
 ckpt = torch.load(model_path)
 model = DiT_models["DiT-S/2"]()
 model.load_state_dict(ckpt, strict=False)
-model = model.to(device).half().eval()
+model = model.to(device, model_dtype).eval()
 
 # Load VAE checkpoint
 vae_ckpt = torch.load(vae_path)
 vae = VAE_models["vit-l-20-shallow-encoder"]()
 vae.load_state_dict(vae_ckpt)
-vae = vae.to(device).half().eval()
+vae = vae.to(device, model_dtype).eval()
 
-noise_range = torch.linspace(-1, max_noise_level - 1, ddim_noise_steps + 1).to(device)
 ctx_max_noise_idx = ddim_noise_steps // 10 * 3
 
+# The model and VAE are called from the pipeline's worker threads on their own streams, which cudagraph
+# trees (mode='reduce-overhead') don't support, so compile without cuda graphs
 if enable_torch_compile_model:
     # Optional compilation for performance
-    model = torch.compile(model, mode='reduce-overhead')
+    model = torch.compile(model, mode='max-autotune-no-cudagraphs')
 if enable_torch_compile_vae:
-    vae = torch.compile(vae, mode='reduce-overhead')
+    vae = torch.compile(vae, mode='max-autotune-no-cudagraphs')
 
 
 mp4_path = f"sample_data/{video_id}.mp4"
-video = read_video(mp4_path, pts_unit="sec")[0].float() / 255
-
-video = video[offset:]
+# only the prompt frames are needed
+video = read_frames(mp4_path, offset, offset + n_prompt_frames).float() / 255
 
-# Initialize action list
 def reset():
-    global x
-    global actions_list
-    x = encode(video, vae)
-    # Initialize with initial action (assumed zero action)
-    actions_list = []
-    initial_action = torch.zeros(len(ACTION_KEYS), device=device).unsqueeze(0)
-    for i in range(n_prompt_frames - 1):
-        actions_list.append(initial_action)
-
-
-@torch.inference_mode
-def sample(x, actions_tensor, ddim_noise_steps, stabilization_level, alphas_cumprod, noise_range, noise_abs_max, model):
-    """
-    Sample function with constant alpha_next and stabilization_level implemented.
-
-    Args:
-        x (torch.Tensor): Current latent tensor of shape [B, T, C, H, W].
-        actions_tensor (torch.Tensor): Actions tensor of shape [B, T, num_actions].
-        ddim_noise_steps (int): Number of DDIM noise steps.
-        stabilization_level (int): Level to stabilize the initial frames.
-        alphas_cumprod (torch.Tensor): Cumulative product of alphas for each timestep.
-        noise_range (torch.Tensor): Noise schedule tensor.
-        noise_abs_max (float): Maximum absolute noise value.
-        model (torch.nn.Module): The diffusion model.
-
-    Returns:
-        torch.Tensor: Updated latent tensor after sampling.
-    """
-    B, context_length, C, H, W = x.shape
-
-    for noise_idx in reversed(range(1, ddim_noise_steps + 1)):
-        # Set up noise values
-        t_ctx = torch.full((B, context_length - 1), stabilization_level - 1, dtype=torch.long, device=device)
-        t = torch.full((B, 1), noise_range[noise_idx], dtype=torch.long, device=device)
-        t_next = torch.full((B, 1), noise_range[noise_idx - 1], dtype=torch.long, device=device)
-        t_next = torch.where(t_next < 0, t, t_next)
-        t = torch.cat([t_ctx, t], dim=1)
-        t_next = torch.cat([t_ctx, t_next], dim=1)
-
-        # Get model predictions
-        with autocast("cuda", dtype=torch.half):
-            v = model(x, t, actions_tensor)
-
-        # Compute x_start and x_noise
-        x_start = alphas_cumprod[t].sqrt() * x - (1 - alphas_cumprod[t]).sqrt() * v
-        x_noise = ((1 / alphas_cumprod[t]).sqrt() * x - x_start) / (1 / alphas_cumprod[t] - 1).sqrt()
-
-        # Compute alpha_next with constant values for context frames
-        alpha_next = alphas_cumprod[t_next].clone()
-        alpha_next[:, :-1] = torch.ones_like(alpha_next[:, :-1])
-
-        # Ensure the last frame has alpha_next set to 1 if it's the first noise step
-        if noise_idx == 1:
-            alpha_next[:, -1:] = torch.ones_like(alpha_next[:, -1:])
-
-        # Compute the predicted x
-        x_pred = alpha_next.sqrt() * x_start + x_noise * (1 - alpha_next).sqrt()
-
-        # Update only the last frame in the latent tensor
-        x[:, -1:] = x_pred[:, -1:]
-
-        # Optionally clamp the noise to maintain stability
-        x[:, -1:] = torch.clamp(x[:, -1:], -noise_abs_max, noise_abs_max)
-
-    return x
+    # New rollout from the prompt frames, with zero actions
+    session.reset(encode(video, vae))
 
 
 @torch.inference_mode
 def encode(video, vae):
     x = video[:n_prompt_frames].unsqueeze(0).to(device)
     # VAE encoding
-    x = rearrange(x, "b t h w c -> (b t) c h w").half()
+    x = rearrange(x, "b t h w c -> (b t) c h w").to(model_dtype)
     H, W = x.shape[-2:]
     with torch.no_grad():
         x = vae.encode(x * 2 - 1).mean * scaling_factor
@@ -274,38 +246,333 @@ def encode(video, vae):
     return x
 
 @torch.inference_mode
-def decode(x, vae):
-    # VAE decoding of the last frame
-    x_last = x[:, -1:]
-    x_last = rearrange(x_last, "b t c h w -> (b t) (h w) c").half()
+def decode(x_last, vae):
+    # VAE decoding of one [1, 1, C, H, W] latent frame, the uint8 [H, W, 3] frame stays on the device
+    x_last = rearrange(x_last, "b t c h w -> (b t) (h w) c").to(model_dtype)
     with torch.no_grad():
         x_decoded = (vae.decode(x_last / scaling_factor) + 1) / 2
     x_decoded = rearrange(x_decoded, "(b t) c h w -> b t h w c", b=1, t=1)
     x_decoded = torch.clamp(x_decoded, 0, 1)
-    x_decoded = (x_decoded * 255).byte().cpu().numpy()
-    frame = x_decoded[0, 0]
+    frame = (x_decoded * 255).byte()[0, 0]
     return frame
 
+class InputState:
+    """
+    Live input shared between the pygame thread, which polls it on every pass of its loop, and the sampling
+    thread, which takes one action per frame. Keys and buttons are the state at the last poll, mouse movement
+    adds up between takes, and every take comes with the time of the oldest poll folded into it, so the
+    display can measure input-to-photon latency.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.updated = Event()
+        self.action = None
+        self.mouse_rel = [0, 0]
+        self.timestamp = None
+
+    def update(self, action, mouse_rel):
+        with self.lock:
+            self.action = action
+            self.mouse_rel[0] += mouse_rel[0]
+            self.mouse_rel[1] += mouse_rel[1]
+            if self.timestamp is None:
+                self.timestamp = time.perf_counter()
+        self.updated.set()
+
+    def take(self):
+        # only blocks until the first poll
+        self.updated.wait()
+        with self.lock:
+            action = dict(self.action)
+            action["camera"] = (self.mouse_rel[1] / 4, self.mouse_rel[0] / 4)
+            timestamp = self.timestamp if self.timestamp is not None else time.perf_counter()
+            self.mouse_rel = [0, 0]
+            self.timestamp = None
+        return action_to_tensor(action).unsqueeze(0), timestamp
+
+
+class FramePipeline:
+    """
+    Sampling and decoding on their own threads, so frame N is decoded (and displayed or written by whoever
+    reads `frames`) while frame N+1 is already being denoised. On cuda each thread queues its work on its
+    own stream, on CPU the two threads share the intra-op thread pool. The queues between the stages are
+    bounded, so a fast stage waits for the slow one and throughput ends up at the cost of the slowest
+    stage instead of the sum of all of them.
+
+    take_action() is called by the sampling thread once per frame and returns ([1, num_actions] action,
+    input timestamp), or (None, None) to finish. `frames` yields (uint8 [H, W, 3] numpy frame, input
+    timestamp) in order and None after the last frame. The frame's memory is reused max_pending + 2 frames
+    later, so copy it if it has to live longer than that.
+    """
+
+    def __init__(self, take_action, max_pending=2):
+        self.take_action = take_action
+        self.latents = queue.Queue(maxsize=max_pending)  # sampled latents waiting for the decoder
+        self.frames = queue.Queue(maxsize=max_pending)  # decoded frames waiting to be shown or written
+        self.stopping = Event()
+        self.reset_requested = Event()
+        self.error = None
+        on_cuda = torch.device(device).type == "cuda"
+        self.sample_stream = torch.cuda.Stream(device) if on_cuda else None
+        self.decode_stream = torch.cuda.Stream(device) if on_cuda else None
+        # host buffers the decoded frames are copied into: one per queue slot, plus the frame being
+        # copied and the one the consumer is still holding
+        self.host_frames = [None] * (max_pending + 2)
+        self.sample_telemetry = FrameTelemetry(["action", "sample"], window=telemetry_window, device=device, frame_label="sampler")
+        self.decode_telemetry = FrameTelemetry(["decode", "copy"], window=telemetry_window, device=device, frame_label="decoder")
+        self.threads = [Thread(target=self._run, args=(self._sample_loop, self.latents), daemon=True),
+                        Thread(target=self._run, args=(self._decode_loop, self.frames), daemon=True)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        for thread in self.threads:
+            thread.join()
+
+    def request_reset(self):
+        # the context is only touched by the sampling thread, which resets it before its next frame
+        self.reset_requested.set()
+
+    def check(self):
+        if self.error is not None:
+            raise RuntimeError("frame pipeline worker failed") from self.error
+
+    def _put(self, q, item):
+        # a blocking put that gives up once the pipeline is stopped
+        while not self.stopping.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, q):
+        while not self.stopping.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
+
+    def _run(self, loop, output):
+        try:
+            loop()
+        except Exception as e:
+            self.error = e
+            traceback.print_exc()
+        self._put(output, None)  # tells the next stage there is nothing more
+
+    def _stream(self, stream):
+        return torch.cuda.stream(stream) if stream is not None else nullcontext()
+
+    def _sample_loop(self):
+        if self.sample_stream is not None:
+            # the prompt was encoded on the default stream
+            self.sample_stream.wait_stream(torch.cuda.current_stream(device))
+        with self._stream(self.sample_stream):
+            self.sample_telemetry.start()
+            while not self.stopping.is_set():
+                if self.reset_requested.is_set():
+                    self.reset_requested.clear()
+                    reset()
+                actions_curr, timestamp = self.take_action()
+                if actions_curr is None:
+                    return
+                self.sample_telemetry.lap("action")
+                # read once, the display thread may swap in a new schedule at any time
+                steps, session.sampler = schedule
+                latent = session.step_latent(actions_curr)
+                done = None
+                if self.sample_stream is not None:
+                    latent.record_stream(self.decode_stream)
+                    done = torch.cuda.Event()
+                    done.record(self.sample_stream)
+                self.sample_telemetry.lap("sample")
+                self.sample_telemetry.end_frame(ddim_noise_steps=steps, context=min(session.count, session.window))
+                if not self._put(self.latents, (latent, done, timestamp)):
+                    return
+
+    def _decode_loop(self):
+        with self._stream(self.decode_stream):
+            self.decode_telemetry.start()
+            slot = 0
+            while True:
+                item = self._get(self.latents)
+                if item is None:
+                    return
+                latent, done, timestamp = item
+                if done is not None:
+                    self.decode_stream.wait_event(done)
+                frame = decode(latent, vae)
+                self.decode_telemetry.lap("decode")
+                if self.decode_stream is not None:
+                    if self.host_frames[slot] is None:
+                        self.host_frames[slot] = torch.empty(frame.shape, dtype=frame.dtype, pin_memory=True)
+                    host_frame = self.host_frames[slot]
+                    host_frame.copy_(frame, non_blocking=True)
+                    # only this thread waits for the copy, sampling keeps going on its stream
+                    self.decode_stream.synchronize()
+                    slot = (slot + 1) % len(self.host_frames)
+                else:
+                    host_frame = frame
+                self.decode_telemetry.lap("copy")
+                self.decode_telemetry.end_frame()
+                if not self._put(self.frames, (host_frame.numpy(), timestamp)):
+                    return
+
+    def telemetry_lines(self):
+        return self.sample_telemetry.overlay_lines(header=False) + self.decode_telemetry.overlay_lines(header=False)
+
+    def export_telemetry(self, prefix):
+        self.sample_telemetry.export(f"{prefix}_sampler")
+        self.decode_telemetry.export(f"{prefix}_decoder")
+
+
+class FrameSink:
+    """
+    Where --headless frames go: an mp4 file, numbered PNGs in a folder, or nowhere.
+    """
+
+    def __init__(self, path, fps):
+        self.path = path
+        self.count = 0
+        self.container = None
+        if path is not None and path.endswith(".mp4"):
+            self.container = av.open(path, mode="w")
+            self.stream = self.container.add_stream("mpeg4", rate=fps)
+            self.stream.pix_fmt = "yuv420p"
+        elif path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    def write(self, frame):
+        if self.container is not None:
+            if self.count == 0:
+                self.stream.height, self.stream.width = frame.shape[:2]
+            for packet in self.stream.encode(av.VideoFrame.from_ndarray(frame, format="rgb24")):
+                self.container.mux(packet)
+        elif self.path is not None:
+            Image.fromarray(frame).save(os.path.join(self.path, f"frame_{self.count:06d}.png"))
+        self.count += 1
+
+    def close(self):
+        if self.container is not None:
+            for packet in self.stream.encode():
+                self.container.mux(packet)
+            self.container.close()
+        if self.path is not None:
+            print(f"{self.count} frames saved to {self.path}")
+
+
+def run_headless():
+    """
+    The frame pipeline without pygame: one frame per row of the recorded action stream, as fast as it goes.
+    """
+    assert args.actions_path is not None, "--headless needs --actions-path"
+    # same loader and alignment as generate_video.py: a zero action is prepended so action i belongs to frame i,
+    # the prompt frames take the first n_prompt_frames actions and the generated ones the rest
+    actions = load_actions(args.actions_path, action_offset=offset, prepend_zero=True)[0].to(device)
+    session.reset(encode(video, vae), actions[:n_prompt_frames].unsqueeze(0))
+    actions = actions[n_prompt_frames:]
+    num_frames = min(args.num_frames or len(actions), len(actions))
+    next_action = iter(range(num_frames))
+
+    def take_action():
+        i = next(next_action, None)
+        if i is None:
+            return None, None
+        return actions[i].unsqueeze(0), time.perf_counter()
+
+    sink = FrameSink(args.output, args.fps)
+    pipeline = FramePipeline(take_action)
+    telemetry = FrameTelemetry(["wait", "write", "latency"], window=telemetry_window, device=device, frame_label="writer")
+    print(f"Generating {num_frames} frames headless from {args.actions_path}...")
+
+    start_time = time.perf_counter()
+    sustained_start = None
+    written = 0
+    pipeline.start()
+    telemetry.start()
+    try:
+        while written < num_frames:
+            item = pipeline.frames.get()
+            if item is None:
+                break
+            if written == args.warmup_frames:
+                sustained_start = time.perf_counter()
+            frame, input_time = item
+            telemetry.lap("wait")
+            sink.write(frame)
+            telemetry.lap("write")
+            # from taking the action to the frame being written
+            telemetry.record("latency", time.perf_counter() - input_time)
+            telemetry.end_frame()
+            written += 1
+    finally:
+        pipeline.stop()
+    pipeline.check()
+    end_time = time.perf_counter()
+    sink.close()
+
+    if written < num_frames:
+        print(f"⚠️ The pipeline stopped after {written} of {num_frames} frames.")
+    print(f"{written} frames in {end_time - start_time:.1f}s ({written / (end_time - start_time):.2f} FPS overall)")
+    if sustained_start is not None and written > args.warmup_frames:
+        sustained = written - args.warmup_frames
+        print(f"Sustained: {sustained / (end_time - sustained_start):.2f} FPS over the last {sustained} frames")
+    else:
+        print(f"⚠️ Only {written} frames, not more than --warmup-frames={args.warmup_frames}, no sustained FPS.")
+    for line in telemetry.overlay_lines() + pipeline.telemetry_lines():
+        print(line)
+    telemetry.export(telemetry_output)
+    pipeline.export_telemetry(telemetry_output)
 
-reset()
 
 # Get alphas
 betas = sigmoid_beta_schedule(max_noise_level).to(device)
 alphas = 1.0 - betas
 alphas_cumprod = torch.cumprod(alphas, dim=0)
 alphas_cumprod = rearrange(alphas_cumprod, "T -> T 1 1 1")
+# what the sampling thread reads, swapped as a whole so it never sees a new step count with an old sampler
+schedule = (ddim_noise_steps, FrameSampler(alphas_cumprod, ddim_noise_steps, sampler_solver, max_noise_level))
+# The latent and action history of the rollout, in preallocated buffers on the device
+session = WorldModelSession(
+    model,
+    schedule[1],
+    vae,
+    context_window=context_window_size,
+    batch_size=B,
+    device=device,
+    stabilization_level=stabilization_level,
+    noise_abs_max=noise_abs_max,
+    clamp_steps=True,
+    scaling_factor=scaling_factor,
+)
+reset()
+
+if args.headless:
+    run_headless()
+    sys.exit()
 
 # Initialize Pygame font for FPS and adjustment info
 pygame.font.init()
 font_size = 24
 font = pygame.font.SysFont('Arial', font_size)
+telemetry_font = pygame.font.SysFont('monospace', 18)  # the latency table needs aligned columns
 
 # Initialize clock
 clock = pygame.time.Clock()
 
 # Initialize variables for FPS measurement
-frame_times = []  # List to store timestamps of recent frames
+frame_times = deque()  # Timestamps of the frames of the last second
 fps = 0.0
+# This thread only polls input and shows frames, sampling and decoding run in the pipeline's threads
+telemetry = FrameTelemetry(["input", "display", "tick", "latency"], window=telemetry_window, device=device, frame_label="shown")
+show_telemetry = False
 
 # Initialize variables for displaying adjustment info
 adjustment_message = ""
@@ -321,137 +588,152 @@ mouse_captured = False  # Initially not captured
 center_pos = (screen_width // 2, screen_height // 2)
 pygame.mouse.set_pos(center_pos)
 
-reset_context = False
-while running:
-    current_time = time.time()
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-
-        elif event.type == pygame.KEYDOWN:
-            if event.key == pygame.K_F2:
-                if mouse_captured:
-                    # Release the mouse
-                    pygame.mouse.set_visible(True)
-                    pygame.event.set_grab(False)
-                    mouse_captured = False
-                    print("Mouse released.")
-                else:
-                    # Capture the mouse
+input_state = InputState()
+pipeline = FramePipeline(input_state.take)
+pipeline.start()
+telemetry.start()
+try:
+    while running:
+        current_time = time.time()
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_F2:
+                    if mouse_captured:
+                        # Release the mouse
+                        pygame.mouse.set_visible(True)
+                        pygame.event.set_grab(False)
+                        mouse_captured = False
+                        print("Mouse released.")
+                    else:
+                        # Capture the mouse
+                        pygame.mouse.set_visible(False)
+                        pygame.event.set_grab(True)
+                        mouse_captured = True
+                        pygame.mouse.set_pos(center_pos)  # Reset to center
+                        pygame.mouse.get_rel()  # Reset relative movement
+                        print("Mouse captured.")
+
+                elif event.key == pygame.K_F3:
+                    # Toggle FPS display
+                    show_fps = not show_fps
+                    print(f"FPS display toggled to {'ON' if show_fps else 'OFF'}.")
+                elif event.key == pygame.K_F4:
+                    # Reset Context, done by the sampling thread before its next frame
+                    pipeline.request_reset()
+                elif event.key == pygame.K_F5:
+                    # Toggle the per-stage latency overlay
+                    show_telemetry = not show_telemetry
+                    print(f"Latency overlay toggled to {'ON' if show_telemetry else 'OFF'}.")
+
+                # Handle '+' and '-' key presses to adjust ddim_noise_steps
+                elif event.key in [pygame.K_PLUS, pygame.K_EQUALS]:
+                    ddim_noise_steps += 1
+                    if ddim_noise_steps > 100:  # Set an upper limit if desired
+                        ddim_noise_steps = 100
+                    # Update the sampler and ctx_max_noise_idx
+                    ctx_max_noise_idx = ddim_noise_steps // 10 * 3
+                    schedule = (ddim_noise_steps, FrameSampler(alphas_cumprod, ddim_noise_steps, sampler_solver, max_noise_level))
+                    adjustment_message = f"ddim_noise_steps: {ddim_noise_steps}"
+                    adjustment_display_time = current_time + 2  # Display for 2 seconds
+                    print(adjustment_message)
+
+                elif event.key in [pygame.K_MINUS, pygame.K_UNDERSCORE]:
+                    ddim_noise_steps -= 1
+                    if ddim_noise_steps < 1:
+                        ddim_noise_steps = 1
+                    # Update the sampler and ctx_max_noise_idx
+                    ctx_max_noise_idx = ddim_noise_steps // 10 * 3
+                    schedule = (ddim_noise_steps, FrameSampler(alphas_cumprod, ddim_noise_steps, sampler_solver, max_noise_level))
+                    adjustment_message = f"ddim_noise_steps: {ddim_noise_steps}"
+                    adjustment_display_time = current_time + 2  # Display for 2 seconds
+                    print(adjustment_message)
+
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                if not mouse_captured:
+                    # Capture the mouse on mouse click if it's not already captured
                     pygame.mouse.set_visible(False)
                     pygame.event.set_grab(True)
                     mouse_captured = True
                     pygame.mouse.set_pos(center_pos)  # Reset to center
                     pygame.mouse.get_rel()  # Reset relative movement
-                    print("Mouse captured.")
-
-            elif event.key == pygame.K_F3:
-                # Toggle FPS display
-                show_fps = not show_fps
-                print(f"FPS display toggled to {'ON' if show_fps else 'OFF'}.")
-            elif event.key == pygame.K_F4:
-                # Reset Context
-                reset()
-                reset_context = True
-
-            # Handle '+' and '-' key presses to adjust ddim_noise_steps
-            elif event.key in [pygame.K_PLUS, pygame.K_EQUALS]:
-                ddim_noise_steps += 1
-                if ddim_noise_steps > 100:  # Set an upper limit if desired
-                    ddim_noise_steps = 100
-                # Update noise_range and ctx_max_noise_idx
-                noise_range = torch.linspace(-1, max_noise_level - 1, ddim_noise_steps + 1).to(device)
-                ctx_max_noise_idx = ddim_noise_steps // 10 * 3
-                adjustment_message = f"ddim_noise_steps: {ddim_noise_steps}"
-                adjustment_display_time = current_time + 2  # Display for 2 seconds
-                print(adjustment_message)
-
-            elif event.key in [pygame.K_MINUS, pygame.K_UNDERSCORE]:
-                ddim_noise_steps -= 1
-                if ddim_noise_steps < 1:
-                    ddim_noise_steps = 1
-                # Update noise_range and ctx_max_noise_idx
-                noise_range = torch.linspace(-1, max_noise_level - 1, ddim_noise_steps + 1).to(device)
-                ctx_max_noise_idx = ddim_noise_steps // 10 * 3
-                adjustment_message = f"ddim_noise_steps: {ddim_noise_steps}"
-                adjustment_display_time = current_time + 2  # Display for 2 seconds
-                print(adjustment_message)
-
-        elif event.type == pygame.MOUSEBUTTONDOWN:
-            if not mouse_captured:
-                # Capture the mouse on mouse click if it's not already captured
-                pygame.mouse.set_visible(False)
-                pygame.event.set_grab(True)
-                mouse_captured = True
-                pygame.mouse.set_pos(center_pos)  # Reset to center
-                pygame.mouse.get_rel()  # Reset relative movement
-                print("Mouse captured on click.")
-
-    if mouse_captured:
-        # Get relative mouse movement
-        rel = pygame.mouse.get_rel()
-        relative_mouse_movement = rel
-
-        # Reset mouse position to the center
-        pygame.mouse.set_pos(center_pos)
-    else:
-        relative_mouse_movement = (0, 0)
-    if not reset_context:
-        # Capture current action
-        action = get_current_action(relative_mouse_movement)
-        actions_curr = action_to_tensor(action).unsqueeze(0)  # Shape [1, num_actions]
-        actions_list.append(actions_curr)
-
-        # Generate a random latent for the new frame
-        chunk = torch.randn((B, 1, *x.shape[-3:]), device=device)
-        chunk = torch.clamp(chunk, -noise_abs_max, +noise_abs_max)
-        x = torch.cat([x, chunk], dim=1)
-
-        # Implement sliding window for context frames and actions
-        if x.shape[1] > context_window_size:
-            x = x[:, -context_window_size:]
-            actions_list = actions_list[-context_window_size:]
-        # Prepare actions tensor
-        actions_tensor = torch.stack(actions_list, dim=1)  # Shape [1, context_length, num_actions]
-    else:
-        reset_context = False
-    
-    x = sample(x, actions_tensor, ddim_noise_steps, stabilization_level, alphas_cumprod, noise_range, noise_abs_max, model)
-
-    frame = decode(x, vae)
-
-    # Convert to surface and display
-    frame_surface = pygame.surfarray.make_surface(np.transpose(frame, (1, 0, 2)))
-    frame_surface = pygame.transform.scale(frame_surface, (screen_width, screen_height))
-    screen.blit(frame_surface, (0, 0))
-
-    # --- FPS Counter ---
-    # Update frame times
-    frame_times.append(current_time)
-    # Remove frame times older than 1 second
-    while frame_times and frame_times[0] < current_time - 1:
-        frame_times.pop(0)
-    # Calculate FPS
-    fps = len(frame_times)
-
-    if show_fps:
-        fps_text = font.render(f"FPS: {fps}", True, (255, 255, 255))  # White color
-        fps_rect = fps_text.get_rect(topright=(screen_width - 10, 10))  # 10 pixels padding from top-right
-        screen.blit(fps_text, fps_rect)
-    # -------------------
-
-    # --- Adjustment Info Display ---
-    if adjustment_message and current_time < adjustment_display_time:
-        adjustment_text = font.render(adjustment_message, True, (255, 255, 0))  # Yellow color
-        adjustment_rect = adjustment_text.get_rect(center=(screen_width // 2, 30))  # Top center
-        screen.blit(adjustment_text, adjustment_rect)
-    elif current_time >= adjustment_display_time:
-        adjustment_message = ""  # Clear the message
-    # ---------------------------------
-
-    pygame.display.flip()
-
-    # Control frame rate
-    clock.tick(35)  # Adjust FPS as needed
-
-pygame.quit()
\ No newline at end of file
+                    print("Mouse captured on click.")
+
+        if mouse_captured:
+            # Get relative mouse movement
+            rel = pygame.mouse.get_rel()
+            relative_mouse_movement = rel
+
+            # Reset mouse position to the center
+            pygame.mouse.set_pos(center_pos)
+        else:
+            relative_mouse_movement = (0, 0)
+        # Hand the current input to the sampling thread, it takes whatever is there when it starts a frame
+        input_state.update(get_current_action(relative_mouse_movement), relative_mouse_movement)
+        telemetry.lap("input")
+
+        try:
+            item = pipeline.frames.get_nowait()
+        except queue.Empty:
+            # No new frame yet, keep polling input
+            clock.tick(input_poll_rate)
+            telemetry.lap("tick")
+            continue
+        if item is None:
+            # a worker stopped, check() below raises its error
+            break
+        frame, input_time = item
+
+        # Convert to surface and display
+        frame_surface = pygame.surfarray.make_surface(np.transpose(frame, (1, 0, 2)))
+        frame_surface = pygame.transform.scale(frame_surface, (screen_width, screen_height))
+        screen.blit(frame_surface, (0, 0))
+
+        # --- FPS Counter ---
+        # Update frame times
+        frame_times.append(current_time)
+        # Remove frame times older than 1 second
+        while frame_times and frame_times[0] < current_time - 1:
+            frame_times.popleft()
+        # Calculate FPS
+        fps = len(frame_times)
+
+        if show_fps:
+            fps_text = font.render(f"FPS: {fps}", True, (255, 255, 255))  # White color
+            fps_rect = fps_text.get_rect(topright=(screen_width - 10, 10))  # 10 pixels padding from top-right
+            screen.blit(fps_text, fps_rect)
+        # -------------------
+
+        # --- Latency Overlay ---
+        if show_telemetry:
+            for line_idx, line in enumerate(telemetry.overlay_lines() + pipeline.telemetry_lines()):
+                line_text = telemetry_font.render(line, True, (0, 255, 0))
+                screen.blit(line_text, (10, 10 + line_idx * 20))
+        # -----------------------
+
+        # --- Adjustment Info Display ---
+        if adjustment_message and current_time < adjustment_display_time:
+            adjustment_text = font.render(adjustment_message, True, (255, 255, 0))  # Yellow color
+            adjustment_rect = adjustment_text.get_rect(center=(screen_width // 2, 30))  # Top center
+            screen.blit(adjustment_text, adjustment_rect)
+        elif current_time >= adjustment_display_time:
+            adjustment_message = ""  # Clear the message
+        # ---------------------------------
+
+        pygame.display.flip()
+        telemetry.lap("display")
+        # From the first input polled for this frame to the frame being on screen
+        telemetry.record("latency", time.perf_counter() - input_time)
+        telemetry.end_frame(ddim_noise_steps=ddim_noise_steps)
+
+        clock.tick(input_poll_rate)
+        telemetry.lap("tick")
+finally:
+    pipeline.stop()
+
+pipeline.check()
+telemetry.export(telemetry_output)
+pipeline.export_telemetry(telemetry_output)
+pygame.quit()
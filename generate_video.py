@@ -1,14 +1,22 @@
 import torch
-from torchvision.io import read_video, read_image, write_video
+from torchvision.io import read_image, write_video
 from einops import rearrange
-from oasis_library.utils import one_hot_actions, sigmoid_beta_schedule
+from oasis_library.utils import load_actions, sigmoid_beta_schedule
 from torchvision.transforms.functional import resize
 from torch.amp import autocast, GradScaler
 from tqdm import tqdm
 import argparse
+import json
 import os
+import queue
+from collections import defaultdict
+from threading import Thread
+import av
 from oasis_library.dit import DiT_models
+from oasis_library.sampling import SOLVERS, FrameSampler
+from oasis_library.session import WorldModelSession
 from oasis_library.vae import VAE_models
+from oasis_library.video_reader import read_frames
 
 assert torch.cuda.is_available()
 
@@ -24,10 +32,10 @@ def load_prompt(path, video_offset=None, n_prompt_frames=1):
         # add frame dimension
         prompt = rearrange(prompt, "c h w -> 1 c h w")
     elif path.lower().split(".")[-1] in VIDEO_EXTENSIONS:
-        prompt = read_video(path, pts_unit="sec")[0]
-        if video_offset is not None:
-            prompt = prompt[video_offset:]
-        prompt = prompt[:n_prompt_frames]
+        # only decode the prompt frames instead of the whole video
+        start = video_offset if video_offset is not None else 0
+        prompt = read_frames(path, start, start + n_prompt_frames)
+        prompt = rearrange(prompt, "t h w c -> t c h w")
     else:
         raise ValueError(f"unrecognized prompt file extension; expected one in {IMAGE_EXTENSIONS} or {VIDEO_EXTENSIONS}")
     assert prompt.shape[0] == n_prompt_frames, f"input prompt {path} had less than n_prompt_frames={n_prompt_frames} frames"
@@ -38,24 +46,7 @@ def load_prompt(path, video_offset=None, n_prompt_frames=1):
     return prompt
 
 
-def load_actions(path, action_offset=None):
-    if path.endswith(".actions.pt"):
-        actions = one_hot_actions(torch.load(path))
-    elif path.endswith(".one_hot_actions.pt"):
-        actions = torch.load(path, weights_only=True)
-    else:
-        raise ValueError("unrecognized action file extension; expected '*.actions.pt' or '*.one_hot_actions.pt'")
-    if action_offset is not None:
-        actions = actions[action_offset:]
-    actions = torch.cat([torch.zeros_like(actions[:1]), actions], dim=0)
-    # add batch dimension
-    actions = rearrange(actions, "t d -> 1 t d")
-    return actions
-
-def main(args):
-    torch.manual_seed(0)
-    torch.cuda.manual_seed(0)
-
+def load_models(args):
     # load DiT checkpoint
     model = DiT_models["DiT-S/2"]()
     print(f"loading Oasis-500M from oasis-ckpt={os.path.abspath(args.oasis_ckpt)}...")
@@ -75,25 +66,119 @@ def main(args):
     #elif args.vae_ckpt.endswith(".safetensors"):
     #    load_model(vae, '/content/drive/MyDrive/Colab Notebooks/vit-l-20.safetensors')
     vae = vae.to(device).eval()
+    return model, vae
+
+
+class StreamingVideoWriter:
+    """
+    Decodes latents and appends them to open video files on a background thread (and its own cuda stream),
+    so decoding and encoding overlap with sampling the next frame and nothing grows with the rollout length.
+    paths: one output file per sample of the batch
+    decode_batch_size: number of frames per sample that are decoded together
+    """
+
+    def __init__(self, vae, paths, fps, decode_batch_size=1, max_pending=8, scaling_factor=0.07843137255):
+        self.vae = vae
+        self.paths = paths
+        self.fps = fps
+        self.decode_batch_size = decode_batch_size
+        self.scaling_factor = scaling_factor
+        self.frames_written = 0
+        self.error = None
+        self.queue = queue.Queue(maxsize=max_pending)  # bounds how far sampling can run ahead of decoding
+        self.stream = torch.cuda.Stream(device=device)
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def put(self, latents):
+        """
+        latents: (B, T, C, H, W) finished frames, in order
+        """
+        if self.error is not None:
+            raise self.error
+        latents = latents.clone()
+        # recorded after the copy, so the decode stream waits for it to finish
+        event = torch.cuda.Event()
+        event.record()
+        self.queue.put((latents, event))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        for path in self.paths:
+            print(f"generation saved to {path}.")
+
+    def _run(self):
+        containers = []
+        item = True
+        try:
+            for path in self.paths:
+                container = av.open(path, mode="w")
+                containers.append((container, None))
+                video_stream = container.add_stream("mpeg4", rate=self.fps)
+                video_stream.width = self.vae.input_width
+                video_stream.height = self.vae.input_height
+                video_stream.pix_fmt = "yuv420p"
+                containers[-1] = (container, video_stream)
+            pending = []
+            while True:
+                item = self.queue.get()
+                if item is not None:
+                    pending.append(item)
+                if pending and (item is None or sum(latents.shape[1] for latents, _ in pending) >= self.decode_batch_size):
+                    self._write(containers, pending)
+                    pending = []
+                if item is None:
+                    break
+            for container, video_stream in containers:
+                for packet in video_stream.encode():
+                    container.mux(packet)
+        except Exception as e:
+            self.error = e
+            # keep draining until close() so put() never blocks on a dead writer
+            while item is not None:
+                item = self.queue.get()
+        finally:
+            for container, _ in containers:
+                container.close()
+
+    def _write(self, containers, pending):
+        with torch.cuda.stream(self.stream):
+            for latents, event in pending:
+                self.stream.wait_event(event)
+                # allocated on the sampling stream, so the allocator must not reuse it before this stream is done
+                latents.record_stream(self.stream)
+            x = torch.cat([latents for latents, _ in pending], dim=1)
+            T = x.shape[1]
+            x = rearrange(x, "b t c h w -> (b t) (h w) c")
+            with torch.no_grad():
+                x = (self.vae.decode(x / self.scaling_factor) + 1) / 2
+            x = rearrange(x, "(b t) c h w -> b t h w c", t=T)
+            x = (torch.clamp(x, 0, 1) * 255).byte().cpu().numpy()
+        for (container, video_stream), frames in zip(containers, x):
+            for frame in frames:
+                for packet in video_stream.encode(av.VideoFrame.from_ndarray(frame, format="rgb24")):
+                    container.mux(packet)
+        self.frames_written += T
+
 
+def rollout(model, vae, x, actions, n_prompt_frames, total_frames, ddim_noise_steps, writer=None, solver="ddim"):
+    """
+    Rolls out every sample of the batch together.
+    x: (B, n_prompt_frames, C, H, W) prompt frames in [0, 1]
+    actions: (B, total_frames, num_actions) action stream, the first frame's action is zero
+    writer: optional StreamingVideoWriter. Every frame is handed to it as soon as it is denoised and only the
+            session's window of latents is kept; otherwise the whole video is decoded at the end.
+    solver: "ddim" or "dpm++2m", see oasis_library/sampling.py
+    Returns the (B, total_frames, H, W, C) uint8 video on the cpu, or None when streaming.
+    """
     # sampling params
-    n_prompt_frames = args.n_prompt_frames
-    total_frames = args.num_frames
     max_noise_level = 1000
-    ddim_noise_steps = args.ddim_steps
-    noise_range = torch.linspace(-1, max_noise_level - 1, ddim_noise_steps + 1)
     noise_abs_max = 20
     stabilization_level = 15
 
-    # get prompt image/video
-    x = load_prompt(
-        args.prompt_path,
-        video_offset=args.video_offset,
-        n_prompt_frames=n_prompt_frames,
-    )
-    # get input action stream
-    actions = load_actions(args.actions_path, action_offset=args.video_offset)[:, :total_frames]
-
     # sampling inputs
     x = x.to(device)
     actions = actions.to(device)
@@ -113,64 +198,127 @@ def main(args):
     betas = sigmoid_beta_schedule(max_noise_level).float().to(device)
     alphas = 1.0 - betas
     alphas_cumprod = torch.cumprod(alphas, dim=0)
-    alphas_cumprod = rearrange(alphas_cumprod, "T -> T 1 1 1")
+    sampler = FrameSampler(alphas_cumprod, ddim_noise_steps, solver, max_noise_level)
+
+    # sliding window of latents and actions, the kv cache is reused until the window moves
+    session = WorldModelSession(
+        model, sampler, vae, batch_size=B, device=device, stabilization_level=stabilization_level, noise_abs_max=noise_abs_max, scaling_factor=scaling_factor
+    )
+    session.reset(x, actions[:, :n_prompt_frames])
+
+    if writer is not None:
+        writer.put(x)
+    else:
+        # every frame is kept for decoding at the end
+        video_latents = torch.empty((B, total_frames, *x.shape[-3:]), device=device)
+        video_latents[:, :n_prompt_frames] = x
 
     # sampling loop
     for i in tqdm(range(n_prompt_frames, total_frames)):
-        chunk = torch.randn((B, 1, *x.shape[-3:]), device=device)
-        chunk = torch.clamp(chunk, -noise_abs_max, +noise_abs_max)
-        x = torch.cat([x, chunk], dim=1)
-        start_frame = max(0, i + 1 - model.max_frames)
-
-        for noise_idx in reversed(range(1, ddim_noise_steps + 1)):
-            # set up noise values
-            t_ctx = torch.full((B, i), stabilization_level - 1, dtype=torch.long, device=device)
-            t = torch.full((B, 1), noise_range[noise_idx], dtype=torch.long, device=device)
-            t_next = torch.full((B, 1), noise_range[noise_idx - 1], dtype=torch.long, device=device)
-            t_next = torch.where(t_next < 0, t, t_next)
-            t = torch.cat([t_ctx, t], dim=1)
-            t_next = torch.cat([t_ctx, t_next], dim=1)
-
-            # sliding window
-            x_curr = x.clone()
-            x_curr = x_curr[:, start_frame:]
-            t = t[:, start_frame:]
-            t_next = t_next[:, start_frame:]
-
-            # get model predictions
-            with torch.no_grad():
-                with autocast("cuda", dtype=torch.half):
-                    v = model(x_curr, t, actions[:, start_frame : i + 1])
-
-            x_start = alphas_cumprod[t].sqrt() * x_curr - (1 - alphas_cumprod[t]).sqrt() * v
-            x_noise = ((1 / alphas_cumprod[t]).sqrt() * x_curr - x_start) / (1 / alphas_cumprod[t] - 1).sqrt()
-
-            # get frame prediction
-            alpha_next = alphas_cumprod[t_next]
-            alpha_next[:, :-1] = torch.ones_like(alpha_next[:, :-1])
-            if noise_idx == 1:
-                alpha_next[:, -1:] = torch.ones_like(alpha_next[:, -1:])
-            x_pred = alpha_next.sqrt() * x_start + x_noise * (1 - alpha_next).sqrt()
-            x[:, -1:] = x_pred[:, -1:]
-
-    # vae decoding
-    x = rearrange(x, "b t c h w -> (b t) (h w) c")
-    with torch.no_grad():
-        x = (vae.decode(x / scaling_factor) + 1) / 2
-    x = rearrange(x, "(b t) c h w -> b t h w c", t=total_frames)
+        # only the newest frame is run through the model, the rest of the window comes from the kv cache
+        latent = session.step_latent(actions[:, i])
+        if writer is not None:
+            writer.put(latent)
+        else:
+            video_latents[:, i : i + 1] = latent
+
+    if writer is not None:
+        return None
+
+    # vae decoding, one rollout at a time so large batches don't multiply the decoder's memory
+    videos = []
+    for x_b in video_latents:
+        x_b = rearrange(x_b, "t c h w -> t (h w) c")
+        with torch.no_grad():
+            x_b = (vae.decode(x_b / scaling_factor) + 1) / 2
+        x_b = rearrange(x_b, "t c h w -> t h w c")
+        x_b = torch.clamp(x_b, 0, 1)
+        videos.append((x_b * 255).byte().cpu())
+    return torch.stack(videos)
 
-    # save video
-    x = torch.clamp(x, 0, 1)
-    x = (x * 255).byte()
 
+def save_video(path, video, fps):
     write_video(
-        filename=args.output_path,
-        video_array=x[0].cpu(),  # shape: (T, H, W, C), dtype=torch.uint8
-        fps=args.fps,
+        filename=path,
+        video_array=video,  # shape: (T, H, W, C), dtype=torch.uint8
+        fps=fps,
         video_codec='mpeg4'  # ← works in Colab
     )
-    #write_video(args.output_path, x[0].cpu(), fps=args.fps)
-    print(f"generation saved to {args.output_path}.")
+    #write_video(path, video, fps=fps)
+    print(f"generation saved to {path}.")
+
+
+def load_manifest(path):
+    """
+    One JSON object per line with "prompt_path", "actions_path" and "output_path", and optionally
+    "video_offset", "num_frames" and "n_prompt_frames" (defaulting to the command line values).
+    """
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def run_manifest(args, model, vae):
+    # actions are small, so load them up front to know each job's length; prompts are loaded per batch
+    groups = defaultdict(list)
+    for job in load_manifest(args.manifest):
+        video_offset = job.get("video_offset", args.video_offset)
+        actions = load_actions(job["actions_path"], action_offset=video_offset, prepend_zero=True)[:, : job.get("num_frames", args.num_frames)]
+        # jobs can only share a batch if they have the same prompt and rollout length
+        groups[(job.get("n_prompt_frames", args.n_prompt_frames), actions.shape[1])].append((job, actions))
+
+    for (n_prompt_frames, total_frames), group in groups.items():
+        for batch_start in range(0, len(group), args.batch_size):
+            batch = group[batch_start : batch_start + args.batch_size]
+            print(f"rolling out {len(batch)} jobs of {total_frames} frames...")
+            x = torch.cat(
+                [load_prompt(job["prompt_path"], video_offset=job.get("video_offset", args.video_offset), n_prompt_frames=n_prompt_frames) for job, _ in batch],
+                dim=0,
+            )
+            actions = torch.cat([actions for _, actions in batch], dim=0)
+            if args.stream:
+                writer = StreamingVideoWriter(vae, [job["output_path"] for job, _ in batch], args.fps, args.stream_decode_batch)
+                try:
+                    rollout(model, vae, x, actions, n_prompt_frames, total_frames, args.ddim_steps, writer=writer, solver=args.sampler)
+                finally:
+                    # finalizes the files and stops the thread, also when sampling failed
+                    writer.close()
+                continue
+            videos = rollout(model, vae, x, actions, n_prompt_frames, total_frames, args.ddim_steps, solver=args.sampler)
+            for (job, _), video in zip(batch, videos):
+                save_video(job["output_path"], video, args.fps)
+
+
+def main(args):
+    torch.manual_seed(0)
+    torch.cuda.manual_seed(0)
+
+    model, vae = load_models(args)
+
+    if args.manifest is not None:
+        run_manifest(args, model, vae)
+        return
+
+    # get prompt image/video
+    x = load_prompt(
+        args.prompt_path,
+        video_offset=args.video_offset,
+        n_prompt_frames=args.n_prompt_frames,
+    )
+    # get input action stream
+    actions = load_actions(args.actions_path, action_offset=args.video_offset, prepend_zero=True)[:, : args.num_frames]
+
+    if args.stream:
+        writer = StreamingVideoWriter(vae, [args.output_path], args.fps, args.stream_decode_batch)
+        try:
+            rollout(model, vae, x, actions, args.n_prompt_frames, args.num_frames, args.ddim_steps, writer=writer, solver=args.sampler)
+        finally:
+            writer.close()
+        return
+
+    video = rollout(model, vae, x, actions, args.n_prompt_frames, args.num_frames, args.ddim_steps, solver=args.sampler)
+
+    # save video
+    save_video(args.output_path, video[0], args.fps)
 
 
 if __name__ == "__main__":
@@ -185,7 +333,12 @@ if __name__ == "__main__":
     parse.add_argument("--n-prompt-frames", type=int, default=1)
     parse.add_argument("--output-path", type=str, default="video.mp4")
     parse.add_argument("--fps", type=int, default=20)
-    parse.add_argument("--ddim-steps", type=int, default=10)
+    parse.add_argument("--ddim-steps", type=int, default=10, help="model calls per frame")
+    parse.add_argument("--sampler", choices=SOLVERS, default="ddim", help="dpm++2m gets the same quality with fewer --ddim-steps")
+    parse.add_argument("--manifest", type=str, default=None, help="JSON lines file of prompt/action pairs to roll out in batches")
+    parse.add_argument("--batch-size", type=int, default=8, help="number of manifest jobs denoised together")
+    parse.add_argument("--stream", action="store_true", help="decode and write each frame as soon as it is sampled")
+    parse.add_argument("--stream-decode-batch", type=int, default=1, help="frames decoded together when streaming")
 
     args, _ = parse.parse_known_args()  # <- allows unknown args like `-f`
     #print("inference args:")
@@ -3,17 +3,16 @@ This is the file that runs during gameplay to record the screen, the keyboard, a
 """
 import cv2
 import numpy as np
-import torch
 import time
 import mss
 from pynput import keyboard, mouse
 from threading import Thread, Lock, Event
-from collections import deque
 import datetime
-from PIL import Image
-from find_health_bar_aspect_ratio import count_hearts
-import copy
+import queue
 from pathlib import Path
+from oasis_library.actions import ACTION_DTYPE, camera_mu_law_encode, empty_actions, save_actions
+from oasis_library.capture import FRAME_HEIGHT, FRAME_WIDTH, new_frame, process_frame
+from oasis_library.ring_buffer import RingBuffer
 
 # Constants
 ACTION_KEYS = [
@@ -60,11 +59,29 @@ double_tap_threshold = 0.3  # 300ms for sprint detection
 # Screen recording buffer
 FPS = 20
 BUFFER_SECONDS = 15
-FRAME_BUFFER = deque(maxlen=FPS * BUFFER_SECONDS)
+RECORDING_FRAMES = FPS * BUFFER_SECONDS  # frames per saved recording
+# Extra ring space so the writer can still read a recording's oldest frames while capture keeps going
+WRITER_HEADROOM_SECONDS = 5
+# Preallocated (400, 360, 640, 3) uint8 ring, process_frames copies each resized frame into it
+FRAME_BUFFER = RingBuffer(FPS * (BUFFER_SECONDS + WRITER_HEADROOM_SECONDS), np.uint8, (FRAME_HEIGHT, FRAME_WIDTH, 3))
+# Grabbed screenshots waiting to be resized. If resizing falls behind, new grabs are dropped instead of piling up
+GRAB_QUEUE_SIZE = 4
+grab_queue = queue.Queue(maxsize=GRAB_QUEUE_SIZE)
+# grabbed: frames captured, written: frames in FRAME_BUFFER,
+# dropped: ticks without a frame (capture fell a whole tick behind, or the resize stage was full),
+# late: frames whose grab finished after the next tick was already due
+CAPTURE_STATS = {"grabbed": 0, "written": 0, "dropped": 0, "late": 0}
+# Heart count of every grabbed frame, read off the full-resolution screenshot by process_frames
+health_queue = queue.Queue()
 ACTIONS_IN_A_SINGLE_FRAME = {}
-last_frame = None
-ACTION_BUFFER = deque(maxlen=FPS * BUFFER_SECONDS)  # Stores recent actions
+last_frame = empty_actions(1)[0]  # One ACTION_DTYPE row, the held keys carry over between frames
+ACTION_BUFFER = RingBuffer(FRAME_BUFFER.capacity, ACTION_DTYPE)  # Stores recent actions, one row per frame
 lock = Lock()
+# A recording never reaches back before the end of the previous one
+recording_start = 0
+# Saves waiting for the writer thread: (first frame, end frame, trigger time) ranges into the rings
+save_queue = queue.Queue()
+WRITER_STATS = {"saved": 0, "lost_frames": 0, "last_latency": 0.0, "max_latency": 0.0}
 
 stop_event = Event()  # Global active signal
 
@@ -73,35 +90,25 @@ damage_timer = None
 timeout_seconds = 5
 current_inventory_slot = 1
 current_health = 0
-def player_taking_damage():
+def player_taking_damage(updated_health):
     # returns true if the player took damage
     # also returns true if the player is dead (and wasn't dead the previous frame)
     # we calculate this by seeing whether the updated health is less than the previous health
-    # there might be a more efficient way than taking another screenshot (we take 2 screenshots every frame), but idk and if it works it works
+    # updated_health comes from the frame the capture pipeline already grabbed, no second screenshot
     global current_health
-    sct = mss.mss()
-    monitor = sct.monitors[1]
-    img = np.array(sct.grab(monitor))[:, :, :3]
-    img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
-    img = Image.fromarray(img)
-    updated_health = count_hearts(img)
     took_damage =(updated_health<current_health)
     dead = (updated_health==0 and current_health>0)
     current_health=updated_health
     return took_damage, dead
 
 def compile_single_frame_actions():
+    # Updates last_frame in place, ACTION_BUFFER.append copies the row so nothing is allocated per frame
     global ACTIONS_IN_A_SINGLE_FRAME
-    global last_frame
-    if not last_frame:
-        last_frame = {"ESC":0, "back":0, "drop":0, "forward":0, "hotbar.1":0, "hotbar.2":0, "hotbar.3":0, "hotbar.4":0, "hotbar.5":0, "hotbar.6":0, "hotbar.7":0, "hotbar.8":0, "hotbar.9":0, 
-                        "inventory":0, "jump":0, "left":0, "right":0, "sneak":0, "sprint":0, "swapHands":0, "camera":np.array([40,40]), "attack":0, "use":0, "pickItem":0 }
-    
-    for action in ACTIONS_IN_A_SINGLE_FRAME:
+    frame_actions, ACTIONS_IN_A_SINGLE_FRAME = ACTIONS_IN_A_SINGLE_FRAME, {}
+    for action in frame_actions:
         if "hotbar" in action: continue
-        last_frame[action]=ACTIONS_IN_A_SINGLE_FRAME[action]
-    ACTIONS_IN_A_SINGLE_FRAME = {}
-    return copy.deepcopy(last_frame)
+        last_frame[action]=frame_actions[action]
+    return last_frame
 
 def compress_mouse(dx):
     """
@@ -111,96 +118,171 @@ def compress_mouse(dx):
     We'll just assume sub-pixel quantities of 0.25 for now
     """
     #Convert dx to sub-pixel quantity of 0.25
-    dx/=4.0
-
-    max_val = 20
-    bin_size = 0.5
-    mu = 2.7
+    return camera_mu_law_encode(dx / 4.0)
 
-    dx = np.clip(dx, -max_val, max_val)
-    dx /= max_val
-    v_encode = np.sign(dx) * (np.log(1.0 + mu * np.abs(dx)) / np.log(1.0 + mu))
-    v_encode *= max_val
-    dx = v_encode
-
-    return np.round((dx + max_val) / bin_size).astype(np.int64)
-
-def record_screen():
+def grab_screen():
+    """
+    Capture stage: grabs the screen on a fixed 20 FPS schedule and hands the raw screenshot, together with
+    the actions of that tick, to process_frames. Only the grab runs on this thread, so a slow resize no
+    longer delays the next grab.
+    """
     global ACTIONS_IN_A_SINGLE_FRAME
     global current_x, current_y, dx, dy
     sct = mss.mss()
     monitor = sct.monitors[1]
     dx, dy, current_x, current_y = 0, 0, 0, 0
-    last_time = time.time()  # Track time manually
+    frame_time = 1 / FPS
+    next_tick = time.time()
     while not stop_event.is_set():
-        current_time = time.time()
-        elapsed_time = current_time - last_time
-
-        if elapsed_time >= 1 / (FPS):  # Only capture if enough time has passed
-            last_time = current_time  # Update last captured frame time
-            img = np.array(sct.grab(monitor)) #This line of code may take longer than 1/20th of a second :(
-            img = img[:, :, :3]
-            img = cv2.resize(img, (640, 360)) #This line of code also takes a while
-            
-            # Up results in small-y
-            # Left results in small-x
-            # Note that due to a quirk in the VPT data, x and y are swapped so it looks like (y, x)
-            ACTIONS_IN_A_SINGLE_FRAME["camera"] = np.array([compress_mouse(dy), compress_mouse(dx)])
-            current_x, current_y = mouse.Controller().position
-            dx, dy = 0, 0
-            action_in_a_single_frame = compile_single_frame_actions()
-            with lock:
-                FRAME_BUFFER.append(img)
-                ACTION_BUFFER.append(action_in_a_single_frame)
+        now = time.time()
+        if now < next_tick:
+            time.sleep(next_tick - now)
+            continue
+        if now - next_tick >= frame_time:
+            # We fell a whole tick (or more) behind, skip the ticks we missed instead of bursting to catch up
+            missed = int((now - next_tick) / frame_time)
+            CAPTURE_STATS["dropped"] += missed
+            next_tick += missed * frame_time
+        next_tick += frame_time
+
+        shot = sct.grab(monitor) #This line of code may take longer than 1/20th of a second :(
+        CAPTURE_STATS["grabbed"] += 1
+        if time.time() > next_tick:
+            CAPTURE_STATS["late"] += 1
+
+        # Up results in small-y
+        # Left results in small-x
+        # Note that due to a quirk in the VPT data, x and y are swapped so it looks like (y, x)
+        ACTIONS_IN_A_SINGLE_FRAME["camera"] = np.array([compress_mouse(dy), compress_mouse(dx)])
+        current_x, current_y = mouse.Controller().position
+        dx, dy = 0, 0
+        action_in_a_single_frame = compile_single_frame_actions().copy()
+        try:
+            grab_queue.put_nowait((shot, action_in_a_single_frame))
+        except queue.Full:
+            CAPTURE_STATS["dropped"] += 1
+
+
+def process_frames():
+    """
+    Resize/convert stage: turns BGRA screenshots into 640x360 BGR frames and appends them, with the
+    matching actions, to FRAME_BUFFER and ACTION_BUFFER (see oasis_library/capture.py). The lock is only
+    held for the frame copy, not the resize.
+    """
+    resized = new_frame()
+    while not stop_event.is_set():
+        try:
+            shot, action_in_a_single_frame = grab_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        # Health stage rides along: the heart count is read off the full-resolution screenshot
+        health_queue.put(process_frame(shot, action_in_a_single_frame, FRAME_BUFFER, ACTION_BUFFER, resized, lock))
+        CAPTURE_STATS["written"] += 1
+
+
+def print_capture_stats():
+    print(f"Capture: {CAPTURE_STATS['grabbed']} grabbed, {CAPTURE_STATS['written']} written, "
+          f"{CAPTURE_STATS['dropped']} dropped, {CAPTURE_STATS['late']} late")
+
+
+def buffered_frames():
+    # Frames available for the next recording
+    return FRAME_BUFFER.count - recording_start
 
 
 def save_recording():
-    global FRAME_BUFFER
-    global ACTION_BUFFER
+    """
+    Queues the last BUFFER_SECONDS of gameplay for the writer thread and returns right away.
+    Only the index range is recorded here, the frames are read from the ring when they are written.
+    """
+    global recording_start
     with lock:
-        frames = list(FRAME_BUFFER)
-        saved_actions = list(ACTION_BUFFER)
-    
-    if not frames or not saved_actions:
+        end = FRAME_BUFFER.count
+        start = max(recording_start, end - RECORDING_FRAMES)
+        recording_start = end
+    if end == start:
         print("No frames/actions to save.")
         return
+    save_queue.put((start, end, time.time()))
 
+
+def write_recording(start, end, trigger_time):
     # Get the path to the Downloads folder and create the target directory
     downloads_path = Path.home() / "Downloads"
     save_dir = downloads_path / "minecraft_recording_data"
     save_dir.mkdir(parents=True, exist_ok=True)  # Create folder if it doesn't exist
 
-    height, width, _ = frames[0].shape
     fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    timestamp = datetime.datetime.fromtimestamp(trigger_time).strftime("%Y%m%d_%H%M%S")
+    if (save_dir / f"replay_{timestamp}.mp4").exists():
+        # overlapping triggers within the same second
+        timestamp += datetime.datetime.fromtimestamp(trigger_time).strftime("_%f")
     output_file = save_dir / f"replay_{timestamp}.mp4"
-    actions_file = save_dir / f"actions_{timestamp}.pt"
+    actions_file = save_dir / f"actions_{timestamp}.npy"
 
-    # Save video
-    out = cv2.VideoWriter(str(output_file), fourcc, FPS, (width, height))
-    for frame in frames:
-        frame = frame[:, :, :3]
+    with lock:
+        # If the writer fell more than WRITER_HEADROOM_SECONDS behind, the oldest frames are gone
+        lost = max(0, FRAME_BUFFER.oldest - start)
+        start += lost
+        saved_actions = ACTION_BUFFER.copy_range(start, end)
+    if lost:
+        WRITER_STATS["lost_frames"] += lost
+        print(f"⚠️ Writer fell behind, {lost} frames of the recording were overwritten")
+
+    # Save video, one frame copied out of the ring at a time so capture is never held up
+    out = cv2.VideoWriter(str(output_file), fourcc, FPS, (FRAME_WIDTH, FRAME_HEIGHT))
+    frame = new_frame()
+    written = 0
+    for i in range(start, end):
+        with lock:
+            if i < FRAME_BUFFER.oldest:
+                break
+            frame[...] = FRAME_BUFFER.get(i)
         out.write(frame)
+        written += 1
     out.release()
+    if written < end - start:
+        # keep actions aligned with the frames that made it into the video
+        saved_actions = saved_actions[:written]
+        WRITER_STATS["lost_frames"] += end - start - written
     print(f"Saved recording to {output_file}")
 
-    # Save actions
-    torch.save(saved_actions, str(actions_file))
+    # Save actions (columnar .npy, see oasis_library/actions.py)
+    save_actions(str(actions_file), saved_actions)
     print(f"Saved actions to {actions_file}")
 
-    # Clear buffers
-    FRAME_BUFFER = deque(maxlen=FPS * BUFFER_SECONDS)
-    ACTION_BUFFER = deque(maxlen=FPS * BUFFER_SECONDS)
+    latency = time.time() - trigger_time
+    WRITER_STATS["saved"] += 1
+    WRITER_STATS["last_latency"] = latency
+    WRITER_STATS["max_latency"] = max(WRITER_STATS["max_latency"], latency)
+    print(f"Flushed {written} frames in {latency:.2f}s after the trigger ({save_queue.qsize()} saves pending)")
+    print_capture_stats()
+
+
+def recording_writer():
+    """
+    Writer thread: encodes queued recordings one after the other, off the capture and trigger threads.
+    Stops after the None sentinel, once every save queued before it is written.
+    """
+    while True:
+        job = save_queue.get()
+        if job is None:
+            break
+        write_recording(*job)
 
 
 def monitor_triggers():
     global damage_detected, damage_timer
     while not stop_event.is_set():
+        # One health reading per captured frame, so this runs at the capture rate without polling
+        try:
+            updated_health = health_queue.get(timeout=1/FPS)
+        except queue.Empty:
+            updated_health = None
         # Make sure the triggers don't occur if we don't have a full frame buffer
-        if len(FRAME_BUFFER)!=FRAME_BUFFER.maxlen: 
-            time.sleep(1/FPS)
+        if buffered_frames() < RECORDING_FRAMES or updated_health is None:
             continue
-        took_damage, dead = player_taking_damage()
+        took_damage, dead = player_taking_damage(updated_health)
         if dead:
             print("Death detected! Saving recording...")
             save_recording()
@@ -221,13 +303,14 @@ def monitor_triggers():
             save_recording()
             damage_detected = False
             damage_end_time = None
-        time.sleep(1/FPS)  # Check every 100ms
 
 def on_press(key):
     global last_forward_press_time
     global current_inventory_slot
     global screen_thread
+    global process_thread
     global trigger_thread
+    global writer_thread
     global k_listener
     global m_listener
     try:
@@ -236,7 +319,11 @@ def on_press(key):
             stop_event.set()
             print("Stopping recording")
             screen_thread.join()
+            process_thread.join()
             trigger_thread.join()
+            save_queue.put(None)  # write whatever is still queued, then stop
+            writer_thread.join()
+            print_capture_stats()
             k_listener.stop()
             m_listener.stop()
             print("All threads stopped.")
@@ -333,14 +420,22 @@ def on_scroll(x, y, dx, dy):
 
 def main():
     global screen_thread
+    global process_thread
     global trigger_thread
+    global writer_thread
     global k_listener
     global m_listener
     print("running")
-    # Start screen recording buffer
-    screen_thread = Thread(target=record_screen, daemon=True)
+    # Start screen recording buffer (grab and resize run on separate threads)
+    screen_thread = Thread(target=grab_screen, daemon=True)
     screen_thread.start()
+    process_thread = Thread(target=process_frames, daemon=True)
+    process_thread.start()
     
+    # Recordings are written on their own thread so saving never stalls capture or detection
+    writer_thread = Thread(target=recording_writer, daemon=True)
+    writer_thread.start()
+
     # Start monitoring triggers
     trigger_thread = Thread(target=monitor_triggers, daemon=True)
     trigger_thread.start()
@@ -0,0 +1,163 @@
+"""
+Action codec.
+
+Recordings are stored column-wise as a numpy structured array with one uint8 column per button in
+ACTION_KEYS and an int16 (2,) "camera" column holding the VPT camera bins (centered on 40, x and y
+swapped like in the VPT data). On disk this is a plain .npy file (27 bytes per frame), so a whole
+recording loads in one read instead of unpickling a list of dicts. Everything here works on whole
+arrays at once.
+
+Conversions:
+    actions_from_dicts / actions_to_dicts   list of per-frame dicts (the old .actions.pt format) <-> array
+    actions_to_one_hot                      array -> (T, 25) model input in ACTION_KEYS order
+    camera_mu_law_encode / decode           camera movement <-> VPT camera bins
+"""
+
+import os
+from typing import Mapping, Sequence
+
+import numpy as np
+import torch
+
+ACTION_KEYS = [
+    "inventory",
+    "ESC",
+    "hotbar.1",
+    "hotbar.2",
+    "hotbar.3",
+    "hotbar.4",
+    "hotbar.5",
+    "hotbar.6",
+    "hotbar.7",
+    "hotbar.8",
+    "hotbar.9",
+    "forward",
+    "back",
+    "left",
+    "right",
+    "cameraX",
+    "cameraY",
+    "jump",
+    "sneak",
+    "sprint",
+    "swapHands",
+    "attack",
+    "use",
+    "pickItem",
+    "drop",
+]
+BUTTON_KEYS = [key for key in ACTION_KEYS if not key.startswith("camera")]
+
+ACTION_DTYPE = np.dtype([(key, np.uint8) for key in BUTTON_KEYS] + [("camera", np.int16, (2,))])
+
+# VPT camera quantization
+CAMERA_MAX_VAL = 20
+CAMERA_BIN_SIZE = 0.5
+CAMERA_MU = 2.7
+CAMERA_NUM_BUCKETS = int(CAMERA_MAX_VAL / CAMERA_BIN_SIZE)  # 40, the "no movement" bin
+
+
+def camera_mu_law_encode(delta):
+    """
+    Mu-law quantizes camera movement (any shape) into VPT camera bins in [0, 2 * CAMERA_NUM_BUCKETS].
+    """
+    delta = np.clip(np.asarray(delta, dtype=np.float64), -CAMERA_MAX_VAL, CAMERA_MAX_VAL) / CAMERA_MAX_VAL
+    v_encode = np.sign(delta) * (np.log(1.0 + CAMERA_MU * np.abs(delta)) / np.log(1.0 + CAMERA_MU))
+    v_encode *= CAMERA_MAX_VAL
+    return np.round((v_encode + CAMERA_MAX_VAL) / CAMERA_BIN_SIZE).astype(np.int64)
+
+
+def camera_mu_law_decode(bins):
+    """
+    Inverse of camera_mu_law_encode, up to the quantization error.
+    """
+    v = (np.asarray(bins, dtype=np.float64) * CAMERA_BIN_SIZE - CAMERA_MAX_VAL) / CAMERA_MAX_VAL
+    delta = np.sign(v) * ((1.0 + CAMERA_MU) ** np.abs(v) - 1.0) / CAMERA_MU
+    return delta * CAMERA_MAX_VAL
+
+
+def empty_actions(n):
+    """
+    n frames of "nothing pressed, camera still".
+    """
+    actions = np.zeros(n, dtype=ACTION_DTYPE)
+    actions["camera"] = CAMERA_NUM_BUCKETS
+    return actions
+
+
+def actions_from_dicts(actions: Sequence[Mapping]) -> np.ndarray:
+    """
+    Converts a list of per-frame action dicts (keys as in ACTION_KEYS plus a "camera" pair of bins,
+    missing keys count as 0) into an ACTION_DTYPE array.
+    """
+    out = empty_actions(len(actions))
+    if not len(actions):
+        return out
+    for key in BUTTON_KEYS:
+        out[key] = np.fromiter((frame.get(key, 0) for frame in actions), dtype=np.int64, count=len(actions))
+    out["camera"] = np.array([np.asarray(frame["camera"]).reshape(2) for frame in actions])
+    return out
+
+
+def actions_to_dicts(actions: np.ndarray) -> list:
+    columns = {key: actions[key].tolist() for key in BUTTON_KEYS}
+    cameras = actions["camera"].astype(np.int64)
+    return [{**{key: columns[key][i] for key in BUTTON_KEYS}, "camera": cameras[i]} for i in range(len(actions))]
+
+
+def actions_to_one_hot(actions: np.ndarray) -> torch.Tensor:
+    """
+    (T,) ACTION_DTYPE array -> (T, len(ACTION_KEYS)) float32 tensor, same values as the old
+    utils.one_hot_actions: buttons as is, camera bins mapped to [-1, 1].
+    """
+    buttons = np.stack([actions[key] for key in BUTTON_KEYS], axis=-1).astype(np.float32)
+    assert buttons.max(initial=0) <= 1, f"Action value must be in [0, 1] got {buttons.max()}"
+    camera = (actions["camera"].astype(np.float32) - CAMERA_NUM_BUCKETS) / CAMERA_NUM_BUCKETS
+    assert np.all(np.abs(camera) <= 1 + 1e-3), f"Camera action value must be in [-1, 1], got {camera[np.abs(camera) > 1 + 1e-3][0]}"
+
+    one_hot = np.empty((len(actions), len(ACTION_KEYS)), dtype=np.float32)
+    button_columns = [j for j, key in enumerate(ACTION_KEYS) if not key.startswith("camera")]
+    one_hot[:, button_columns] = buttons
+    one_hot[:, ACTION_KEYS.index("cameraX")] = camera[:, 0]
+    one_hot[:, ACTION_KEYS.index("cameraY")] = camera[:, 1]
+    return torch.from_numpy(one_hot)
+
+
+def save_actions(path, actions: np.ndarray):
+    assert actions.dtype == ACTION_DTYPE, f"expected ACTION_DTYPE, got {actions.dtype}"
+    with open(path, "wb") as f:  # np.save would append .npy to paths without it
+        np.save(f, actions)
+
+
+def load_actions_array(path) -> np.ndarray:
+    """
+    Loads a recording saved with save_actions (.npy) or an old pickled list of dicts (.pt).
+    """
+    if str(path).endswith(".npy"):
+        return np.load(path)
+    return actions_from_dicts(torch.load(path, weights_only=False))
+
+
+def load_one_hot_actions(path) -> torch.Tensor:
+    return actions_to_one_hot(load_actions_array(path))
+
+
+def find_actions_file(data_dir, video_id):
+    """
+    Returns the actions file of training/replay_<video_id>.mp4, preferring the converted .npy, or None.
+    """
+    for extension in (".npy", ".pt"):
+        path = os.path.join(data_dir, f"actions_{video_id}{extension}")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def convert_actions_file(path, output_path=None):
+    """
+    Converts a pickled .pt action file into the .npy format next to it. Returns the output path.
+    """
+    if output_path is None:
+        output_path = str(path)[: -len(".pt")] + ".npy"
+    save_actions(output_path, actions_from_dicts(torch.load(path, weights_only=False)))
+    return output_path
@@ -2,15 +2,93 @@
 Based on https://github.com/buoyancy99/diffusion-forcing/blob/main/algorithms/diffusion_forcing/models/attention.py
 """
 
-from typing import Optional
+from typing import List, Optional
 from collections import namedtuple
 import torch
 from torch import nn
 from torch.nn import functional as F
-from einops import rearrange
+from einops import rearrange, repeat
 from oasis_library.rotary_embedding_torch import RotaryEmbedding, apply_rotary_emb
 
 
+class TemporalKVCache:
+    """
+    Per-block temporal keys/values of frames that have already been run through the DiT.
+    Keys are stored before the rotary embedding is applied, so the cached frames can be
+    re-rotated to their position in whatever window they end up attending from.
+    key_padding_mask: optional (B, T) bool tensor, False for the left padding added by stack()
+    """
+
+    def __init__(self, depth: int):
+        self.keys: List[Optional[torch.Tensor]] = [None] * depth
+        self.values: List[Optional[torch.Tensor]] = [None] * depth
+        self.key_padding_mask: Optional[torch.Tensor] = None
+
+    def __len__(self):
+        # number of cached frames
+        return 0 if self.keys[0] is None else self.keys[0].shape[-2]
+
+    def get(self, layer_idx: int):
+        return self.keys[layer_idx], self.values[layer_idx]
+
+    def append(self, layer_idx: int, k: torch.Tensor, v: torch.Tensor):
+        if self.keys[layer_idx] is None:
+            self.keys[layer_idx], self.values[layer_idx] = k, v
+        else:
+            self.keys[layer_idx] = torch.cat([self.keys[layer_idx], k], dim=-2)
+            self.values[layer_idx] = torch.cat([self.values[layer_idx], v], dim=-2)
+        if self.key_padding_mask is not None and layer_idx == len(self.keys) - 1:
+            new_mask = self.key_padding_mask.new_ones(self.key_padding_mask.shape[0], k.shape[-2])
+            self.key_padding_mask = torch.cat([self.key_padding_mask, new_mask], dim=1)
+
+    def reset(self):
+        self.keys = [None] * len(self.keys)
+        self.values = [None] * len(self.values)
+        self.key_padding_mask = None
+
+    def split(self, batch_size: int) -> List["TemporalKVCache"]:
+        """
+        Splits a cache prefilled for batch_size samples into one cache per sample.
+        """
+        caches = [TemporalKVCache(len(self.keys)) for _ in range(batch_size)]
+        for layer_idx, (k, v) in enumerate(zip(self.keys, self.values)):
+            if k is None:
+                continue
+            for cache, k_i, v_i in zip(caches, k.chunk(batch_size, dim=0), v.chunk(batch_size, dim=0)):
+                cache.keys[layer_idx], cache.values[layer_idx] = k_i, v_i
+        return caches
+
+    @classmethod
+    def stack(cls, caches: List["TemporalKVCache"]) -> "TemporalKVCache":
+        """
+        Stacks single-sample caches of possibly different lengths along the batch dimension.
+        Shorter caches are left padded and masked out, which keeps the rotary positions of the
+        real frames relative to the new frame the same as when they are run on their own.
+        """
+        stacked = cls(len(caches[0].keys))
+        lengths = [len(cache) for cache in caches]
+        max_len = max(lengths)
+        if max_len == 0:
+            return stacked
+        reference = next(cache for cache in caches if len(cache) == max_len)
+        for layer_idx in range(len(stacked.keys)):
+            ref_k = reference.keys[layer_idx]
+            keys, values = [], []
+            for cache, length in zip(caches, lengths):
+                k, v = cache.get(layer_idx)
+                if length < max_len:
+                    pad = ref_k.new_zeros(*ref_k.shape[:-2], max_len - length, ref_k.shape[-1])
+                    k = pad if k is None else torch.cat([pad, k], dim=-2)
+                    v = pad if v is None else torch.cat([pad, v], dim=-2)
+                keys.append(k)
+                values.append(v)
+            stacked.keys[layer_idx] = torch.cat(keys, dim=0)
+            stacked.values[layer_idx] = torch.cat(values, dim=0)
+        positions = torch.arange(max_len, device=ref_k.device)
+        stacked.key_padding_mask = positions[None] >= torch.tensor([max_len - length for length in lengths], device=ref_k.device)[:, None]
+        return stacked
+
+
 class TemporalAxialAttention(nn.Module):
     def __init__(
         self,
@@ -31,7 +109,11 @@ class TemporalAxialAttention(nn.Module):
         self.rotary_emb = rotary_emb
         self.is_causal = is_causal
 
-    def forward(self, x: torch.Tensor):
+    def forward(self, x: torch.Tensor, kv_cache: Optional[TemporalKVCache] = None, layer_idx: int = 0, update_cache: bool = False):
+        """
+        kv_cache: keys/values of earlier frames that x comes after. x attends to them as well as to itself.
+        update_cache: append the keys/values of x to kv_cache (used to prefill the context frames).
+        """
         B, T, H, W, D = x.shape
 
         q, k, v = self.to_qkv(x).chunk(3, dim=-1)
@@ -40,12 +122,38 @@ class TemporalAxialAttention(nn.Module):
         k = rearrange(k, "B T H W (h d) -> (B H W) h T d", h=self.heads)
         v = rearrange(v, "B T H W (h d) -> (B H W) h T d", h=self.heads)
 
-        q = self.rotary_emb.rotate_queries_or_keys(q, self.rotary_emb.freqs)
+        n_past = 0
+        key_padding_mask = None
+        if kv_cache is not None:
+            past_k, past_v = kv_cache.get(layer_idx)
+            key_padding_mask = kv_cache.key_padding_mask
+            if update_cache:
+                kv_cache.append(layer_idx, k, v)
+            if past_k is not None:
+                n_past = past_k.shape[-2]
+                k = torch.cat([past_k, k], dim=-2)
+                v = torch.cat([past_v, v], dim=-2)
+
+        q = self.rotary_emb.rotate_queries_or_keys(q, self.rotary_emb.freqs, offset=n_past)
         k = self.rotary_emb.rotate_queries_or_keys(k, self.rotary_emb.freqs)
 
         q, k, v = map(lambda t: t.contiguous(), (q, k, v))
 
-        x = F.scaled_dot_product_attention(query=q, key=k, value=v, is_causal=self.is_causal)
+        if key_padding_mask is not None and n_past > 0:
+            # padded batch of caches: mask the padding and keep the causal mask aligned to the end of the keys
+            attn_mask = torch.ones(T, n_past + T, dtype=torch.bool, device=x.device).tril(diagonal=n_past)
+            key_padding_mask = torch.cat([key_padding_mask[:, -n_past:], key_padding_mask.new_ones(B, T)], dim=1)
+            key_padding_mask = repeat(key_padding_mask, "B k -> (B H W) 1 1 k", H=H, W=W)
+            x = F.scaled_dot_product_attention(query=q, key=k, value=v, attn_mask=attn_mask & key_padding_mask)
+        elif n_past == 0 or not self.is_causal:
+            x = F.scaled_dot_product_attention(query=q, key=k, value=v, is_causal=self.is_causal)
+        elif T == 1:
+            # a single new frame sees every cached frame, no mask needed
+            x = F.scaled_dot_product_attention(query=q, key=k, value=v)
+        else:
+            # causal mask aligned to the end of the key sequence
+            attn_mask = torch.ones(T, n_past + T, dtype=torch.bool, device=x.device).tril(diagonal=n_past)
+            x = F.scaled_dot_product_attention(query=q, key=k, value=v, attn_mask=attn_mask)
 
         x = rearrange(x, "(B H W) h T d -> B T H W (h d)", B=B, H=H, W=W)
         x = x.to(q.dtype)
@@ -0,0 +1,37 @@
+"""
+The recorder's per-frame capture work, kept out of minecraft_recording.py (which needs a display and the
+input hooks just to import) so benchmarks/bench_data.py times the same code the recorder runs.
+"""
+
+from contextlib import nullcontext
+
+import cv2
+import numpy as np
+
+from find_health_bar_aspect_ratio import count_hearts_array
+
+# Size of the recorded frames
+FRAME_WIDTH, FRAME_HEIGHT = 640, 360
+
+
+def new_frame():
+    return np.empty((FRAME_HEIGHT, FRAME_WIDTH, 3), dtype=np.uint8)
+
+
+def process_frame(shot, action, frame_buffer, action_buffer, resized, lock=None):
+    """
+    Turns one BGRA screenshot into a FRAME_WIDTH x FRAME_HEIGHT BGR frame and appends it, with its actions
+    row, to frame_buffer and action_buffer (RingBuffers). Returns the heart count of the full-resolution
+    screenshot.
+    resized: scratch frame from new_frame(), reused between calls. The resize goes there outside the lock,
+             since the ring slot it would go to can still be the oldest frame a writer is copying
+    lock: held only for the frame copy and the appends
+    """
+    img = np.asarray(shot)[:, :, :3]
+    # 20 pixels of the health bar at precomputed coordinates (screenshots are BGRA)
+    hearts = count_hearts_array(img, channels=(2, 1, 0))
+    cv2.resize(img, (FRAME_WIDTH, FRAME_HEIGHT), dst=resized)  # the slow part
+    with lock if lock is not None else nullcontext():
+        frame_buffer.append(resized)
+        action_buffer.append(action)
+    return hearts
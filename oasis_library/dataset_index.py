@@ -0,0 +1,138 @@
+"""
+SQLite index of the training videos, written by build_dataset_index.py.
+
+One row per replay_*.mp4 with everything segment selection needs, so train.py never has to glob the
+folder or open a video just to find out whether a segment is usable:
+    videos  video_path, actions_path (NULL if the actions are missing), num_frames, num_actions,
+            size/mtime of the video and mtime of the actions file (to skip unchanged files when
+            re-indexing),
+            brightness (float16 mean pixel value per frame in [0, 1]), health (uint8 hearts per frame)
+    events  (video, frame, kind) with kind "damage" or "death", same rules as the recorder's triggers
+Paths are stored relative to the index file, so the index moves with the data folder.
+"""
+
+import os
+import sqlite3
+
+import numpy as np
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    id INTEGER PRIMARY KEY,
+    video_path TEXT UNIQUE NOT NULL,
+    actions_path TEXT,
+    num_frames INTEGER NOT NULL,
+    num_actions INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    brightness BLOB NOT NULL,
+    health BLOB,
+    actions_mtime REAL
+);
+CREATE TABLE IF NOT EXISTS events (
+    video INTEGER NOT NULL REFERENCES videos(id) ON DELETE CASCADE,
+    frame INTEGER NOT NULL,
+    kind TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_video ON events(video);
+"""
+
+
+class DatasetIndex:
+    def __init__(self, path):
+        self.path = path
+        self.root = os.path.dirname(os.path.abspath(path))
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.executescript(SCHEMA)
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(videos)")]
+        if "actions_mtime" not in columns:
+            # indexes from before actions_mtime existed; their rows count as stale until re-indexed
+            with self.db:
+                self.db.execute("ALTER TABLE videos ADD COLUMN actions_mtime REAL")
+
+    def _relative(self, path):
+        return None if path is None else os.path.relpath(os.path.abspath(path), self.root)
+
+    def _absolute(self, path):
+        return None if path is None else os.path.normpath(os.path.join(self.root, path))
+
+    @staticmethod
+    def _mtime(path):
+        return None if path is None else os.stat(path).st_mtime
+
+    def is_current(self, video_path, actions_path=None):
+        """
+        True if video_path is indexed with actions_path (None: no actions file) and neither changed since.
+        """
+        stat = os.stat(video_path)
+        row = self.db.execute("SELECT size, mtime, actions_path, actions_mtime FROM videos WHERE video_path = ?", (self._relative(video_path),)).fetchone()
+        if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime:
+            return False
+        return row[2] == self._relative(actions_path) and row[3] == self._mtime(actions_path)
+
+    def add_video(self, video_path, actions_path, num_actions, brightness, health=None, events=()):
+        """
+        Inserts or replaces the entry of one video. events: iterable of (frame, kind).
+        """
+        stat = os.stat(video_path)
+        with self.db:
+            self.db.execute("DELETE FROM videos WHERE video_path = ?", (self._relative(video_path),))
+            cursor = self.db.execute(
+                "INSERT INTO videos (video_path, actions_path, num_frames, num_actions, size, mtime, brightness, health, actions_mtime) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self._relative(video_path),
+                    self._relative(actions_path),
+                    len(brightness),
+                    num_actions,
+                    stat.st_size,
+                    stat.st_mtime,
+                    np.asarray(brightness, dtype=np.float16).tobytes(),
+                    None if health is None else np.asarray(health, dtype=np.uint8).tobytes(),
+                    self._mtime(actions_path),
+                ),
+            )
+            self.db.executemany("INSERT INTO events (video, frame, kind) VALUES (?, ?, ?)", [(cursor.lastrowid, int(frame), kind) for frame, kind in events])
+
+    def remove_missing(self):
+        """
+        Drops entries whose video no longer exists. Returns how many were dropped.
+        """
+        missing = [(path,) for (path,) in self.db.execute("SELECT video_path FROM videos") if not os.path.exists(self._absolute(path))]
+        with self.db:
+            self.db.executemany("DELETE FROM videos WHERE video_path = ?", missing)
+        return len(missing)
+
+    def videos(self, with_actions=True):
+        """
+        Returns the indexed videos (ordered by path) as dicts with numpy brightness/health arrays and
+        sorted "damage" and "deaths" frame arrays. With with_actions, videos whose actions file has
+        been deleted since indexing are left out too.
+        """
+        query = "SELECT id, video_path, actions_path, num_frames, num_actions, brightness, health FROM videos"
+        if with_actions:
+            query += " WHERE actions_path IS NOT NULL"
+        events = {}
+        for video, frame, kind in self.db.execute("SELECT video, frame, kind FROM events ORDER BY frame"):
+            events.setdefault((video, kind), []).append(frame)
+        videos = []
+        for video, video_path, actions_path, num_frames, num_actions, brightness, health in self.db.execute(query + " ORDER BY video_path"):
+            if with_actions and not os.path.exists(self._absolute(actions_path)):
+                print(f"⚠️ {actions_path} is gone, re-run build_dataset_index.py. Skipping {video_path}.")
+                continue
+            videos.append(
+                {
+                    "video_path": self._absolute(video_path),
+                    "actions_path": self._absolute(actions_path),
+                    "num_frames": num_frames,
+                    "num_actions": num_actions,
+                    "brightness": np.frombuffer(brightness, dtype=np.float16).astype(np.float32),
+                    "health": None if health is None else np.frombuffer(health, dtype=np.uint8),
+                    "damage": np.array(events.get((video, "damage"), []), dtype=np.int64),
+                    "deaths": np.array(events.get((video, "death"), []), dtype=np.int64),
+                }
+            )
+        return videos
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,223 @@
+"""
+torch.utils.data pipeline for train.py.
+
+Segments are identified by (video index, first frame). The sampler picks which segments to train on,
+the dataset decodes them (or reads them from the latent cache) inside the DataLoader workers, so the
+main process only has to move ready batches to the device.
+"""
+
+import glob
+import os
+from functools import lru_cache
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset, Sampler
+
+from oasis_library.latent_cache import LatentCache
+from oasis_library.actions import find_actions_file, load_one_hot_actions
+from oasis_library.video_reader import num_frames, read_frames
+
+DARKNESS_THRESHOLD = 0.25  # segments with a lower mean pixel value are skipped
+
+
+@lru_cache(maxsize=64)
+def _load_one_hot_actions(actions_path):
+    # every worker converts each actions file once, not once per segment
+    return load_one_hot_actions(actions_path)
+
+
+class VideoSegmentDataset(Dataset):
+    """
+    Pairs every training/replay_<id>.mp4 with training/actions_<id>.npy (or the older actions_<id>.pt).
+    Items are (frames, actions): (total_frames, H, W, C) uint8 and (total_frames, action_dim) float32,
+    or None for segments that are too dark.
+    """
+
+    def __init__(self, data_dir, total_frames, video_files=None):
+        self.total_frames = total_frames
+        self.video_files = []
+        self.actions_files = []
+        if video_files is None:
+            video_files = sorted(glob.glob(os.path.join(data_dir, "replay_*.mp4")))
+        for video_path in video_files:
+            video_id = os.path.basename(video_path).split("replay_")[1].split(".mp4")[0]
+            actions_path = find_actions_file(data_dir, video_id)
+            if actions_path is None:
+                print(f"⚠️ Skipping {video_id}: missing actions file.")
+                continue
+            self.video_files.append(video_path)
+            self.actions_files.append(actions_path)
+        self.lengths = [num_frames(video_path) for video_path in self.video_files]
+
+    @classmethod
+    def from_index(cls, videos, total_frames):
+        """
+        Builds the dataset from DatasetIndex.videos() without touching the data folder.
+        """
+        dataset = cls.__new__(cls)
+        dataset.total_frames = total_frames
+        dataset.video_files = [video["video_path"] for video in videos]
+        dataset.actions_files = [video["actions_path"] for video in videos]
+        dataset.lengths = [min(video["num_frames"], video["num_actions"]) for video in videos]
+        return dataset
+
+    def __len__(self):
+        return len(self.video_files)
+
+    def __getitem__(self, index):
+        video_idx, segment_start = index
+        segment_end = segment_start + self.total_frames
+        frames = read_frames(self.video_files[video_idx], segment_start, segment_end)
+        if frames.mean(dtype=torch.float32) / 255 < DARKNESS_THRESHOLD:
+            return None
+        actions = _load_one_hot_actions(self.actions_files[video_idx])[segment_start:segment_end]
+        return frames, actions
+
+
+class CachedSegmentDataset(Dataset):
+    """
+    Same segments read from the shards written by precompute_latents.py.
+    Items are (latents, actions): (total_frames, C, h, w) and (total_frames, action_dim) float32, or None.
+    With world_size > 1 only every world_size-th cached video (starting at rank) is used.
+    """
+
+    def __init__(self, cache_dir, total_frames, rank=0, world_size=1):
+        self.total_frames = total_frames
+        self.cache = LatentCache(cache_dir)
+        self.cache.videos = self.cache.videos[rank::world_size]
+        self.lengths = [video["length"] for video in self.cache.videos]
+
+    def __len__(self):
+        return len(self.cache)
+
+    def __getitem__(self, index):
+        video_idx, segment_start = index
+        brightness = self.cache.brightness(video_idx)[segment_start : segment_start + self.total_frames]
+        if brightness.mean() < DARKNESS_THRESHOLD:
+            return None
+        return self.cache.segment(video_idx, segment_start, self.total_frames)
+
+
+class EndWeightedSegmentSampler(Sampler):
+    """
+    Draws segments_per_video segment starts from every long enough video, biased quadratically towards
+    the end of the video (where the player gets damaged/killed in our recordings). New starts are drawn
+    every epoch. Segments come video by video unless shuffle is set, which mixes videos within a batch.
+    """
+
+    def __init__(self, lengths, total_frames, segments_per_video, shuffle=False):
+        self.lengths = lengths
+        self.total_frames = total_frames
+        self.segments_per_video = segments_per_video
+        self.shuffle = shuffle
+        for video_idx, N in enumerate(lengths):
+            if N < total_frames:
+                print(f"⚠️ Skipping video {video_idx}: not enough frames ({N} < {total_frames})")
+
+    def __len__(self):
+        return sum(self.segments_per_video for N in self.lengths if N >= self.total_frames)
+
+    def __iter__(self):
+        segments = []
+        for video_idx, N in enumerate(self.lengths):
+            if N < self.total_frames:
+                continue
+            max_start = N - self.total_frames
+            weights = np.linspace(1, max_start + 1, max_start + 1) ** 2  # Quadratic bias
+            weights = weights / weights.sum()
+            for segment_start in np.random.choice(np.arange(max_start + 1), size=self.segments_per_video, p=weights):
+                segments.append((video_idx, int(segment_start)))
+        if self.shuffle:
+            np.random.shuffle(segments)
+        return iter(segments)
+
+
+def segment_weights(lengths, brightness, total_frames, damage=None, damage_weight=0.0, n_prompt_frames=0):
+    """
+    Enumerates every usable segment of every video: long enough and not too dark (the same test as the
+    datasets, done on the indexed per-frame brightness). Within a video segments keep the quadratic
+    end bias of EndWeightedSegmentSampler, optionally boosted by (1 + damage_weight) when a damage or
+    death frame falls among the segment's target frames. Every video with a usable segment gets the
+    same total weight.
+    Returns (video_idx, segment_start, weight) arrays.
+    """
+    video_idx, starts, weights = [], [], []
+    for i, (N, frame_brightness) in enumerate(zip(lengths, brightness)):
+        if N < total_frames:
+            continue
+        segment_start = np.arange(N - total_frames + 1)
+        cumsum = np.concatenate([[0.0], np.cumsum(frame_brightness[:N], dtype=np.float64)])
+        segment_brightness = (cumsum[segment_start + total_frames] - cumsum[segment_start]) / total_frames
+        w = (segment_start + 1.0) ** 2  # Quadratic bias
+        w[segment_brightness < DARKNESS_THRESHOLD] = 0
+        if damage is not None and damage_weight and len(damage[i]):
+            # number of damage frames in [start + n_prompt_frames, start + total_frames)
+            hits = np.searchsorted(damage[i], segment_start + total_frames) - np.searchsorted(damage[i], segment_start + n_prompt_frames)
+            w *= np.where(hits > 0, 1.0 + damage_weight, 1.0)
+        valid = w > 0
+        if not valid.any():
+            continue
+        video_idx.append(np.full(valid.sum(), i, dtype=np.int32))
+        starts.append(segment_start[valid].astype(np.int32))
+        weights.append(w[valid] / w[valid].sum())
+    if not weights:
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32), np.zeros(0)
+    return np.concatenate(video_idx), np.concatenate(starts), np.concatenate(weights)
+
+
+def build_alias_table(weights):
+    """
+    Vose's alias method: after this O(n) setup each weighted draw costs one uniform index and one coin flip.
+    Returns (prob, alias) arrays.
+    """
+    n = len(weights)
+    scaled = np.asarray(weights, dtype=np.float64) * n / np.sum(weights)
+    prob = np.ones(n)
+    alias = np.arange(n)
+    small = [i for i in range(n) if scaled[i] < 1.0]
+    large = [i for i in range(n) if scaled[i] >= 1.0]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        prob[s] = scaled[s]
+        alias[s] = l
+        scaled[l] -= 1.0 - scaled[s]
+        (small if scaled[l] < 1.0 else large).append(l)
+    # whatever is left over has probability 1 up to rounding
+    return prob, alias
+
+
+class AliasSegmentSampler(Sampler):
+    """
+    Draws num_samples segments per epoch from one global alias table over all usable segments (see
+    segment_weights), so dark or too short segments are never decoded and draws are O(1).
+    """
+
+    def __init__(self, video_idx, segment_starts, weights, num_samples):
+        if not len(weights):
+            # e.g. a distributed rank whose share of the videos is all too short or too dark
+            print("⚠️ No usable segments, the sampler is empty.")
+            num_samples = 0
+        self.video_idx = video_idx
+        self.segment_starts = segment_starts
+        self.num_samples = num_samples
+        self.prob, self.alias = build_alias_table(weights) if num_samples else (np.ones(0), np.zeros(0, dtype=np.int64))
+
+    def __len__(self):
+        return self.num_samples
+
+    def __iter__(self):
+        columns = np.random.randint(len(self.prob), size=self.num_samples)
+        picks = np.where(np.random.random(self.num_samples) < self.prob[columns], columns, self.alias[columns])
+        for pick in picks:
+            yield int(self.video_idx[pick]), int(self.segment_starts[pick])
+
+
+def collate_segments(batch):
+    """
+    Stacks the segments that survived the darkness filter, or returns None if none did.
+    """
+    batch = [item for item in batch if item is not None]
+    if not batch:
+        return None
+    return tuple(torch.stack(tensors) for tensors in zip(*batch))
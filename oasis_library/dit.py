@@ -8,9 +8,11 @@ References:
 from typing import Optional, Literal
 import torch
 from torch import nn
+from torch.utils.checkpoint import checkpoint
 from oasis_library.rotary_embedding_torch import RotaryEmbedding
 from einops import rearrange
-from oasis_library.attention import SpatialAxialAttention, TemporalAxialAttention
+from oasis_library.attention import SpatialAxialAttention, TemporalAxialAttention, TemporalKVCache
+from oasis_library.profiling import maybe_instrument
 from timm.models.vision_transformer import Mlp
 from timm.layers.helpers import to_2tuple
 import math
@@ -176,18 +178,37 @@ class SpatioTemporalDiTBlock(nn.Module):
         )
         self.t_adaLN_modulation = nn.Sequential(nn.SiLU(), nn.Linear(hidden_size, 6 * hidden_size, bias=True))
 
-    def forward(self, x, c):
-        B, T, H, W, D = x.shape
+        # which half of the block recomputes its activations in the backward pass instead of storing them
+        self.gradient_checkpointing: Optional[Literal["spatial", "temporal", "both"]] = None
 
-        # spatial block
+    def spatial_forward(self, x, c):
         s_shift_msa, s_scale_msa, s_gate_msa, s_shift_mlp, s_scale_mlp, s_gate_mlp = self.s_adaLN_modulation(c).chunk(6, dim=-1)
         x = x + gate(self.s_attn(modulate(self.s_norm1(x), s_shift_msa, s_scale_msa)), s_gate_msa)
         x = x + gate(self.s_mlp(modulate(self.s_norm2(x), s_shift_mlp, s_scale_mlp)), s_gate_mlp)
+        return x
 
-        # temporal block
+    def temporal_forward(self, x, c, kv_cache=None, layer_idx=0, update_cache=False):
         t_shift_msa, t_scale_msa, t_gate_msa, t_shift_mlp, t_scale_mlp, t_gate_mlp = self.t_adaLN_modulation(c).chunk(6, dim=-1)
-        x = x + gate(self.t_attn(modulate(self.t_norm1(x), t_shift_msa, t_scale_msa)), t_gate_msa)
+        x = x + gate(self.t_attn(modulate(self.t_norm1(x), t_shift_msa, t_scale_msa), kv_cache, layer_idx, update_cache), t_gate_msa)
         x = x + gate(self.t_mlp(modulate(self.t_norm2(x), t_shift_mlp, t_scale_mlp)), t_gate_mlp)
+        return x
+
+    def forward(self, x, c, kv_cache=None, layer_idx=0, update_cache=False):
+        B, T, H, W, D = x.shape
+        # only worth it when gradients are tracked; sampling with a kv cache never checkpoints
+        checkpointing = self.gradient_checkpointing if torch.is_grad_enabled() and kv_cache is None else None
+
+        # spatial block
+        if checkpointing in ("spatial", "both"):
+            x = checkpoint(self.spatial_forward, x, c, use_reentrant=False)
+        else:
+            x = self.spatial_forward(x, c)
+
+        # temporal block
+        if checkpointing in ("temporal", "both"):
+            x = checkpoint(self.temporal_forward, x, c, use_reentrant=False)
+        else:
+            x = self.temporal_forward(x, c, kv_cache, layer_idx, update_cache)
 
         return x
 
@@ -241,6 +262,7 @@ class DiT(nn.Module):
 
         self.final_layer = FinalLayer(hidden_size, patch_size, self.out_channels)
         self.initialize_weights()
+        maybe_instrument(self)  # only does something with OASIS_PROFILE=1, see profiling.py
 
     def initialize_weights(self):
         # Initialize transformer layers:
@@ -289,13 +311,7 @@ class DiT(nn.Module):
         imgs = x.reshape(shape=(x.shape[0], c, h * p, w * p))
         return imgs
 
-    def forward(self, x, t, external_cond=None):
-        """
-        Forward pass of DiT.
-        x: (B, T, C, H, W) tensor of spatial inputs (images or latent representations of images)
-        t: (B, T,) tensor of diffusion timesteps
-        """
-
+    def embed(self, x, t, external_cond=None):
         B, T, C, H, W = x.shape
 
         # add spatial embeddings
@@ -309,8 +325,49 @@ class DiT(nn.Module):
         c = rearrange(c, "(b t) d -> b t d", t=T)
         if torch.is_tensor(external_cond):
             c += self.external_cond(external_cond)
+        return x, c
+
+    def set_gradient_checkpointing(self, mode: Optional[Literal["spatial", "temporal", "both"]] = "both"):
+        """
+        Trades compute for memory during training: the chosen half of every block ("spatial", "temporal"
+        or "both") is recomputed in the backward pass instead of keeping its activations. None turns it off.
+        """
+        assert mode in (None, "spatial", "temporal", "both"), f"unknown gradient checkpointing mode {mode}"
         for block in self.blocks:
-            x = block(x, c)  # (N, T, H, W, D)
+            block.gradient_checkpointing = mode
+
+    def new_kv_cache(self):
+        return TemporalKVCache(len(self.blocks))
+
+    def prefill(self, x, t, kv_cache, external_cond=None):
+        """
+        Runs context frames through the blocks once and appends their temporal keys/values to kv_cache.
+        The temporal attention is causal, so as long as the context frames keep the same noise level
+        their activations do not depend on the frames that come after them, and every later call to
+        forward(..., kv_cache=kv_cache) only has to compute the new frames.
+        x: (B, T, C, H, W) context frames, following any frames already in kv_cache
+        t: (B, T,) tensor of diffusion timesteps of the context frames
+        """
+        if x.shape[1] == 0:
+            return kv_cache
+        x, c = self.embed(x, t, external_cond)
+        for i, block in enumerate(self.blocks):
+            x = block(x, c, kv_cache, i, update_cache=True)
+        return kv_cache
+
+    def forward(self, x, t, external_cond=None, kv_cache=None):
+        """
+        Forward pass of DiT.
+        x: (B, T, C, H, W) tensor of spatial inputs (images or latent representations of images)
+        t: (B, T,) tensor of diffusion timesteps
+        kv_cache: optional TemporalKVCache filled by prefill(); x is then treated as the frames that follow the cached ones
+        """
+
+        B, T, C, H, W = x.shape
+
+        x, c = self.embed(x, t, external_cond)
+        for i, block in enumerate(self.blocks):
+            x = block(x, c, kv_cache, i)  # (N, T, H, W, D)
         x = self.final_layer(x, c)  # (N, T, H, W, patch_size ** 2 * out_channels)
         # unpatchify
         x = rearrange(x, "b t h w d -> (b t) h w d")
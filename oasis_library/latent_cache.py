@@ -0,0 +1,118 @@
+"""
+Precomputed VAE latents for training.
+
+The VAE is frozen during fine-tuning, so every replay_*.mp4 is encoded once (see precompute_latents.py)
+and train.py reads segments straight from memory-mapped shards:
+    shard_00000.latents.npy     (N, 16, 18, 32) float16, already multiplied by the scaling factor
+    shard_00000.actions.npy     (N, 25) float32, one-hot actions in ACTION_KEYS order
+    shard_00000.brightness.npy  (N,) float32, mean pixel value of each frame in [0, 1]
+    index.json                  one entry per video: {"video_id", "shard", "start", "length"}
+"""
+
+import json
+import os
+
+import numpy as np
+import torch
+from einops import rearrange
+
+INDEX_FILE = "index.json"
+
+
+def shard_path(cache_dir, shard, kind):
+    return os.path.join(cache_dir, f"shard_{shard:05d}.{kind}.npy")
+
+
+@torch.no_grad()
+def encode_video(vae, video, device, batch_frames=32, scaling_factor=0.07843137255):
+    """
+    video: (T, H, W, C) uint8 tensor
+    Returns (T, C, h, w) float16 latents and (T,) float32 per-frame brightness, both as numpy arrays.
+    """
+    latents = []
+    brightness = []
+    for start in range(0, video.shape[0], batch_frames):
+        x = video[start : start + batch_frames].to(device).float() / 255
+        brightness.append(x.mean(dim=(1, 2, 3)).cpu())
+        x = rearrange(x, "t h w c -> t c h w")
+        H, W = x.shape[-2:]
+        # same fp32 encoding as train.py
+        x = vae.encode(x * 2 - 1).mean * scaling_factor
+        x = rearrange(x, "t (h w) c -> t c h w", h=H // vae.patch_size, w=W // vae.patch_size)
+        latents.append(x.half().cpu())
+    return torch.cat(latents).numpy(), torch.cat(brightness).numpy()
+
+
+class LatentShardWriter:
+    """
+    Buffers encoded videos and writes them out as one shard every frames_per_shard frames.
+    """
+
+    def __init__(self, cache_dir, frames_per_shard=20000):
+        self.cache_dir = cache_dir
+        self.frames_per_shard = frames_per_shard
+        self.index = []
+        self.shard = 0
+        self.buffer = []
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def add(self, video_id, latents, actions, brightness):
+        assert len(latents) == len(actions) == len(brightness), f"{video_id}: {len(latents)} frames but {len(actions)} actions"
+        self.buffer.append((video_id, latents, actions, brightness))
+        if sum(len(item[1]) for item in self.buffer) >= self.frames_per_shard:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        start = 0
+        for video_id, latents, _, _ in self.buffer:
+            self.index.append({"video_id": video_id, "shard": self.shard, "start": start, "length": len(latents)})
+            start += len(latents)
+        np.save(shard_path(self.cache_dir, self.shard, "latents"), np.concatenate([item[1] for item in self.buffer]).astype(np.float16))
+        np.save(shard_path(self.cache_dir, self.shard, "actions"), np.concatenate([item[2] for item in self.buffer]).astype(np.float32))
+        np.save(shard_path(self.cache_dir, self.shard, "brightness"), np.concatenate([item[3] for item in self.buffer]).astype(np.float32))
+        self.buffer = []
+        self.shard += 1
+
+    def close(self):
+        self.flush()
+        with open(os.path.join(self.cache_dir, INDEX_FILE), "w") as f:
+            json.dump(self.index, f, indent=1)
+
+
+class LatentCache:
+    """
+    Read side of the cache. Shards are opened lazily and memory-mapped, so only the frames of the
+    segments that are actually sampled are read from disk.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        with open(os.path.join(cache_dir, INDEX_FILE)) as f:
+            self.videos = json.load(f)
+        self._shards = {}
+
+    def __len__(self):
+        return len(self.videos)
+
+    def _open(self, shard):
+        if shard not in self._shards:
+            self._shards[shard] = {kind: np.load(shard_path(self.cache_dir, shard, kind), mmap_mode="r") for kind in ("latents", "actions", "brightness")}
+        return self._shards[shard]
+
+    def brightness(self, video_idx):
+        video = self.videos[video_idx]
+        return self._open(video["shard"])["brightness"][video["start"] : video["start"] + video["length"]]
+
+    def segment(self, video_idx, segment_start, length):
+        """
+        Returns (length, C, h, w) float32 latents and (length, num_actions) float32 actions.
+        """
+        video = self.videos[video_idx]
+        shard = self._open(video["shard"])
+        start = video["start"] + segment_start
+        assert segment_start + length <= video["length"]
+        latents = torch.from_numpy(np.array(shard["latents"][start : start + length])).float()
+        actions = torch.from_numpy(np.array(shard["actions"][start : start + length]))
+        return latents, actions
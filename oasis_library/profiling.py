@@ -0,0 +1,318 @@
+"""
+Opt-in per-module profiling of DiT and the VAE.
+
+Instrumented models get forward hooks on their interesting sub-modules and timing wrappers around a few
+methods, which record the wall time (and on cuda the allocated memory) of every call:
+    DiT          x_embedder, t_embedder, external_cond, every SpatioTemporalDiTBlock, its spatial_forward /
+                 temporal_forward halves and their norms, attentions, Mlps and adaLN modulations,
+                 final_layer, unpatchify, prefill
+    AutoencoderKL  patch_embed, encode, decode, every encoder/decoder AttentionBlock and its attn, mlp and
+                 norms, quant_conv, post_quant_conv, predictor, unpatchify
+Calls nest, so besides its total time every entry has a self time: what is left after its instrumented
+children, i.e. the rearranges, modulate/gate and residual adds around them.
+
+Nothing is hooked unless profiling is turned on, so there is no overhead at all when it is off.
+    OASIS_PROFILE=1 python generate_video.py ...   # every DiT/AutoencoderKL built is instrumented, and the
+                                                   # table plus a Chrome trace are written at exit
+                                                   # (OASIS_PROFILE_OUTPUT=<prefix>, default oasis_profile)
+or from code:
+    with profiling.profile(model, vae):
+        ...
+    profiling.print_summary()
+    profiling.export_chrome_trace("trace.json")    # open in chrome://tracing or https://ui.perfetto.dev
+"""
+
+import atexit
+import csv
+import functools
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import torch
+
+ENABLED = os.environ.get("OASIS_PROFILE", "0") not in ("", "0")
+OUTPUT_PREFIX = os.environ.get("OASIS_PROFILE_OUTPUT", "oasis_profile")
+# Trace events kept for export, the aggregated stats keep counting after that
+MAX_TRACE_EVENTS = 1_000_000
+
+# Every instance of these is timed together with its direct children
+INSTRUMENTED_MODULES = {"SpatioTemporalDiTBlock", "FinalLayer", "AttentionBlock"}
+# Methods timed where they exist, with the name they are recorded under
+INSTRUMENTED_METHODS = {
+    "spatial_forward": "spatial",
+    "temporal_forward": "temporal",
+    "unpatchify": "unpatchify",
+    "prefill": "prefill",
+    "encode": "encode",
+    "decode": "decode",
+}
+
+_local = threading.local()
+_lock = threading.Lock()
+_trace = []
+_stats = {}
+_origin = time.perf_counter()
+_handles = {}  # id(model) -> (model, hook handles, wrapped method owners)
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+def _cuda_sync():
+    if torch.cuda.is_available() and torch.cuda.is_initialized():
+        torch.cuda.synchronize()
+        return True
+    return False
+
+
+def _tensor_bytes(output):
+    if torch.is_tensor(output):
+        return output.numel() * output.element_size()
+    if isinstance(output, (tuple, list)):
+        return sum(_tensor_bytes(o) for o in output)
+    return 0
+
+
+def _enter(name):
+    on_cuda = _cuda_sync()
+    stack = _stack()
+    frame = {"name": name, "children": 0.0, "peak": 0, "memory": 0}
+    if on_cuda:
+        # the running peak of the parent has to be saved before the counter is reset for this call
+        if stack:
+            stack[-1]["peak"] = max(stack[-1]["peak"], torch.cuda.max_memory_allocated())
+        torch.cuda.reset_peak_memory_stats()
+        frame["memory"] = torch.cuda.memory_allocated()
+    frame["start"] = time.perf_counter()
+    stack.append(frame)
+
+
+def _exit(output=None):
+    on_cuda = _cuda_sync()
+    end = time.perf_counter()
+    stack = _stack()
+    frame = stack.pop()
+    duration = end - frame["start"]
+    allocated = peak = 0
+    if on_cuda:
+        peak = max(frame["peak"], torch.cuda.max_memory_allocated())
+        allocated = torch.cuda.memory_allocated() - frame["memory"]
+        peak -= frame["memory"]
+    if stack:
+        stack[-1]["children"] += duration
+        if on_cuda:
+            stack[-1]["peak"] = max(stack[-1]["peak"], peak + frame["memory"])
+    _record(frame["name"], frame["start"], duration, duration - frame["children"], _tensor_bytes(output), allocated, peak)
+
+
+def _record(name, start, duration, self_time, output_bytes, allocated, peak):
+    group = re.sub(r"\.\d+(?=\.|$)", ".*", name)
+    with _lock:
+        stats = _stats.setdefault(group, {"calls": 0, "total": 0.0, "self": 0.0, "output_bytes": 0, "allocated": 0, "peak": 0})
+        stats["calls"] += 1
+        stats["total"] += duration
+        stats["self"] += self_time
+        stats["output_bytes"] += output_bytes
+        stats["allocated"] += allocated
+        stats["peak"] = max(stats["peak"], peak)
+        if len(_trace) < MAX_TRACE_EVENTS:
+            _trace.append((name, start, duration, threading.get_ident(), output_bytes, allocated, peak))
+
+
+def _timed_method(name, method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        _enter(name)
+        output = None
+        try:
+            output = method(*args, **kwargs)
+            return output
+        finally:
+            _exit(output)
+
+    return wrapper
+
+
+def _instrument_module(module, name, handles):
+    handles.append(module.register_forward_pre_hook(lambda module, args: _enter(name)))
+    handles.append(module.register_forward_hook(lambda module, args, output: _exit(output)))
+
+
+def instrument(model, name=None):
+    """
+    Hooks model (a DiT or AutoencoderKL, or anything containing them) for profiling. Returns model.
+    """
+    if id(model) in _handles:
+        return model
+    root = name or type(model).__name__
+    handles, owners = [], []
+    instrumented_parents = {""}
+    for module_name, module in model.named_modules():
+        full_name = f"{root}.{module_name}" if module_name else root
+        parent = module_name.rsplit(".", 1)[0] if "." in module_name else ""
+        if module_name == "" or parent in instrumented_parents or type(module).__name__ in INSTRUMENTED_MODULES:
+            _instrument_module(module, full_name, handles)
+            if type(module).__name__ in INSTRUMENTED_MODULES:
+                instrumented_parents.add(module_name)
+            for method, label in INSTRUMENTED_METHODS.items():
+                if callable(getattr(type(module), method, None)) and method not in vars(module):
+                    # an instance attribute shadows the class method until it is deleted again
+                    setattr(module, method, _timed_method(f"{full_name}.{label}", getattr(module, method)))
+                    owners.append((module, method))
+    _handles[id(model)] = (model, handles, owners)
+    return model
+
+
+def remove_instrumentation(model):
+    model, handles, owners = _handles.pop(id(model), (model, [], []))
+    for handle in handles:
+        handle.remove()
+    for module, method in owners:
+        delattr(module, method)
+
+
+def maybe_instrument(model):
+    """
+    Called by the DiT and AutoencoderKL constructors, instruments the new model only if profiling is on.
+    """
+    if ENABLED:
+        instrument(model)
+    return model
+
+
+def enable():
+    """
+    Instrument every DiT/AutoencoderKL constructed from now on (same as OASIS_PROFILE=1).
+    """
+    global ENABLED
+    if not ENABLED:
+        atexit.register(_write_at_exit)
+    ENABLED = True
+
+
+def disable():
+    global ENABLED
+    if ENABLED:
+        atexit.unregister(_write_at_exit)
+    ENABLED = False
+
+
+def reset():
+    global _origin
+    with _lock:
+        _trace.clear()
+        _stats.clear()
+        _origin = time.perf_counter()
+
+
+@contextmanager
+def profile(*models, trace_path=None):
+    """
+    Instruments models for the duration of the block (starting from empty stats) and removes the hooks
+    afterwards. Optionally writes a Chrome trace at the end.
+    """
+    reset()
+    for model in models:
+        instrument(model)
+    try:
+        yield
+    finally:
+        for model in models:
+            remove_instrumentation(model)
+        if trace_path is not None:
+            export_chrome_trace(trace_path)
+
+
+def summary():
+    """
+    Aggregated stats per module, with layer indices folded together (blocks.*.s_attn), sorted by self time.
+    Times in ms, memory in MB (allocated: net change over all calls, peak: largest single call, cuda only).
+    """
+    with _lock:
+        stats = {name: dict(entry) for name, entry in _stats.items()}
+    total_self = sum(entry["self"] for entry in stats.values()) or 1.0
+    rows = []
+    for name, entry in stats.items():
+        rows.append(
+            {
+                "name": name,
+                "calls": entry["calls"],
+                "total_ms": entry["total"] * 1000,
+                "self_ms": entry["self"] * 1000,
+                "mean_ms": entry["total"] * 1000 / entry["calls"],
+                "self_percent": 100 * entry["self"] / total_self,
+                "output_mb": entry["output_bytes"] / 2**20,
+                "allocated_mb": entry["allocated"] / 2**20,
+                "peak_mb": entry["peak"] / 2**20,
+            }
+        )
+    rows.sort(key=lambda row: row["self_ms"], reverse=True)
+    return rows
+
+
+def print_summary(limit=40):
+    rows = summary()
+    print(f"{'module':<45} {'calls':>8} {'total ms':>11} {'self ms':>11} {'self %':>7} {'mean ms':>9} {'peak MB':>9}")
+    for row in rows[:limit]:
+        print(
+            f"{row['name']:<45} {row['calls']:>8} {row['total_ms']:>11.2f} {row['self_ms']:>11.2f} "
+            f"{row['self_percent']:>6.1f}% {row['mean_ms']:>9.3f} {row['peak_mb']:>9.1f}"
+        )
+
+
+def export_summary(path):
+    """
+    Writes summary() as CSV, or as JSON if path ends with .json.
+    """
+    rows = summary()
+    with open(path, "w", newline="") as f:
+        if path.endswith(".json"):
+            json.dump(rows, f, indent=1)
+            return
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()) if rows else ["name"])
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def export_chrome_trace(path):
+    """
+    Writes the recorded calls in the Chrome trace event format (one complete event per call).
+    """
+    with _lock:
+        trace = list(_trace)
+        origin = _origin
+    events = [
+        {
+            "name": name.rsplit(".", 1)[-1] if "." in name else name,
+            "cat": name,
+            "ph": "X",
+            "ts": (start - origin) * 1e6,
+            "dur": duration * 1e6,
+            "pid": os.getpid(),
+            "tid": thread,
+            "args": {"module": name, "output_mb": output_bytes / 2**20, "allocated_mb": allocated / 2**20, "peak_mb": peak / 2**20},
+        }
+        for name, start, duration, thread, output_bytes, allocated, peak in trace
+    ]
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def _write_at_exit():
+    if not _stats:
+        return
+    print_summary()
+    export_summary(f"{OUTPUT_PREFIX}.summary.csv")
+    export_chrome_trace(f"{OUTPUT_PREFIX}.trace.json")
+    print(f"Profile written to {OUTPUT_PREFIX}.summary.csv and {OUTPUT_PREFIX}.trace.json")
+
+
+if ENABLED:
+    atexit.register(_write_at_exit)
@@ -0,0 +1,77 @@
+"""
+Fixed-size ring buffer over one preallocated numpy array, used by minecraft_recording.py to keep the
+last few seconds of gameplay without allocating anything per frame.
+"""
+
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Holds the last `capacity` rows of shape `shape` and dtype `dtype` (a structured dtype works too).
+    `count` is the total number of rows ever appended, so row i of the recording lives at
+    data[i % capacity] for as long as it has not been overwritten.
+    """
+
+    def __init__(self, capacity, dtype, shape=()):
+        self.capacity = capacity
+        self.data = np.zeros((capacity, *shape), dtype=dtype)
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    @property
+    def full(self):
+        return self.count >= self.capacity
+
+    def append(self, row):
+        """
+        Copies row into the next slot, overwriting the oldest row once the buffer is full.
+        """
+        self.data[self.count % self.capacity] = row
+        self.count += 1
+
+    def next_slot(self):
+        """
+        View of the slot the next row goes into, for writing a row in place (e.g. cv2.resize(..., dst=slot)).
+        The row only becomes part of the buffer once commit() is called.
+        """
+        return self.data[self.count % self.capacity]
+
+    def commit(self):
+        self.count += 1
+
+    def clear(self):
+        self.count = 0
+
+    @property
+    def oldest(self):
+        """
+        Index (in append order) of the oldest row still in the buffer.
+        """
+        return max(0, self.count - self.capacity)
+
+    def get(self, i):
+        """
+        View of row i (in append order). Only valid while oldest <= i < count.
+        """
+        assert self.oldest <= i < self.count, f"row {i} is not in the buffer (holds {self.oldest}..{self.count - 1})"
+        return self.data[i % self.capacity]
+
+    def copy_range(self, start, end):
+        """
+        Copy of rows [start, end) (in append order), oldest first.
+        """
+        assert self.oldest <= start <= end <= self.count, f"rows {start}..{end - 1} are not in the buffer"
+        idx = np.arange(start, end) % self.capacity
+        return self.data[idx]
+
+    def ordered(self):
+        """
+        Returns a copy of the buffered rows, oldest first.
+        """
+        if self.count <= self.capacity:
+            return self.data[: self.count].copy()
+        split = self.count % self.capacity
+        return np.concatenate([self.data[split:], self.data[:split]])
@@ -0,0 +1,109 @@
+"""
+Samplers for the newest frame of a rollout: the context frames sit in a kv cache (see DiT.prefill) and
+only x[:, -1:] is denoised, one model call per step.
+
+The model predicts v. With alpha = sqrt(alphas_cumprod[t]) and sigma = sqrt(1 - alphas_cumprod[t]) the
+clean frame is x0 = alpha * x - sigma * v, and both solvers move the frame to the next noise level as
+    x_next = (sigma_next / sigma) * x + (alpha_next - sigma_next * alpha / sigma) * D
+    "ddim"      D = x0                                    deterministic DDIM, the update game.py always used
+    "dpm++2m"   D = (1 + 1/2r) * x0 - 1/2r * x0_prev      DPM-Solver++(2M), r = h_prev / h with h the
+                                                          step in log(alpha / sigma)
+(the first and the last step of dpm++2m fall back to D = x0). Everything except x and v only depends on
+the step, so it is computed once per (schedule, step count) into plain python floats, and a step is one
+model call plus a couple of scalar multiply-adds on the last frame. dpm++2m gets as close to the
+many-step result with fewer steps (against an exact denoiser 6 dpm++2m steps about match 8-10 DDIM ones).
+
+The timesteps are the usual torch.linspace(-1, max_noise_level - 1, steps + 1) noise_range, and the last
+step goes straight to the clean frame (alpha_next = 1).
+"""
+
+import math
+from contextlib import nullcontext
+
+import torch
+from torch import autocast
+
+SOLVERS = ["ddim", "dpm++2m"]
+
+
+class FrameSampler:
+    def __init__(self, alphas_cumprod, steps, solver="ddim", max_noise_level=1000, device=None):
+        """
+        alphas_cumprod: (max_noise_level,) or (max_noise_level, 1, 1, 1) tensor
+        steps: number of model calls per frame
+        """
+        assert solver in SOLVERS, f"unknown solver {solver}, expected one of {SOLVERS}"
+        assert steps >= 1, "need at least one step"
+        self.steps = steps
+        self.solver = solver
+        self.device = torch.device(device) if device is not None else alphas_cumprod.device
+        alphas_cumprod = alphas_cumprod.flatten().double().cpu()
+        noise_range = torch.linspace(-1, max_noise_level - 1, steps + 1).long()
+
+        # one row per step, noisiest first
+        self.table = []
+        lambda_prev = None
+        for noise_idx in reversed(range(1, steps + 1)):
+            a = alphas_cumprod[noise_range[noise_idx]].item()
+            alpha, sigma = math.sqrt(a), math.sqrt(1 - a)
+            if noise_idx == 1:
+                alpha_next, sigma_next = 1.0, 0.0
+            else:
+                a_next = alphas_cumprod[noise_range[noise_idx - 1]].item()
+                alpha_next, sigma_next = math.sqrt(a_next), math.sqrt(1 - a_next)
+            lambda_cur = math.log(alpha / sigma)
+            w_cur, w_prev = 1.0, 0.0
+            if solver == "dpm++2m" and lambda_prev is not None and noise_idx != 1:
+                h = math.log(alpha_next / sigma_next) - lambda_cur
+                r = (lambda_cur - lambda_prev) / h
+                w_cur, w_prev = 1 + 1 / (2 * r), -1 / (2 * r)
+            lambda_prev = lambda_cur
+            self.table.append(
+                {
+                    "t": noise_range[noise_idx].item(),
+                    "alpha": alpha,
+                    "sigma": sigma,
+                    "c_x": sigma_next / sigma,
+                    "c_d": alpha_next - sigma_next * alpha / sigma,
+                    "w_cur": w_cur,
+                    "w_prev": w_prev,
+                }
+            )
+        # the timesteps of every step, indexed (not rebuilt) by sample()
+        self.timesteps = torch.tensor([row["t"] for row in self.table], dtype=torch.long, device=self.device).view(-1, 1)
+        # the same table as tensors, for callers that run rows at different steps in one batch
+        self.coefficients = {
+            key: torch.tensor([row[key] for row in self.table], dtype=torch.float32, device=self.device).view(-1, 1, 1, 1, 1)
+            for key in ["alpha", "sigma", "c_x", "c_d", "w_cur", "w_prev"]
+        }
+
+    def step(self, k, x, v, x0_prev=None):
+        """
+        Step k (0 is the noisiest) of the frame x given the model's v. Returns (x_next, x0), pass x0 as
+        x0_prev to the next step.
+        """
+        row = self.table[k]
+        x0 = x * row["alpha"] - v * row["sigma"]
+        d = x0
+        if row["w_prev"] != 0.0:
+            d = x0 * row["w_cur"] + x0_prev * row["w_prev"]
+        return x * row["c_x"] + d * row["c_d"], x0
+
+    @torch.inference_mode()
+    def sample(self, model, x, actions, kv_cache, noise_abs_max=None, autocast_dtype=torch.half):
+        """
+        Denoises the new frame x (B, 1, C, H, W) with its actions (B, 1, num_actions) on top of the
+        context already in kv_cache. x is left untouched, the clean frame is returned.
+        noise_abs_max: clamp the frame to +-noise_abs_max after every step, as game.py does
+        autocast_dtype: dtype of the model calls on cuda, None to use whatever autocast the caller set up
+        """
+        B = x.shape[0]
+        context = autocast(x.device.type, dtype=autocast_dtype, enabled=x.is_cuda) if autocast_dtype is not None else nullcontext()
+        x0 = None
+        for k in range(self.steps):
+            with context:
+                v = model(x, self.timesteps[k].expand(B, 1), actions, kv_cache=kv_cache)
+            x, x0 = self.step(k, x, v, x0)
+            if noise_abs_max is not None:
+                x = torch.clamp(x, -noise_abs_max, noise_abs_max)
+        return x
@@ -0,0 +1,269 @@
+"""
+Continuous batching of the interactive sampling loop across many player sessions.
+
+Every session denoises one frame at a time exactly like game.py's sample(), but instead of running
+its own DiT call per DDIM step, the scheduler gathers the newest frame of every session that has a
+frame in flight into one batched DiT.forward. Sessions can be at different DDIM steps and have
+different context lengths (e.g. while a window is still filling up to context_window_size), their
+cached context keys/values are left padded and masked by TemporalKVCache.stack().
+
+Typical use:
+    scheduler = InferenceScheduler(model, vae, alphas_cumprod, device=device)
+    Thread(target=scheduler.run_forever, daemon=True).start()
+    session_id = scheduler.join(prompt_latents)
+    scheduler.submit(session_id, action)   # (num_actions,) tensor, one per frame
+    frame = scheduler.get_frame(session_id)
+"""
+
+import itertools
+import queue
+import time
+from collections import deque
+from threading import Event, Lock
+
+import torch
+from einops import rearrange
+from torch import autocast
+
+from oasis_library.attention import TemporalKVCache
+from oasis_library.sampling import FrameSampler
+from oasis_library.utils import ACTION_KEYS
+
+
+class Session:
+    """
+    State of one player: the latent/action context window, queued actions and the frame being denoised.
+    """
+
+    def __init__(self, session_id, prompt_latents, num_actions, context_window_size):
+        self.id = session_id
+        self.x = prompt_latents  # (1, T, C, H, W)
+        self.context_window_size = context_window_size
+        # the prompt frames get zero actions, one per frame so that actions stay aligned with x
+        self.actions = torch.zeros((1, prompt_latents.shape[1], num_actions), device=prompt_latents.device)
+        self.pending_actions = deque()
+        self.frames = queue.Queue()
+        self.noise_idx = 0  # 0 means no frame in flight
+        self.x0_prev = None  # clean frame predicted by the previous step, used by multistep solvers
+        self.kv_cache = None
+
+    @property
+    def in_flight(self):
+        return self.noise_idx > 0
+
+
+class InferenceScheduler:
+    def __init__(
+        self,
+        model,
+        vae,
+        alphas_cumprod,
+        device="cuda:0",
+        max_batch_size=16,
+        context_window_size=4,
+        ddim_noise_steps=16,
+        solver="ddim",
+        max_noise_level=1000,
+        stabilization_level=15,
+        noise_abs_max=20,
+        scaling_factor=0.07843137255,
+    ):
+        """
+        model, vae: loaded DiT and VAE, already on device
+        alphas_cumprod: (max_noise_level, 1, 1, 1) tensor, as in game.py
+        max_batch_size: admission limit, sessions beyond it wait in the join queue
+        solver: "ddim" or "dpm++2m", see oasis_library/sampling.py
+        """
+        self.model = model
+        self.vae = vae
+        self.alphas_cumprod = alphas_cumprod
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.context_window_size = context_window_size
+        self.ddim_noise_steps = ddim_noise_steps
+        self.sampler = FrameSampler(alphas_cumprod, ddim_noise_steps, solver, max_noise_level, device=device)
+        self.stabilization_level = stabilization_level
+        self.noise_abs_max = noise_abs_max
+        self.scaling_factor = scaling_factor
+
+        self.sessions = {}
+        self._join_queue = deque()
+        self._leave_queue = deque()
+        self._lock = Lock()
+        self._ids = itertools.count()
+        self.stop_event = Event()
+
+        # the stacked cache only changes when a frame starts or finishes somewhere in the batch
+        self._batch_ids = None
+        self._batch_cache = None
+
+        self.frames_generated = 0
+        self.steps_run = 0
+        self.rows_run = 0
+        self.start_time = time.time()
+
+    # ----- session management (safe to call from any thread) -----
+
+    def join(self, prompt_latents):
+        """
+        prompt_latents: (1, n_prompt_frames, C, H, W) VAE latents of the prompt, already scaled by scaling_factor.
+        The session is admitted at the next step boundary once there is room in the batch.
+        """
+        session = Session(next(self._ids), prompt_latents.to(self.device), len(ACTION_KEYS), self.context_window_size)
+        with self._lock:
+            self._join_queue.append(session)
+        return session.id
+
+    def leave(self, session_id):
+        with self._lock:
+            self._leave_queue.append(session_id)
+
+    def submit(self, session_id, action):
+        """
+        Queues the action for the next frame of a session. action: (num_actions,) tensor.
+        """
+        with self._lock:
+            self._find(session_id).pending_actions.append(action.to(self.device))
+
+    def get_frame(self, session_id, timeout=None):
+        with self._lock:
+            session = self._find(session_id)
+        return session.frames.get(timeout=timeout)
+
+    def _find(self, session_id):
+        if session_id in self.sessions:
+            return self.sessions[session_id]
+        for session in self._join_queue:
+            if session.id == session_id:
+                return session
+        raise KeyError(f"unknown session {session_id}")
+
+    def _admit(self):
+        with self._lock:
+            while self._leave_queue:
+                session_id = self._leave_queue.popleft()
+                self.sessions.pop(session_id, None)
+                self._join_queue = deque(s for s in self._join_queue if s.id != session_id)
+            while self._join_queue and len(self.sessions) < self.max_batch_size:
+                session = self._join_queue.popleft()
+                self.sessions[session.id] = session
+
+    # ----- sampling -----
+
+    @torch.inference_mode()
+    def _start_frames(self):
+        """
+        Appends a noise frame to every idle session that has an action queued and prefills its context.
+        Sessions with the same context length are prefilled together.
+        """
+        starting = []
+        with self._lock:
+            for session in self.sessions.values():
+                if not session.in_flight and session.pending_actions:
+                    starting.append((session, session.pending_actions.popleft()))
+        if not starting:
+            return
+
+        for session, action in starting:
+            chunk = torch.randn((1, 1, *session.x.shape[-3:]), device=self.device)
+            chunk = torch.clamp(chunk, -self.noise_abs_max, +self.noise_abs_max)
+            session.x = torch.cat([session.x, chunk], dim=1)[:, -session.context_window_size :]
+            session.actions = torch.cat([session.actions, action.view(1, 1, -1)], dim=1)[:, -session.context_window_size :]
+            session.noise_idx = self.ddim_noise_steps
+            session.x0_prev = None
+
+        groups = {}
+        for session, _ in starting:
+            groups.setdefault(session.x.shape[1], []).append(session)
+        for context_length, group in groups.items():
+            x_ctx = torch.cat([s.x[:, :-1] for s in group], dim=0)
+            actions_ctx = torch.cat([s.actions[:, :-1] for s in group], dim=0)
+            t_ctx = torch.full((len(group), context_length - 1), self.stabilization_level - 1, dtype=torch.long, device=self.device)
+            kv_cache = self.model.new_kv_cache()
+            with autocast("cuda", dtype=torch.half):
+                self.model.prefill(x_ctx, t_ctx, kv_cache, actions_ctx)
+            for session, session_cache in zip(group, kv_cache.split(len(group))):
+                session.kv_cache = session_cache
+        self._batch_ids = None
+
+    @torch.inference_mode()
+    def step(self):
+        """
+        Runs one batched DDIM step over every session with a frame in flight.
+        Returns the number of sessions that were advanced.
+        """
+        self._admit()
+        self._start_frames()
+        active = [s for s in self.sessions.values() if s.in_flight]
+        if not active:
+            return 0
+
+        ids = [s.id for s in active]
+        if ids != self._batch_ids:
+            self._batch_cache = TemporalKVCache.stack([s.kv_cache for s in active])
+            self._batch_ids = ids
+
+        x_curr = torch.cat([s.x[:, -1:] for s in active], dim=0)
+        actions_curr = torch.cat([s.actions[:, -1:] for s in active], dim=0)
+        # rows can be at different steps, so the sampler's coefficients are gathered per row
+        step = torch.tensor([self.ddim_noise_steps - s.noise_idx for s in active], device=self.device)
+        t = self.sampler.timesteps[step]
+        coefficients = {key: table[step] for key, table in self.sampler.coefficients.items()}
+
+        with autocast("cuda", dtype=torch.half):
+            v = self.model(x_curr, t, actions_curr, kv_cache=self._batch_cache)
+
+        x0 = coefficients["alpha"] * x_curr - coefficients["sigma"] * v
+        d = coefficients["w_cur"] * x0
+        if self.sampler.solver != "ddim":
+            x0_prev = torch.cat([s.x0_prev if s.x0_prev is not None else torch.zeros_like(s.x[:, -1:]) for s in active], dim=0)
+            d = d + coefficients["w_prev"] * x0_prev
+        # rows on their last step go all the way to the clean frame (c_x = 0, c_d = 1)
+        x_pred = coefficients["c_x"] * x_curr + coefficients["c_d"] * d
+        x_pred = torch.clamp(x_pred, -self.noise_abs_max, self.noise_abs_max)
+
+        finished = []
+        for row, session in enumerate(active):
+            session.x[:, -1:] = x_pred[row : row + 1]
+            session.x0_prev = x0[row : row + 1]
+            session.noise_idx -= 1
+            if not session.in_flight:
+                session.kv_cache = None
+                session.x0_prev = None
+                finished.append(session)
+        if finished:
+            self._batch_ids = None
+            self._emit(finished)
+
+        self.steps_run += 1
+        self.rows_run += len(active)
+        return len(active)
+
+    @torch.inference_mode()
+    def _emit(self, finished):
+        """
+        Decodes the finished frames of this step in one VAE call and hands them to their sessions.
+        """
+        x_last = torch.cat([s.x[:, -1:] for s in finished], dim=0)
+        x_last = rearrange(x_last, "b t c h w -> (b t) (h w) c").half()
+        x_decoded = (self.vae.decode(x_last / self.scaling_factor) + 1) / 2
+        x_decoded = rearrange(x_decoded, "b c h w -> b h w c")
+        frames = (torch.clamp(x_decoded, 0, 1) * 255).byte().cpu().numpy()
+        for session, frame in zip(finished, frames):
+            session.frames.put(frame)
+        self.frames_generated += len(finished)
+
+    def run_forever(self, idle_sleep=0.001):
+        while not self.stop_event.is_set():
+            if self.step() == 0:
+                time.sleep(idle_sleep)
+
+    def stats(self):
+        elapsed = time.time() - self.start_time
+        return {
+            "sessions": len(self.sessions),
+            "waiting": len(self._join_queue),
+            "frames": self.frames_generated,
+            "fps": self.frames_generated / elapsed if elapsed > 0 else 0.0,
+            "mean_batch_size": self.rows_run / self.steps_run if self.steps_run else 0.0,
+        }
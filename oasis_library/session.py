@@ -0,0 +1,141 @@
+"""
+One rollout of the world model, a frame at a time: step(action) appends a noise frame with its action,
+denoises it on top of the context window and returns it.
+
+The latents and actions live in preallocated device buffers of twice the window size. Frame i is
+written to slot i % window and mirrored to slot i % window + window, so the last `window` frames are
+always one contiguous slice of the buffer and can go to the model as a view. Once the window is full a
+step does no concatenation, cloning or reallocation of the history, just the one frame copy.
+
+    session = WorldModelSession(model, FrameSampler(alphas_cumprod, 16), vae, context_window=4)
+    session.reset(prompt_latents)          # (B, T, C, H, W), already scaled by scaling_factor
+    frame = session.step(action)           # (B, num_actions) -> (B, H, W, 3) uint8 on the device
+"""
+
+import torch
+from einops import rearrange
+from torch import autocast
+
+
+class WorldModelSession:
+    def __init__(
+        self,
+        model,
+        sampler,
+        vae=None,
+        context_window=None,
+        batch_size=1,
+        device="cuda:0",
+        stabilization_level=15,
+        noise_abs_max=20,
+        clamp_steps=False,
+        scaling_factor=0.07843137255,
+        autocast_dtype=torch.half,
+    ):
+        """
+        model: DiT, already on device
+        sampler: FrameSampler, can be swapped between steps (e.g. to change the step count)
+        vae: only needed by step() / decode(), step_latent() works without it
+        context_window: frames the model sees per step including the new one, defaults to model.max_frames
+        clamp_steps: clamp the new frame to +-noise_abs_max after every denoising step (game.py does, the
+                     initial noise is always clamped)
+        """
+        self.model = model
+        self.sampler = sampler
+        self.vae = vae
+        self.window = context_window or model.max_frames
+        assert self.window <= model.max_frames, f"context_window {self.window} is longer than the model's {model.max_frames} frames"
+        self.batch_size = batch_size
+        self.device = torch.device(device)
+        self.stabilization_level = stabilization_level
+        self.noise_abs_max = noise_abs_max
+        self.clamp_steps = clamp_steps
+        self.scaling_factor = scaling_factor
+        self.autocast_dtype = autocast_dtype
+
+        H, W = model.x_embedder.img_size
+        num_actions = getattr(model.external_cond, "in_features", 0)  # nn.Identity without actions
+        self.latents = torch.zeros((batch_size, 2 * self.window, model.in_channels, H, W), device=self.device)
+        self.actions = torch.zeros((batch_size, 2 * self.window, num_actions), device=self.device)
+        # the context frames all sit at the same noise level, so their timesteps never change
+        self.t_ctx = torch.full((batch_size, self.window - 1), stabilization_level - 1, dtype=torch.long, device=self.device)
+        self.kv_cache = model.new_kv_cache()
+        self.count = 0  # frames in the rollout so far, prompt included
+        self.cache_start = 0  # first frame of the window the kv cache was built for
+
+    def _write(self, i, latents=None, actions=None):
+        # frame i and its mirror
+        for slot in (i % self.window, i % self.window + self.window):
+            if latents is not None:
+                self.latents[:, slot].copy_(latents)
+            if actions is not None:
+                self.actions[:, slot].copy_(actions)
+
+    def _window(self, start, end):
+        """
+        Views of frames [start, end) of the rollout, which have to be among the last `window` ones.
+        """
+        first = start % self.window
+        return self.latents[:, first : first + end - start], self.actions[:, first : first + end - start]
+
+    def reset(self, prompt_latents, prompt_actions=None):
+        """
+        Starts a new rollout from prompt_latents (B, T, C, H, W). prompt_actions (B, T, num_actions)
+        default to zero actions. Only the last context_window - 1 prompt frames are kept.
+        """
+        T = prompt_latents.shape[1]
+        keep = min(T, self.window - 1)
+        if prompt_actions is None:
+            prompt_actions = torch.zeros((self.batch_size, T, self.actions.shape[-1]), device=self.device)
+        self.count = 0
+        self.cache_start = 0
+        self.kv_cache.reset()
+        for i in range(T - keep, T):
+            self._write(self.count, prompt_latents[:, i], prompt_actions[:, i])
+            self.count += 1
+
+    @torch.inference_mode()
+    def step_latent(self, action):
+        """
+        Generates the next frame for action (B, num_actions) and returns its latent (B, 1, C, H, W).
+        The returned tensor is not part of the buffers, so it stays valid after later steps.
+        """
+        assert self.count > 0, "reset() the session with a prompt first"
+        i = self.count
+        start = max(0, i + 1 - self.window)
+        self._write(i, actions=action)
+        x, actions = self._window(start, i + 1)
+        x_new = x[:, -1:]
+        x_new.normal_().clamp_(-self.noise_abs_max, self.noise_abs_max)
+
+        # the context frames keep their noise level and the temporal attention is causal, so the kv cache
+        # stays valid until the window slides, and only frames that are not in it yet are prefilled
+        if start != self.cache_start:
+            self.kv_cache.reset()
+            self.cache_start = start
+        cached_until = self.cache_start + len(self.kv_cache)
+        with autocast(self.device.type, dtype=self.autocast_dtype, enabled=self.device.type == "cuda"):
+            self.model.prefill(x[:, cached_until - start : -1], self.t_ctx[:, : i - cached_until], self.kv_cache, actions[:, cached_until - start : -1])
+
+        noise_abs_max = self.noise_abs_max if self.clamp_steps else None
+        latent = self.sampler.sample(self.model, x_new, actions[:, -1:], self.kv_cache, noise_abs_max=noise_abs_max, autocast_dtype=self.autocast_dtype)
+        self._write(i, latents=latent[:, 0])
+        self.count += 1
+        return latent
+
+    @torch.inference_mode()
+    def decode(self, latent):
+        """
+        latent (B, 1, C, H, W) -> (B, H, W, 3) uint8 frames on the device.
+        """
+        latent = rearrange(latent, "b t c h w -> (b t) (h w) c")
+        with autocast(self.device.type, dtype=self.autocast_dtype, enabled=self.device.type == "cuda"):
+            frames = (self.vae.decode(latent / self.scaling_factor) + 1) / 2
+        frames = rearrange(frames, "b c h w -> b h w c")
+        return (torch.clamp(frames, 0, 1) * 255).byte()
+
+    def step(self, action):
+        """
+        Generates and decodes the next frame for action (B, num_actions), returns (B, H, W, 3) uint8.
+        """
+        return self.decode(self.step_latent(action))
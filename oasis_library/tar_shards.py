@@ -0,0 +1,213 @@
+"""
+Tar shards of training recordings.
+
+Instead of thousands of replay_<id>.mp4 / actions_<id>.* pairs, pack_tar_shards.py writes a few large
+tar files (shard_00000.tar, ...) of roughly fixed size, each holding whole recordings as consecutive
+members that share a key:
+    <key>.json          {"video_id", "num_frames", "num_actions"}
+    <key>.mp4           the video bytes, unchanged
+    <key>.actions.npy   ACTION_DTYPE actions (oasis_library/actions.py)
+    <key>.latents.npy   optional (N, 16, 18, 32) float16 VAE latents, see latent_cache.py
+    <key>.brightness.npy optional (N,) float32 per-frame brightness, stored next to the latents
+TarSegmentDataset streams the shards front to back, so training reads big sequential blocks instead of
+opening small files at random.
+"""
+
+import io
+import json
+import os
+import tarfile
+
+import av
+import numpy as np
+import torch
+from torch.utils.data import IterableDataset, get_worker_info
+
+from oasis_library.actions import actions_to_one_hot
+from oasis_library.datasets import DARKNESS_THRESHOLD
+
+SHARD_LIST = "shards.json"
+
+
+def shard_name(shard):
+    return f"shard_{shard:05d}.tar"
+
+
+class ShardWriter:
+    """
+    Appends recordings to the current shard and starts a new one once it holds max_shard_bytes.
+    """
+
+    def __init__(self, output_dir, max_shard_bytes=1 << 30):
+        self.output_dir = output_dir
+        self.max_shard_bytes = max_shard_bytes
+        self.shards = []  # [{"path", "samples", "frames"}]
+        self._tar = None
+        self._size = 0
+        os.makedirs(output_dir, exist_ok=True)
+
+    def _add_member(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        self._tar.addfile(info, io.BytesIO(data))
+        self._size += len(data)
+
+    @staticmethod
+    def _npy_bytes(array):
+        buffer = io.BytesIO()
+        np.save(buffer, array)
+        return buffer.getvalue()
+
+    def add(self, key, video_id, video_bytes, num_frames, actions, latents=None, brightness=None):
+        if self._tar is None or self._size >= self.max_shard_bytes:
+            self._next_shard()
+        metadata = {"video_id": video_id, "num_frames": int(num_frames), "num_actions": int(len(actions))}
+        self._add_member(f"{key}.json", json.dumps(metadata).encode())
+        self._add_member(f"{key}.mp4", video_bytes)
+        self._add_member(f"{key}.actions.npy", self._npy_bytes(actions))
+        if latents is not None:
+            self._add_member(f"{key}.latents.npy", self._npy_bytes(latents))
+            self._add_member(f"{key}.brightness.npy", self._npy_bytes(brightness))
+        self.shards[-1]["samples"] += 1
+        self.shards[-1]["frames"] += int(num_frames)
+
+    def _next_shard(self):
+        if self._tar is not None:
+            self._tar.close()
+        name = shard_name(len(self.shards))
+        self._tar = tarfile.open(os.path.join(self.output_dir, name), "w")
+        self._size = 0
+        self.shards.append({"path": name, "samples": 0, "frames": 0})
+
+    def close(self):
+        if self._tar is not None:
+            self._tar.close()
+        with open(os.path.join(self.output_dir, SHARD_LIST), "w") as f:
+            json.dump(self.shards, f, indent=1)
+
+
+def list_shards(shard_dir):
+    with open(os.path.join(shard_dir, SHARD_LIST)) as f:
+        return [os.path.join(shard_dir, shard["path"]) for shard in json.load(f)]
+
+
+def iter_samples(shard_path):
+    """
+    Streams one shard and yields a dict per recording: {"json": metadata, "mp4": bytes, "actions.npy": array, ...}.
+    """
+    sample, key = {}, None
+    with tarfile.open(shard_path, "r|") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            member_key, extension = member.name.split(".", 1)
+            if member_key != key and sample:
+                yield sample
+                sample = {}
+            key = member_key
+            data = tar.extractfile(member).read()
+            if extension == "json":
+                sample["json"] = json.loads(data)
+            elif extension.endswith(".npy"):
+                sample[extension] = np.load(io.BytesIO(data))
+            else:
+                sample[extension] = data
+    if sample:
+        yield sample
+
+
+def decode_segments(video_bytes, segment_starts, length):
+    """
+    Decodes the frames of several [start, start + length) segments of an in-memory video in a single
+    pass, stopping after the last one. Returns a list of (length, H, W, C) uint8 tensors.
+    """
+    wanted = {frame_idx: None for segment_start in segment_starts for frame_idx in range(segment_start, segment_start + length)}
+    last = max(wanted)
+    with av.open(io.BytesIO(video_bytes)) as container:
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        for frame_idx, frame in enumerate(container.decode(stream)):
+            if frame_idx in wanted:
+                wanted[frame_idx] = frame.to_ndarray(format="rgb24")
+            if frame_idx == last:
+                break
+    return [torch.from_numpy(np.stack([wanted[i] for i in range(s, s + length)])) for s in segment_starts]
+
+
+class TarSegmentDataset(IterableDataset):
+    """
+    Streams segments out of tar shards. Items are the same as VideoSegmentDataset's ((frames, actions),
+    uint8 frames) or, with use_latents, CachedSegmentDataset's ((latents, actions)); dark segments are
+    skipped here instead of being returned as None.
+
+    With world_size > 1 every distributed rank only reads every world_size-th shard. Every epoch the
+    shard order is reshuffled (the same way in every worker) and each DataLoader worker reads its own
+    subset of the rank's shards. Call set_epoch(epoch) before every epoch and don't use persistent
+    workers: they keep the copy of the dataset (and the seed) they were started with. Segments are
+    picked segments_per_video at a time per recording with the usual quadratic end bias, and mixed
+    through a small shuffle buffer before they are yielded.
+    """
+
+    def __init__(self, shard_dir, total_frames, segments_per_video, use_latents=False, shuffle_buffer=64, rank=0, world_size=1):
+        self.shards = list_shards(shard_dir)[rank::world_size]
+        if not self.shards:
+            print(f"⚠️ Rank {rank} has no shards to read, pack more shards than there are ranks.")
+        self.total_frames = total_frames
+        self.segments_per_video = segments_per_video
+        self.use_latents = use_latents
+        self.shuffle_buffer = shuffle_buffer
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _shared_seed(self):
+        # the DataLoader draws a new base seed whenever it starts its workers and gives worker i the seed base + i
+        worker = get_worker_info()
+        if worker is None:
+            return int(torch.empty((), dtype=torch.int64).random_().item())
+        return worker.seed - worker.id
+
+    def _my_shards(self, rng):
+        shards = [self.shards[i] for i in rng.permutation(len(self.shards))]
+        worker = get_worker_info()
+        if worker is not None:
+            shards = shards[worker.id :: worker.num_workers]
+        return shards
+
+    def _segments(self, sample, rng):
+        N = min(sample["json"]["num_frames"], sample["json"]["num_actions"])
+        if N < self.total_frames:
+            return
+        max_start = N - self.total_frames
+        weights = np.linspace(1, max_start + 1, max_start + 1) ** 2  # Quadratic bias
+        segment_starts = sorted(rng.choice(np.arange(max_start + 1), size=self.segments_per_video, p=weights / weights.sum()).tolist())
+        actions = actions_to_one_hot(sample["actions.npy"])
+
+        if self.use_latents:
+            for segment_start in segment_starts:
+                segment_end = segment_start + self.total_frames
+                if sample["brightness.npy"][segment_start:segment_end].mean() < DARKNESS_THRESHOLD:
+                    continue
+                latents = torch.from_numpy(sample["latents.npy"][segment_start:segment_end].astype(np.float32))
+                yield latents, actions[segment_start:segment_end]
+            return
+
+        for segment_start, frames in zip(segment_starts, decode_segments(sample["mp4"], segment_starts, self.total_frames)):
+            if frames.mean(dtype=torch.float32) / 255 < DARKNESS_THRESHOLD:
+                continue
+            yield frames, actions[segment_start : segment_start + self.total_frames]
+
+    def __iter__(self):
+        seed = self._shared_seed()
+        worker = get_worker_info()
+        rng = np.random.default_rng([seed, self.epoch, worker.id if worker is not None else 0])  # own stream per worker
+        buffer = []
+        for shard in self._my_shards(np.random.default_rng([seed, self.epoch])):
+            for sample in iter_samples(shard):
+                for item in self._segments(sample, rng):
+                    buffer.append(item)
+                    if len(buffer) >= self.shuffle_buffer:
+                        yield buffer.pop(rng.integers(len(buffer)))
+        rng.shuffle(buffer)
+        yield from buffer
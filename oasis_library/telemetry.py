@@ -0,0 +1,136 @@
+"""
+Per-stage frame latency telemetry for interactive loops like game.py.
+
+Every frame is split into named stages (input, action, sample, decode, display, ...) by calling lap(stage)
+at the end of each one. The current cuda stream is synchronized at every lap, so queued cuda work is charged
+to the stage that queued it and not to whichever later stage happens to wait for it, while work on other
+streams (another pipeline stage running on its own thread) is left alone. Times measured elsewhere, like
+an input-to-display latency, can be added to a frame with record(stage, seconds). The last `window` frames
+feed rolling p50/p95/p99 numbers for an on-screen overlay, and every frame is kept for export at the end
+of the session:
+    <prefix>.csv    one row per frame: stage times in ms, frame total and the settings the frame ran with
+    <prefix>.json   p50/p95/p99/mean/max per stage over the whole session, overall and per setting combination
+"""
+
+import csv
+import json
+import time
+from collections import deque
+
+import numpy as np
+import torch
+
+PERCENTILES = (50, 95, 99)
+
+
+class FrameTelemetry:
+    def __init__(self, stages, window=300, device=None, frame_label="frame"):
+        self.stages = list(stages)
+        self.window = window
+        self.device = torch.device(device) if device is not None else None
+        # name of the whole-frame row in the overlay, so tables of several threads can be stacked
+        self.frame_label = frame_label
+        self.recent = {stage: deque(maxlen=window) for stage in self.stages + ["frame"]}
+        self.frames = []  # (stage times in seconds, frame time, settings) of every finished frame
+        self._current = {}
+        self._frame_start = self._last = time.perf_counter()
+
+    def _synchronize(self):
+        if self.device is not None and self.device.type == "cuda":
+            torch.cuda.current_stream(self.device).synchronize()
+
+    def start(self):
+        """
+        (Re)starts the clock, call it right before the loop.
+        """
+        self._current = {}
+        self._frame_start = self._last = time.perf_counter()
+
+    def lap(self, name):
+        """
+        Ends stage `name`: everything since the previous lap (or the start of the frame) is charged to it.
+        """
+        assert name in self.recent, f"unknown stage {name}, expected one of {self.stages}"
+        self._synchronize()
+        now = time.perf_counter()
+        self._current[name] = self._current.get(name, 0.0) + now - self._last
+        self._last = now
+
+    def record(self, name, seconds):
+        """
+        Adds a time measured outside of the laps to stage `name` of the current frame.
+        """
+        assert name in self.recent, f"unknown stage {name}, expected one of {self.stages}"
+        self._current[name] = self._current.get(name, 0.0) + seconds
+
+    def end_frame(self, **settings):
+        """
+        Closes the current frame, time since the last lap counts towards the frame but no stage. settings
+        (e.g. ddim_noise_steps=16, context=4) are stored with the frame so the export can be split by them.
+        """
+        end = time.perf_counter()
+        frame_time = end - self._frame_start
+        for stage in self.stages:
+            self.recent[stage].append(self._current.get(stage, 0.0))
+        self.recent["frame"].append(frame_time)
+        self.frames.append((dict(self._current), frame_time, settings))
+        self._current = {}
+        self._frame_start = self._last = end
+
+    def percentiles(self):
+        """
+        Rolling {stage: (p50, p95, p99)} in ms over the last `window` frames, "frame" is the whole frame.
+        """
+        return {
+            stage: tuple(np.percentile(np.array(times) * 1000, PERCENTILES)) if times else (0.0,) * len(PERCENTILES)
+            for stage, times in self.recent.items()
+        }
+
+    def overlay_lines(self, header=True):
+        lines = [f"{'stage':<8} {'p50':>7} {'p95':>7} {'p99':>7} ms"] if header else []
+        for stage, (p50, p95, p99) in self.percentiles().items():
+            label = self.frame_label if stage == "frame" else stage
+            lines.append(f"{label:<8} {p50:7.1f} {p95:7.1f} {p99:7.1f}")
+        return lines
+
+    @staticmethod
+    def _stats(times):
+        times = np.array(times) * 1000
+        p50, p95, p99 = np.percentile(times, PERCENTILES)
+        return {"frames": len(times), "p50": p50, "p95": p95, "p99": p99, "mean": times.mean(), "max": times.max()}
+
+    def summary(self):
+        """
+        Session-wide latency stats per stage, overall and for every combination of settings seen.
+        """
+        if not self.frames:
+            return {"overall": {}, "by_settings": []}
+
+        def stats_of(frames):
+            stats = {stage: self._stats([times.get(stage, 0.0) for times, _, _ in frames]) for stage in self.stages}
+            stats["frame"] = self._stats([frame_time for _, frame_time, _ in frames])
+            return stats
+
+        groups = {}
+        for frame in self.frames:
+            groups.setdefault(tuple(sorted(frame[2].items())), []).append(frame)
+        return {
+            "overall": stats_of(self.frames),
+            "by_settings": [{"settings": dict(key), "stages": stats_of(frames)} for key, frames in groups.items()],
+        }
+
+    def export(self, prefix):
+        """
+        Writes <prefix>.csv and <prefix>.json, see the module docstring.
+        """
+        setting_keys = sorted({key for _, _, settings in self.frames for key in settings})
+        with open(f"{prefix}.csv", "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["frame"] + [f"{stage}_ms" for stage in self.stages] + ["frame_ms"] + setting_keys)
+            for i, (times, frame_time, settings) in enumerate(self.frames):
+                writer.writerow(
+                    [i] + [round(times.get(stage, 0.0) * 1000, 3) for stage in self.stages] + [round(frame_time * 1000, 3)] + [settings.get(key) for key in setting_keys]
+                )
+        with open(f"{prefix}.json", "w") as f:
+            json.dump(self.summary(), f, indent=1, default=float)
+        print(f"Frame telemetry of {len(self.frames)} frames saved to {prefix}.csv and {prefix}.json")
@@ -6,10 +6,12 @@ Action format derived from VPT https://github.com/openai/Video-Pre-Training
 import math
 import torch
 from torch import nn
-from torchvision.io import read_image, read_video
+from torchvision.io import read_image
 from torchvision.transforms.functional import resize
 from einops import rearrange
 from typing import Mapping, Sequence
+from oasis_library.video_reader import read_frames
+from oasis_library.actions import ACTION_KEYS, actions_from_dicts, actions_to_one_hot, load_one_hot_actions
 
 
 def sigmoid_beta_schedule(timesteps, start=-3, end=3, tau=1, clamp_min=1e-5):
@@ -28,57 +30,8 @@ def sigmoid_beta_schedule(timesteps, start=-3, end=3, tau=1, clamp_min=1e-5):
     return torch.clip(betas, 0, 0.999)
 
 
-ACTION_KEYS = [
-    "inventory",
-    "ESC",
-    "hotbar.1",
-    "hotbar.2",
-    "hotbar.3",
-    "hotbar.4",
-    "hotbar.5",
-    "hotbar.6",
-    "hotbar.7",
-    "hotbar.8",
-    "hotbar.9",
-    "forward",
-    "back",
-    "left",
-    "right",
-    "cameraX",
-    "cameraY",
-    "jump",
-    "sneak",
-    "sprint",
-    "swapHands",
-    "attack",
-    "use",
-    "pickItem",
-    "drop",
-]
-
-
 def one_hot_actions(actions: Sequence[Mapping[str, int]]) -> torch.Tensor:
-    actions_one_hot = torch.zeros(len(actions), len(ACTION_KEYS))
-    for i, current_actions in enumerate(actions):
-        for j, action_key in enumerate(ACTION_KEYS):
-            if action_key.startswith("camera"):
-                if action_key == "cameraX":
-                    value = current_actions["camera"][0]
-                elif action_key == "cameraY":
-                    value = current_actions["camera"][1]
-                else:
-                    raise ValueError(f"Unknown camera action key: {action_key}")
-                max_val = 20
-                bin_size = 0.5
-                num_buckets = int(max_val / bin_size)
-                value = (value - num_buckets) / num_buckets
-                assert -1 - 1e-3 <= value <= 1 + 1e-3, f"Camera action value must be in [-1, 1], got {value}"
-            else:
-                value = current_actions[action_key]
-                assert 0 <= value <= 1, f"Action value must be in [0, 1] got {value}"
-            actions_one_hot[i, j] = value
-
-    return actions_one_hot
+    return actions_to_one_hot(actions_from_dicts(actions))
 
 
 IMAGE_EXTENSIONS = {"png", "jpg", "jpeg"}
@@ -92,10 +45,10 @@ def load_prompt(path, video_offset=None, n_prompt_frames=1):
         # add frame dimension
         prompt = rearrange(prompt, "c h w -> 1 c h w")
     elif path.lower().split(".")[-1] in VIDEO_EXTENSIONS:
-        prompt = read_video(path, pts_unit="sec")[0]
-        if video_offset is not None:
-            prompt = prompt[video_offset:]
-        prompt = prompt[:n_prompt_frames]
+        # only decode the prompt frames instead of the whole video
+        start = video_offset if video_offset is not None else 0
+        prompt = read_frames(path, start, start + n_prompt_frames)
+        prompt = rearrange(prompt, "t h w c -> t c h w")
     else:
         raise ValueError(f"unrecognized prompt file extension; expected one in {IMAGE_EXTENSIONS} or {VIDEO_EXTENSIONS}")
     assert prompt.shape[0] == n_prompt_frames, f"input prompt {path} had less than n_prompt_frames={n_prompt_frames} frames"
@@ -106,16 +59,24 @@ def load_prompt(path, video_offset=None, n_prompt_frames=1):
     return prompt
 
 
-def load_actions(path, action_offset=None):
-    if path.endswith(".actions.pt"):
-        actions = one_hot_actions(torch.load(path))
+def load_actions(path, action_offset=None, prepend_zero=False):
+    """
+    (1, T, num_actions) one-hot actions. The first frame of a rollout has no action: prepend_zero puts a zero
+    action in front of the stream (what generate_video.py and game.py --headless do, action i then belongs to
+    frame i), otherwise the first action is overwritten with zeros.
+    """
+    if path.endswith(".actions.pt") or path.endswith(".actions.npy"):
+        actions = load_one_hot_actions(path)
     elif path.endswith(".one_hot_actions.pt"):
         actions = torch.load(path, weights_only=True)
     else:
-        raise ValueError("unrecognized action file extension; expected '*.actions.pt' or '*.one_hot_actions.pt'")
+        raise ValueError("unrecognized action file extension; expected '*.actions.pt', '*.actions.npy' or '*.one_hot_actions.pt'")
     if action_offset is not None:
         actions = actions[action_offset:]
+    if prepend_zero:
+        actions = torch.cat([torch.zeros_like(actions[:1]), actions], dim=0)
     # add batch dimension
     actions = rearrange(actions, "t d -> 1 t d")
-    actions[:, :1] = torch.zeros_like(actions[:, :1])  # zero-init first frame's action
+    if not prepend_zero:
+        actions[:, :1] = torch.zeros_like(actions[:, :1])  # zero-init first frame's action
     return actions
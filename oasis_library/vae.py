@@ -16,6 +16,7 @@ from timm.models.vision_transformer import Mlp
 from timm.layers.helpers import to_2tuple
 from oasis_library.rotary_embedding_torch import RotaryEmbedding, apply_rotary_emb
 from oasis_library.dit import PatchEmbed
+from oasis_library.profiling import maybe_instrument
 
 
 class DiagonalGaussianDistribution(object):
@@ -223,6 +224,7 @@ class AutoencoderKL(nn.Module):
 
         # initialize this weight first
         self.initialize_weights()
+        maybe_instrument(self)  # only does something with OASIS_PROFILE=1, see profiling.py
 
     def initialize_weights(self):
         # initialization
@@ -0,0 +1,120 @@
+"""
+Frame-range video reading.
+
+torchvision's read_video decodes the whole file even when only a few frames are needed. Here every file
+gets an index of its frame timestamps and keyframes (built by demuxing, without decoding, and cached
+next to the video as <video>.index.json), so a range of frames can be read by seeking to the closest
+keyframe and decoding only from there.
+"""
+
+import bisect
+import json
+import os
+from functools import lru_cache
+
+import av
+import numpy as np
+import torch
+
+INDEX_SUFFIX = ".index.json"
+
+
+def _build_index(path):
+    pts = []
+    keyframes = []
+    with av.open(path) as container:
+        stream = container.streams.video[0]
+        for packet in container.demux(stream):
+            if packet.pts is None:
+                continue
+            pts.append(packet.pts)
+            if packet.is_keyframe:
+                keyframes.append(packet.pts)
+    # frames are numbered in presentation order, same as read_video
+    return {"pts": sorted(pts), "keyframes": sorted(keyframes)}
+
+
+@lru_cache(maxsize=1024)
+def _load_index(path, size, mtime):
+    index_path = path + INDEX_SUFFIX
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+        if index.get("size") == size and index.get("mtime") == mtime:
+            return index
+    except (OSError, ValueError):
+        pass  # missing or corrupt, rebuilt below
+    index = _build_index(path)
+    index["size"], index["mtime"] = size, mtime
+    # DataLoader workers and the builders' process pools index the same videos at the same time, so the
+    # index is written under a name of its own and renamed into place, readers never see half a file
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, index_path)
+    except OSError:
+        # read-only dataset, keep the index in memory only
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return index
+
+
+def get_index(path):
+    """
+    Returns {"pts": [...], "keyframes": [...]} for the video stream of path.
+    """
+    stat = os.stat(path)
+    return _load_index(os.path.abspath(path), stat.st_size, stat.st_mtime)
+
+
+def num_frames(path):
+    return len(get_index(path)["pts"])
+
+
+def _keyframe_before(index, target_pts):
+    keyframes = index["keyframes"]
+    return keyframes[max(bisect.bisect_right(keyframes, target_pts) - 1, 0)]
+
+
+def iter_frames(path, chunk_size=32, start=0, end=None):
+    """
+    Decodes frames [start, end) of a video in a single pass and yields (T, H, W, C) uint8 tensors of at
+    most chunk_size frames, the same layout as read_video(path, pts_unit="sec")[0].
+    """
+    index = get_index(path)
+    pts = index["pts"]
+    end = len(pts) if end is None else min(end, len(pts))
+    if start >= end:
+        return
+    first_pts = pts[start]
+    remaining = end - start
+
+    chunk = []
+    with av.open(path) as container:
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        container.seek(_keyframe_before(index, first_pts), backward=True, any_frame=False, stream=stream)
+        for frame in container.decode(stream):
+            if frame.pts is None or frame.pts < first_pts:
+                continue
+            chunk.append(frame.to_ndarray(format="rgb24"))
+            remaining -= 1
+            if len(chunk) == chunk_size or remaining == 0:
+                yield torch.from_numpy(np.stack(chunk))
+                chunk = []
+            if remaining == 0:
+                break
+    if chunk:
+        yield torch.from_numpy(np.stack(chunk))
+
+
+def read_frames(path, start=0, end=None):
+    """
+    Decodes frames [start, end) of a video into one (T, H, W, C) uint8 tensor.
+    """
+    end = num_frames(path) if end is None else end
+    chunks = list(iter_frames(path, chunk_size=max(end - start, 1), start=start, end=end))
+    if not chunks:
+        return torch.zeros((0, 0, 0, 3), dtype=torch.uint8)
+    return torch.cat(chunks)
@@ -6,6 +6,7 @@ This file should mostly be used for debugging
 import cv2
 import torch
 import numpy as np
+from oasis_library.actions import actions_to_dicts, load_actions_array
 # {'ESC': 0, 'back': 0, 'drop': 0, 'forward': 0, 'hotbar.1': 0, 'hotbar.2': 0, 'hotbar.3': 0, 'hotbar.4': 0, 'hotbar.5': 0, 'hotbar.6': 0, 'hotbar.7': 0, 'hotbar.8': 0, 'hotbar.9': 0, 
 # 'inventory': 0, 'jump': 0, 'left': 0, 'right': 0, 'sneak': 0, 'sprint': 0, 'swapHands': 0, 'camera': array([40, 40]), 'attack': 0, 'use': 0, 'pickItem': 0}
 
@@ -22,7 +23,8 @@ ACTION_KEYS = [
 ]
 
 def load_actions(action_path):
-    return torch.load(action_path, weights_only=False)
+    # works for the old pickled .pt files and the .npy files the recorder writes now
+    return actions_to_dicts(load_actions_array(action_path))
 
 def draw_overlay(frame, actions, frame_idx, width, height):
     overlay = frame.copy()
@@ -0,0 +1,60 @@
+"""
+Packs a training folder (replay_<id>.mp4 + actions_<id>.npy/.pt, optionally the latents of
+precompute_latents.py) into tar shards of about --shard-size-mb each, see oasis_library/tar_shards.py.
+Recordings are shuffled before packing so every shard holds a mix of sessions.
+Point tar_shards_dir in train.py at the output folder.
+"""
+import argparse
+import glob
+import os
+import random
+
+from tqdm import tqdm
+
+from oasis_library.actions import find_actions_file, load_actions_array
+from oasis_library.latent_cache import LatentCache
+from oasis_library.tar_shards import ShardWriter
+from oasis_library.video_reader import num_frames
+
+
+def main(args):
+    cached = {}
+    if args.latent_cache_dir is not None:
+        cache = LatentCache(args.latent_cache_dir)
+        cached = {video["video_id"]: video_idx for video_idx, video in enumerate(cache.videos)}
+
+    video_files = sorted(glob.glob(os.path.join(args.data_dir, "replay_*.mp4")))
+    random.Random(args.seed).shuffle(video_files)
+
+    writer = ShardWriter(args.output_dir, max_shard_bytes=args.shard_size_mb << 20)
+    for key, video_path in enumerate(tqdm(video_files, desc="Packing videos")):
+        video_id = os.path.basename(video_path).split("replay_")[1].split(".mp4")[0]
+        actions_path = find_actions_file(args.data_dir, video_id)
+        if actions_path is None:
+            print(f"⚠️ Skipping {video_id}: missing actions file.")
+            continue
+        latents = brightness = None
+        if args.latent_cache_dir is not None:
+            if video_id not in cached:
+                print(f"⚠️ Skipping {video_id}: not in the latent cache.")
+                continue
+            video = cache.videos[cached[video_id]]
+            latents, _ = cache.segment(cached[video_id], 0, video["length"])
+            latents = latents.half().numpy()
+            brightness = cache.brightness(cached[video_id])
+        with open(video_path, "rb") as f:
+            video_bytes = f.read()
+        writer.add(f"{key:08d}", video_id, video_bytes, num_frames(video_path), load_actions_array(actions_path), latents, brightness)
+    writer.close()
+    print(f"Wrote {sum(shard['samples'] for shard in writer.shards)} recordings into {len(writer.shards)} shards in {args.output_dir}")
+
+
+if __name__ == "__main__":
+    parse = argparse.ArgumentParser()
+    parse.add_argument("--data-dir", type=str, default="training")
+    parse.add_argument("--output-dir", type=str, default="training_shards")
+    parse.add_argument("--latent-cache-dir", type=str, default=None, help="also pack the latents of precompute_latents.py")
+    parse.add_argument("--shard-size-mb", type=int, default=1024)
+    parse.add_argument("--seed", type=int, default=0)
+    args = parse.parse_args()
+    main(args)
@@ -0,0 +1,55 @@
+"""
+Encodes every replay_*.mp4 in the training folder once with the frozen VAE and writes the fp16 latents,
+one-hot actions and per-frame brightness into memory-mapped shards (see oasis_library/latent_cache.py).
+Point latent_cache_dir in train.py at the output folder to skip VAE encoding during training.
+"""
+import argparse
+import glob
+import os
+
+import torch
+import numpy as np
+from tqdm import tqdm
+
+from oasis_library.latent_cache import LatentShardWriter, encode_video
+from oasis_library.actions import find_actions_file, load_one_hot_actions
+from oasis_library.vae import VAE_models
+from oasis_library.video_reader import iter_frames, num_frames
+
+device = "cuda:0" if torch.cuda.is_available() else "cpu"
+
+
+def main(args):
+    vae = VAE_models["vit-l-20-shallow-encoder"]()
+    vae.load_state_dict(torch.load(args.vae_ckpt, weights_only=True))
+    vae = vae.to(device).eval()
+
+    writer = LatentShardWriter(args.output_dir, frames_per_shard=args.frames_per_shard)
+    video_files = sorted(glob.glob(os.path.join(args.data_dir, "replay_*.mp4")))
+    for video_path in tqdm(video_files, desc="Encoding videos"):
+        video_id = os.path.basename(video_path).split("replay_")[1].split(".mp4")[0]
+        actions_path = find_actions_file(args.data_dir, video_id)
+        if actions_path is None:
+            print(f"⚠️ Skipping {video_id}: missing actions file.")
+            continue
+
+        actions = load_one_hot_actions(actions_path)
+        n_frames = min(num_frames(video_path), actions.shape[0])
+        # decode and encode chunk by chunk so the whole video is never held in memory
+        encoded = [encode_video(vae, chunk, device, batch_frames=args.batch_frames) for chunk in iter_frames(video_path, args.batch_frames, end=n_frames)]
+        latents = np.concatenate([latents for latents, _ in encoded])
+        brightness = np.concatenate([brightness for _, brightness in encoded])
+        writer.add(video_id, latents, actions[:n_frames].numpy(), brightness)
+    writer.close()
+    print(f"Wrote {len(writer.index)} videos in {writer.shard} shards to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    parse = argparse.ArgumentParser()
+    parse.add_argument("--data-dir", type=str, default="training")
+    parse.add_argument("--output-dir", type=str, default="training_latents")
+    parse.add_argument("--vae-ckpt", type=str, default="vit-l-20.pt")
+    parse.add_argument("--frames-per-shard", type=int, default=20000)
+    parse.add_argument("--batch-frames", type=int, default=32, help="frames encoded per VAE call")
+    args = parse.parse_args()
+    main(args)
@@ -0,0 +1,30 @@
+import pytest
+import torch
+
+from oasis_library.dit import DiT
+
+
+@pytest.fixture
+def tiny_dit():
+    """
+    A small DiT on CPU with random weights everywhere (initialize_weights zeroes the output layers, which
+    would make every comparison trivially pass).
+    """
+    torch.manual_seed(0)
+    model = DiT(input_h=4, input_w=8, patch_size=2, in_channels=4, hidden_size=32, depth=2, num_heads=4, max_frames=6)
+    with torch.no_grad():
+        for p in model.parameters():
+            p.normal_(0, 0.2)
+    return model.eval()
+
+
+def random_inputs(model, B, T, seed=1):
+    """
+    (x, t, actions) for T frames of B samples.
+    """
+    g = torch.Generator().manual_seed(seed)
+    H, W = model.x_embedder.img_size
+    x = torch.randn(B, T, model.in_channels, H, W, generator=g)
+    t = torch.randint(0, 1000, (B, T), generator=g)
+    actions = torch.rand(B, T, model.external_cond.in_features, generator=g)
+    return x, t, actions
@@ -0,0 +1,97 @@
+import numpy as np
+import torch
+
+from oasis_library.actions import (
+    ACTION_DTYPE,
+    ACTION_KEYS,
+    BUTTON_KEYS,
+    actions_from_dicts,
+    actions_to_dicts,
+    actions_to_one_hot,
+    camera_mu_law_decode,
+    camera_mu_law_encode,
+    convert_actions_file,
+    empty_actions,
+    find_actions_file,
+    load_actions_array,
+    save_actions,
+)
+
+
+def random_dicts(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return [
+        {**{key: int(rng.random() < 0.3) for key in BUTTON_KEYS}, "camera": rng.integers(0, 81, size=2)}
+        for _ in range(n)
+    ]
+
+
+def one_hot_loop(actions):
+    # the per-frame loop utils.one_hot_actions used to be
+    out = torch.zeros(len(actions), len(ACTION_KEYS))
+    for i, frame in enumerate(actions):
+        for j, key in enumerate(ACTION_KEYS):
+            if key == "cameraX":
+                value = (frame["camera"][0] - 40) / 40
+            elif key == "cameraY":
+                value = (frame["camera"][1] - 40) / 40
+            else:
+                value = frame[key]
+            out[i, j] = value
+    return out
+
+
+def test_one_hot_matches_loop():
+    dicts = random_dicts(50)
+    assert torch.equal(actions_to_one_hot(actions_from_dicts(dicts)), one_hot_loop(dicts))
+
+
+def test_dicts_round_trip():
+    dicts = random_dicts(20)
+    back = actions_to_dicts(actions_from_dicts(dicts))
+    for frame, frame_back in zip(dicts, back):
+        assert {key: frame[key] for key in BUTTON_KEYS} == {key: frame_back[key] for key in BUTTON_KEYS}
+        assert list(frame["camera"]) == list(frame_back["camera"])
+
+
+def test_missing_keys_are_released():
+    actions = actions_from_dicts([{"forward": 1, "camera": (40, 40)}])
+    assert actions["forward"][0] == 1
+    assert all(actions[key][0] == 0 for key in BUTTON_KEYS if key != "forward")
+    assert len(actions_from_dicts([])) == 0
+
+
+def test_empty_actions_are_zero_input():
+    assert not actions_to_one_hot(empty_actions(3)).any()
+
+
+def test_camera_mu_law():
+    deltas = np.linspace(-30, 30, 241)
+    bins = camera_mu_law_encode(deltas)
+    # what the recorder's compress_mouse computed, one value at a time
+    mu, max_val = 2.7, 20
+    for delta, b in zip(deltas, bins):
+        v = np.clip(delta, -max_val, max_val) / max_val
+        v = np.sign(v) * np.log(1 + mu * abs(v)) / np.log(1 + mu) * max_val
+        assert b == np.round((v + max_val) / 0.5)
+    assert bins.min() == 0 and bins.max() == 80 and camera_mu_law_encode(0) == 40
+    assert np.array_equal(camera_mu_law_encode(camera_mu_law_decode(np.arange(81))), np.arange(81))
+
+
+def test_save_load_and_convert(tmp_path):
+    dicts = random_dicts(10)
+    actions = actions_from_dicts(dicts)
+    path = tmp_path / "actions_a.npy"
+    save_actions(path, actions)
+    loaded = load_actions_array(path)
+    assert loaded.dtype == ACTION_DTYPE and np.array_equal(loaded, actions)
+
+    pt_path = tmp_path / "actions_b.pt"
+    torch.save(dicts, pt_path)
+    assert np.array_equal(load_actions_array(pt_path), actions)
+    assert find_actions_file(tmp_path, "b") == str(pt_path)
+    converted = convert_actions_file(pt_path)
+    assert np.array_equal(np.load(converted), actions)
+    # the converted .npy wins over the .pt
+    assert find_actions_file(tmp_path, "b") == converted
+    assert find_actions_file(tmp_path, "c") is None
@@ -0,0 +1,116 @@
+import os
+import shutil
+
+import numpy as np
+
+from oasis_library.dataset_index import DatasetIndex
+from oasis_library.datasets import AliasSegmentSampler, build_alias_table, segment_weights
+
+
+def touch(path, content=b"x", mtime=None):
+    with open(path, "wb") as f:
+        f.write(content)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return str(path)
+
+
+def test_alias_table_is_exact():
+    weights = np.array([0.5, 3.0, 0.0, 1.5, 1.0, 2.0])
+    prob, alias = build_alias_table(weights)
+    # column i is picked with 1/n, keeps i with prob[i] and goes to alias[i] otherwise
+    n = len(weights)
+    p = prob / n
+    np.add.at(p, alias, (1 - prob) / n)
+    assert np.allclose(p, weights / weights.sum())
+
+
+def test_alias_sampler_draws():
+    np.random.seed(0)
+    weights = np.array([1.0, 2.0, 7.0])
+    sampler = AliasSegmentSampler(np.array([0, 1, 1]), np.array([5, 0, 3]), weights, 20000)
+    picks = list(sampler)
+    assert len(picks) == len(sampler) == 20000
+    counts = {pick: picks.count(pick) / len(picks) for pick in set(picks)}
+    assert set(counts) == {(0, 5), (1, 0), (1, 3)}
+    assert abs(counts[(1, 3)] - 0.7) < 0.02 and abs(counts[(0, 5)] - 0.1) < 0.02
+    assert list(AliasSegmentSampler(np.zeros(0), np.zeros(0), np.zeros(0), 10)) == []
+
+
+def test_segment_weights():
+    bright, dark = np.full(10, 0.5), np.full(10, 0.5)
+    dark[:4] = 0.0
+    video_idx, starts, weights = segment_weights([10, 3, 10], [bright, bright[:3], dark], total_frames=4)
+    # the 3 frame video is too short, the dark video loses the segments that start in the dark
+    assert set(video_idx.tolist()) == {0, 2}
+    assert starts[video_idx == 0].tolist() == list(range(7))
+    assert starts[video_idx == 2].min() == 2
+    # every video gets the same total weight, later segments more of it
+    assert np.isclose(weights[video_idx == 0].sum(), 1) and np.isclose(weights[video_idx == 2].sum(), 1)
+    assert np.all(np.diff(weights[video_idx == 0]) > 0)
+
+    damage = [np.array([6]), np.zeros(0), np.zeros(0)]
+    _, starts_d, weights_d = segment_weights([10], [bright], total_frames=4, damage=damage, damage_weight=1.0, n_prompt_frames=2)
+    ratio = weights_d / weights[video_idx == 0]
+    # frame 6 is a target frame of the segments starting at 3 and 4 (prompt frames don't count)
+    boosted = np.isclose(ratio / ratio.min(), 2.0)
+    assert starts_d[boosted].tolist() == [3, 4]
+
+
+def test_index_round_trip(tmp_path):
+    video = touch(tmp_path / "replay_a.mp4", mtime=1000)
+    actions = touch(tmp_path / "actions_a.npy", mtime=1000)
+    index = DatasetIndex(str(tmp_path / "index.sqlite"))
+    assert not index.is_current(video, actions)
+    index.add_video(video, actions, 9, np.linspace(0, 1, 10), health=np.arange(10), events=[(7, "damage"), (3, "damage"), (9, "death")])
+    assert index.is_current(video, actions)
+    (entry,) = index.videos()
+    assert entry["video_path"] == video and entry["actions_path"] == actions
+    assert entry["num_frames"] == 10 and entry["num_actions"] == 9
+    assert np.allclose(entry["brightness"], np.linspace(0, 1, 10), atol=1e-3)
+    assert entry["health"].tolist() == list(range(10))
+    assert entry["damage"].tolist() == [3, 7] and entry["deaths"].tolist() == [9]
+
+    # re-adding replaces the entry and its events
+    index.add_video(video, actions, 9, np.ones(10))
+    (entry,) = index.videos()
+    assert entry["health"] is None and len(entry["damage"]) == 0
+    index.close()
+
+    # paths are relative to the index, so the folder can move
+    moved = tmp_path / "moved"
+    os.mkdir(moved)
+    for name in ["replay_a.mp4", "actions_a.npy", "index.sqlite"]:
+        shutil.move(tmp_path / name, moved / name)
+    index = DatasetIndex(str(moved / "index.sqlite"))
+    assert index.videos()[0]["video_path"] == str(moved / "replay_a.mp4")
+    os.remove(moved / "replay_a.mp4")
+    assert index.remove_missing() == 1 and index.videos(with_actions=False) == []
+
+
+def test_index_freshness(tmp_path):
+    video = touch(tmp_path / "replay_a.mp4", mtime=1000)
+    index = DatasetIndex(str(tmp_path / "index.sqlite"))
+
+    # indexed before the actions existed
+    index.add_video(video, None, 0, np.ones(10))
+    assert index.is_current(video, None)
+    assert index.videos() == [] and len(index.videos(with_actions=False)) == 1
+    actions = touch(tmp_path / "actions_a.npy", mtime=1000)
+    assert not index.is_current(video, actions)
+
+    index.add_video(video, actions, 10, np.ones(10))
+    assert index.is_current(video, actions)
+    # actions re-converted
+    os.utime(actions, (2000, 2000))
+    assert not index.is_current(video, actions)
+    index.add_video(video, actions, 10, np.ones(10))
+    # video re-encoded
+    touch(video, b"xy", mtime=1000)
+    assert not index.is_current(video, actions)
+    index.add_video(video, actions, 10, np.ones(10))
+
+    # actions deleted (convert_actions.py --remove): stale, and left out of training
+    os.remove(actions)
+    assert not index.is_current(video, None)
+    assert index.videos() == []
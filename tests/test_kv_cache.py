@@ -0,0 +1,77 @@
+import torch
+
+from conftest import random_inputs
+from oasis_library.attention import TemporalKVCache
+
+
+@torch.no_grad()
+def test_prefill_matches_full_forward(tiny_dit):
+    x, t, actions = random_inputs(tiny_dit, 2, 5)
+    full = tiny_dit(x, t, actions)
+
+    cache = tiny_dit.prefill(x[:, :4], t[:, :4], tiny_dit.new_kv_cache(), actions[:, :4])
+    assert len(cache) == 4
+    assert torch.allclose(tiny_dit(x[:, 4:], t[:, 4:], actions[:, 4:], kv_cache=cache), full[:, 4:], atol=1e-5)
+    # forward doesn't add the new frames to the cache
+    assert len(cache) == 4
+
+    # several new frames at once
+    cache = tiny_dit.prefill(x[:, :2], t[:, :2], tiny_dit.new_kv_cache(), actions[:, :2])
+    assert torch.allclose(tiny_dit(x[:, 2:], t[:, 2:], actions[:, 2:], kv_cache=cache), full[:, 2:], atol=1e-5)
+
+
+@torch.no_grad()
+def test_prefix_reuse(tiny_dit):
+    # the cache is extended a frame at a time, as a rollout does, instead of being rebuilt
+    x, t, actions = random_inputs(tiny_dit, 1, 6)
+    cache = tiny_dit.new_kv_cache()
+    for i in range(5):
+        tiny_dit.prefill(x[:, i : i + 1], t[:, i : i + 1], cache, actions[:, i : i + 1])
+        full = tiny_dit(x[:, : i + 2], t[:, : i + 2], actions[:, : i + 2])
+        assert torch.allclose(tiny_dit(x[:, i + 1 : i + 2], t[:, i + 1 : i + 2], actions[:, i + 1 : i + 2], kv_cache=cache), full[:, -1:], atol=1e-5)
+    tiny_dit.prefill(x[:, :0], t[:, :0], cache, actions[:, :0])
+    assert len(cache) == 5
+    cache.reset()
+    assert len(cache) == 0
+
+
+@torch.no_grad()
+def test_split(tiny_dit):
+    x, t, actions = random_inputs(tiny_dit, 3, 4)
+    full = tiny_dit(x, t, actions)
+    cache = tiny_dit.prefill(x[:, :3], t[:, :3], tiny_dit.new_kv_cache(), actions[:, :3])
+    for b, sample_cache in enumerate(cache.split(3)):
+        out = tiny_dit(x[b : b + 1, 3:], t[b : b + 1, 3:], actions[b : b + 1, 3:], kv_cache=sample_cache)
+        assert torch.allclose(out, full[b : b + 1, 3:], atol=1e-5)
+
+
+@torch.no_grad()
+def test_stack_pads_and_masks(tiny_dit):
+    # sessions with 1, 3 and no context frames, batched the way the scheduler does
+    lengths = [1, 3, 0]
+    inputs = [random_inputs(tiny_dit, 1, length + 2, seed=i) for i, length in enumerate(lengths)]
+    caches = [tiny_dit.prefill(x[:, :n], t[:, :n], tiny_dit.new_kv_cache(), a[:, :n]) for (x, t, a), n in zip(inputs, lengths)]
+    stacked = TemporalKVCache.stack(caches)
+    assert len(stacked) == 3
+    assert stacked.key_padding_mask.tolist() == [[False, False, True], [True, True, True], [False, False, False]]
+
+    def frame(k):
+        # frame k after each session's own context, batched
+        return [torch.cat([tensor[:, n + k : n + k + 1] for tensor, n in zip(tensors, lengths)]) for tensors in zip(*inputs)]
+
+    # one more context frame for everyone (the mask grows with it), then the new frames
+    x, t, a = frame(0)
+    tiny_dit.prefill(x, t, stacked, a)
+    assert stacked.key_padding_mask.shape == (3, 4) and stacked.key_padding_mask[:, -1].all()
+    x, t, a = frame(1)
+    out = tiny_dit(x, t, a, kv_cache=stacked)
+    for b, ((x_b, t_b, a_b), n) in enumerate(zip(inputs, lengths)):
+        # the real frames keep their positions relative to the new frame, so the result is what the session gets alone
+        alone = tiny_dit(x_b[:, : n + 2], t_b[:, : n + 2], a_b[:, : n + 2])[:, -1:]
+        assert torch.allclose(out[b : b + 1], alone, atol=1e-5)
+
+
+def test_stack_empty():
+    caches = [TemporalKVCache(2), TemporalKVCache(2)]
+    stacked = TemporalKVCache.stack(caches)
+    assert len(stacked) == 0 and stacked.key_padding_mask is None
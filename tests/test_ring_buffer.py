@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from oasis_library.actions import ACTION_DTYPE, empty_actions
+from oasis_library.ring_buffer import RingBuffer
+
+
+def test_wraps_around():
+    ring = RingBuffer(4, np.int64)
+    for i in range(10):
+        ring.append(i)
+    assert ring.full and len(ring) == 4 and ring.count == 10 and ring.oldest == 6
+    assert ring.ordered().tolist() == [6, 7, 8, 9]
+    assert ring.copy_range(7, 10).tolist() == [7, 8, 9]
+    assert ring.get(6) == 6
+    with pytest.raises(AssertionError):
+        ring.get(5)
+    with pytest.raises(AssertionError):
+        ring.copy_range(5, 8)
+
+
+def test_not_full():
+    ring = RingBuffer(4, np.int64)
+    ring.append(1)
+    ring.append(2)
+    assert not ring.full and len(ring) == 2 and ring.oldest == 0
+    assert ring.ordered().tolist() == [1, 2]
+    ring.clear()
+    assert len(ring) == 0 and ring.ordered().tolist() == []
+
+
+def test_next_slot_and_commit():
+    ring = RingBuffer(3, np.uint8, (2, 2))
+    for i in range(5):
+        ring.next_slot()[...] = i
+        ring.commit()
+    assert [int(frame[0, 0]) for frame in ring.ordered()] == [2, 3, 4]
+
+
+def test_copies_are_detached():
+    ring = RingBuffer(2, ACTION_DTYPE)
+    row = empty_actions(1)[0]
+    row["forward"] = 1
+    ring.append(row)
+    # the recorder keeps updating its row in place after appending it
+    row["forward"] = 0
+    saved = ring.copy_range(0, 1)
+    ring.append(row)
+    ring.append(row)
+    assert ring.data["forward"].tolist() == [0, 0] and saved["forward"].tolist() == [1]
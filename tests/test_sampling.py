@@ -0,0 +1,101 @@
+import math
+
+import pytest
+import torch
+
+from conftest import random_inputs
+from oasis_library.sampling import SOLVERS, FrameSampler
+from oasis_library.utils import sigmoid_beta_schedule
+
+ALPHAS_CUMPROD = torch.cumprod(1 - sigmoid_beta_schedule(1000), 0)
+
+
+def ddim_loop(model, x, actions, kv_cache, steps, noise_abs_max):
+    # the denoising loop game.py used to run inline
+    alphas_cumprod = ALPHAS_CUMPROD.float().view(-1, 1, 1, 1)
+    noise_range = torch.linspace(-1, 999, steps + 1)
+    B = x.shape[0]
+    x = x.clone()
+    for noise_idx in reversed(range(1, steps + 1)):
+        t = torch.full((B, 1), noise_range[noise_idx], dtype=torch.long)
+        t_next = torch.full((B, 1), noise_range[noise_idx - 1], dtype=torch.long)
+        t_next = torch.where(t_next < 0, t, t_next)
+        v = model(x, t, actions, kv_cache=kv_cache)
+        x_start = alphas_cumprod[t].sqrt() * x - (1 - alphas_cumprod[t]).sqrt() * v
+        x_noise = ((1 / alphas_cumprod[t]).sqrt() * x - x_start) / (1 / alphas_cumprod[t] - 1).sqrt()
+        alpha_next = alphas_cumprod[t_next]
+        if noise_idx == 1:
+            alpha_next = torch.ones_like(alpha_next)
+        x = alpha_next.sqrt() * x_start + x_noise * (1 - alpha_next).sqrt()
+        x = torch.clamp(x, -noise_abs_max, noise_abs_max)
+    return x
+
+
+@pytest.mark.parametrize("steps", [1, 4, 16])
+@torch.no_grad()
+def test_ddim_matches_inline_loop(tiny_dit, steps):
+    x, _, actions = random_inputs(tiny_dit, 2, 4)
+    t_ctx = torch.full((2, 3), 14, dtype=torch.long)
+    kv_cache = tiny_dit.prefill(x[:, :3], t_ctx, tiny_dit.new_kv_cache(), actions[:, :3])
+    x_new = x[:, 3:].clone()
+
+    sampler = FrameSampler(ALPHAS_CUMPROD.view(-1, 1, 1, 1), steps)
+    out = sampler.sample(tiny_dit, x_new, actions[:, 3:], kv_cache, noise_abs_max=20)
+    assert torch.equal(x_new, x[:, 3:]), "sample() must not touch its input"
+    expected = ddim_loop(tiny_dit, x[:, 3:], actions[:, 3:], kv_cache, steps, noise_abs_max=20)
+    assert torch.allclose(out, expected, atol=1e-4, rtol=1e-4)
+
+
+@pytest.mark.parametrize("solver", SOLVERS)
+def test_tables(solver):
+    steps = 6
+    sampler = FrameSampler(ALPHAS_CUMPROD, steps, solver)
+    noise_range = torch.linspace(-1, 999, steps + 1).long()
+    assert sampler.timesteps.flatten().tolist() == noise_range[1:].flip(0).tolist()
+    for k, row in enumerate(sampler.table):
+        assert math.isclose(row["alpha"] ** 2 + row["sigma"] ** 2, 1)
+        assert math.isclose(row["w_cur"] + row["w_prev"], 1)
+        if solver == "ddim" or k in (0, steps - 1):
+            assert (row["w_cur"], row["w_prev"]) == (1.0, 0.0)
+        else:
+            assert row["w_prev"] < 0
+        for key, column in sampler.coefficients.items():
+            assert math.isclose(column[k].item(), row[key], rel_tol=1e-6)
+    # the last step lands on the clean frame
+    assert sampler.table[-1]["c_x"] == 0 and math.isclose(sampler.table[-1]["c_d"], 1)
+
+
+def test_step_is_the_table_update():
+    sampler = FrameSampler(ALPHAS_CUMPROD, 4, "dpm++2m")
+    x, v, x0_prev = torch.randn(3, 2, 5).double().unbind(0)
+    row = sampler.table[1]
+    x_next, x0 = sampler.step(1, x, v, x0_prev)
+    assert torch.allclose(x0, row["alpha"] * x - row["sigma"] * v)
+    d = row["w_cur"] * x0 + row["w_prev"] * x0_prev
+    assert torch.allclose(x_next, row["c_x"] * x + row["c_d"] * d)
+
+
+def mixture_model(x, t, actions, kv_cache=None):
+    # exact v prediction for data that is a mixture of two narrow gaussians per value
+    a = ALPHAS_CUMPROD[t.flatten()].view(-1, 1, 1, 1, 1)
+    alpha, sigma = a.sqrt(), (1 - a).sqrt()
+    means, s = torch.tensor([-1.0, 1.2], dtype=torch.float64), 0.3
+    var = alpha**2 * s**2 + sigma**2
+    w = torch.softmax(torch.stack([-((x - alpha * m) ** 2) / (2 * var) for m in means]), 0)
+    x0 = sum(w[i] * (m + alpha * s**2 / var * (x - alpha * m)) for i, m in enumerate(means))
+    return alpha * (x - alpha * x0) / sigma - sigma * x0
+
+
+def test_dpm_needs_fewer_steps():
+    torch.manual_seed(0)
+    x = torch.randn(1, 1, 4, 8, 8, dtype=torch.float64)
+    reference = FrameSampler(ALPHAS_CUMPROD, 500).sample(mixture_model, x, None, None, autocast_dtype=None)
+
+    def error(steps, solver):
+        out = FrameSampler(ALPHAS_CUMPROD, steps, solver).sample(mixture_model, x, None, None, autocast_dtype=None)
+        return (out - reference).abs().mean().item()
+
+    for steps in [4, 6, 10]:
+        assert error(steps, "dpm++2m") < error(steps, "ddim")
+    # and 6 dpm++2m steps beat 8 DDIM ones
+    assert error(6, "dpm++2m") < error(8, "ddim")
@@ -0,0 +1,92 @@
+import torch
+
+from conftest import random_inputs
+from oasis_library.sampling import FrameSampler
+from oasis_library.session import WorldModelSession
+from oasis_library.utils import sigmoid_beta_schedule
+from oasis_library.vae import AutoencoderKL
+
+ALPHAS_CUMPROD = torch.cumprod(1 - sigmoid_beta_schedule(1000), 0)
+
+
+def new_session(model, window=4, vae=None):
+    return WorldModelSession(model, FrameSampler(ALPHAS_CUMPROD, 3), vae, context_window=window, batch_size=2, device="cpu", clamp_steps=True)
+
+
+@torch.no_grad()
+def reference_step(model, session, context, context_actions, action):
+    # what step_latent has to produce: the same noise, a fresh kv cache over the context, the sampler.
+    # The noise is drawn into a frame of the ring, and normal_ on a strided view uses the generator
+    # differently than on a contiguous tensor, so it is drawn into the same layout here.
+    noise = torch.zeros_like(session.latents)[:, :1].normal_().clamp_(-session.noise_abs_max, session.noise_abs_max)
+    t_ctx = torch.full(context.shape[:2], session.stabilization_level - 1, dtype=torch.long)
+    kv_cache = model.prefill(context, t_ctx, model.new_kv_cache(), context_actions)
+    return session.sampler.sample(model, noise, action[:, None], kv_cache, noise_abs_max=session.noise_abs_max)
+
+
+def test_reset_keeps_the_last_frames(tiny_dit):
+    session = new_session(tiny_dit)
+    prompt, _, prompt_actions = random_inputs(tiny_dit, 2, 5)
+    session.reset(prompt, prompt_actions)
+    assert session.count == 3
+    latents, actions = session._window(0, 3)
+    assert torch.equal(latents, prompt[:, 2:]) and torch.equal(actions, prompt_actions[:, 2:])
+
+    # default prompt actions are zero, and a new reset starts over
+    session.reset(prompt[:, :1])
+    latents, actions = session._window(0, 1)
+    assert session.count == 1 and torch.equal(latents, prompt[:, :1]) and not actions.any()
+
+
+def test_steps_match_a_sliding_window(tiny_dit):
+    window = 4
+    session = new_session(tiny_dit, window)
+    prompt, _, actions = random_inputs(tiny_dit, 2, 12)
+    session.reset(prompt[:, :2], actions[:, :2])
+    frames, frame_actions = list(prompt[:, :2].unbind(1)), list(actions[:, :2].unbind(1))
+    for i in range(2, 12):
+        context = torch.stack(frames[-(window - 1) :], 1)
+        context_actions = torch.stack(frame_actions[-(window - 1) :], 1)
+        torch.manual_seed(i)
+        expected = reference_step(tiny_dit, session, context, context_actions, actions[:, i])
+        torch.manual_seed(i)
+        latent = session.step_latent(actions[:, i])
+        assert torch.allclose(latent, expected, atol=1e-5)
+        frames.append(latent[:, 0])
+        frame_actions.append(actions[:, i])
+
+        # the mirrored ring always holds the last `window` frames as one contiguous view
+        start = max(0, session.count - window)
+        latents, ring_actions = session._window(start, session.count)
+        assert latents.data_ptr() >= session.latents.data_ptr()
+        assert torch.equal(latents, torch.stack(frames[start:], 1))
+        assert torch.equal(ring_actions, torch.stack(frame_actions[start:], 1))
+        # the kv cache only holds the context of the current window
+        assert session.cache_start == max(0, i + 1 - window) and len(session.kv_cache) == i - session.cache_start
+
+
+def test_returned_latents_stay_valid(tiny_dit):
+    session = new_session(tiny_dit, window=2)
+    prompt, _, actions = random_inputs(tiny_dit, 2, 6)
+    session.reset(prompt[:, :1])
+    first = session.step_latent(actions[:, 0])
+    kept = first.clone()
+    for i in range(1, 6):
+        session.step_latent(actions[:, i])
+    assert torch.equal(first, kept)
+
+
+@torch.no_grad()
+def test_step_decodes(tiny_dit):
+    torch.manual_seed(0)
+    H, W = tiny_dit.x_embedder.img_size
+    vae = AutoencoderKL(tiny_dit.in_channels, input_height=H * 4, input_width=W * 4, patch_size=4, enc_dim=32, enc_depth=1, enc_heads=2, dec_dim=32, dec_depth=1, dec_heads=2).eval()
+    session = new_session(tiny_dit, vae=vae)
+    prompt, _, actions = random_inputs(tiny_dit, 2, 2)
+    session.reset(prompt[:, :1])
+    torch.manual_seed(1)
+    frames = session.step(actions[:, 1])
+    assert frames.shape == (2, H * 4, W * 4, 3) and frames.dtype == torch.uint8
+    torch.manual_seed(1)
+    session.reset(prompt[:, :1])
+    assert torch.equal(session.decode(session.step_latent(actions[:, 1])), frames)
@@ -1,18 +1,39 @@
+import glob
+import os
+from contextlib import nullcontext
+
 import torch
+import torch.distributed as dist
 from torch.amp import autocast, GradScaler
+from torch.distributed.algorithms.join import Join
+from torch.nn.parallel import DistributedDataParallel
 from oasis_library.dit import DiT_models
 from oasis_library.vae import VAE_models
-from torchvision.io import read_video
-from oasis_library.utils import one_hot_actions, sigmoid_beta_schedule
+from oasis_library.utils import sigmoid_beta_schedule
+from oasis_library.datasets import AliasSegmentSampler, CachedSegmentDataset, EndWeightedSegmentSampler, VideoSegmentDataset, collate_segments, segment_weights
+from oasis_library.dataset_index import DatasetIndex
+from oasis_library.tar_shards import TarSegmentDataset
+from torch.utils.data import DataLoader
 from tqdm import tqdm
 from einops import rearrange
 import numpy as np
-import os
-import glob
 #import random
 
-# Ensure CUDA is available
-device = "cuda:0" if torch.cuda.is_available() else "cpu"
+# Distributed data parallel: `torchrun --nproc_per_node=<N> train.py` runs this script once per rank (plain
+# `python train.py` still trains in a single process). Ranks use nccl on GPUs and gloo on CPU, so multi-process
+# runs can be tried locally. Every rank trains on its own share of the videos, only rank 0 logs and saves.
+distributed = "WORLD_SIZE" in os.environ
+if distributed:
+    dist.init_process_group("nccl" if torch.cuda.is_available() else "gloo")
+    rank, world_size = dist.get_rank(), dist.get_world_size()
+    local_rank = int(os.environ.get("LOCAL_RANK", 0))
+else:
+    rank, world_size, local_rank = 0, 1, 0
+is_main = rank == 0
+
+device = torch.device(f"cuda:{local_rank}" if torch.cuda.is_available() else "cpu")
+if device.type == "cuda":
+    torch.cuda.set_device(device)
 
 # Load DiT checkpoint
 ckpt = torch.load("oasis500m.pt", weights_only=True)
@@ -20,11 +41,31 @@ model = DiT_models["DiT-S/2"]()
 model.load_state_dict(ckpt, strict=False)
 model = model.to(device).train()  # Set to training mode
 
-# Load VAE checkpoint
-vae_ckpt = torch.load("vit-l-20.pt", weights_only=True)
-vae = VAE_models["vit-l-20-shallow-encoder"]()
-vae.load_state_dict(vae_ckpt)
-vae = vae.to(device).eval()  # Set to evaluation mode
+# Memory/speed trade-offs, so B can go up
+gradient_checkpointing = None  # None, "spatial", "temporal" or "both" halves of every DiT block are recomputed in backward
+amp_dtype = torch.float16  # torch.bfloat16 on GPUs that support it (same range as fp32, the loss scaler turns itself off)
+model.set_gradient_checkpointing(gradient_checkpointing)
+
+# Forward/backward go through ddp_model, which averages the gradients over all ranks (rank 0's weights are
+# broadcast on construction)
+if distributed:
+    ddp_model = DistributedDataParallel(model, device_ids=[local_rank] if device.type == "cuda" else None)
+else:
+    ddp_model = model
+
+# Set to the output folder of precompute_latents.py to read pre-encoded segments instead of running the VAE
+latent_cache_dir = None
+# Set to the output folder of pack_tar_shards.py to stream segments out of large tar shards instead
+tar_shards_dir = None
+tar_shards_use_latents = False  # the shards were packed with --latent-cache-dir
+pre_encoded = latent_cache_dir is not None or (tar_shards_dir is not None and tar_shards_use_latents)
+
+# Load VAE checkpoint (only needed when encoding on the fly)
+if not pre_encoded:
+    vae_ckpt = torch.load("vit-l-20.pt", weights_only=True)
+    vae = VAE_models["vit-l-20-shallow-encoder"]()
+    vae.load_state_dict(vae_ckpt)
+    vae = vae.to(device).eval()  # Set to evaluation mode
 
 # Sampling parameters
 B = 1  # Batch size
@@ -37,6 +78,10 @@ ctx_max_noise_idx = (ddim_noise_steps // 10) * 3
 n_prompt_frames = 8  # Number of prompt frames (context)
 num_epochs = 4
 num_segments_per_epoch = 10  # Number of segments to use in each epoch
+# "per_frame": one forward/backward per target frame on the growing prefix (the original loop)
+# "diffusion_forcing": one forward/backward per batch over the whole window, with an independent noise
+# level for every frame and the loss on all target frames. Raise B to batch segments of several videos.
+training_mode = "per_frame"
 
 # Get alphas for noise scheduling
 betas = sigmoid_beta_schedule(max_noise_level).to(device)
@@ -47,79 +92,136 @@ alphas_cumprod = rearrange(alphas_cumprod, "T -> T 1 1 1")
 # Optimizer
 optimizer = torch.optim.AdamW(model.parameters(), lr=3e-4)
 
-# Scaler
-scaler = GradScaler()
+# Loss scaling keeps small fp16 gradients from underflowing, bf16 and fp32 don't need it
+scaler = GradScaler(device.type, enabled=device.type == "cuda" and amp_dtype == torch.float16)
 
 # Get all video-action pairs
 data_dir = "training"
-video_files = sorted(glob.glob(os.path.join(data_dir, "replay_*.mp4")))
+scaling_factor = 0.07843137255
+# Output of build_dataset_index.py. With it nothing is globbed or probed at startup and segments are drawn from
+# one alias table over all usable segments, so dark or short segments are never decoded
+dataset_index_path = None
+damage_weight = 4.0  # extra weight of indexed segments with damage or a death among their target frames
+
+# Data loading: segments are decoded (or read from the latent cache) in worker processes and
+# prefetched into pinned memory while the GPU trains on the current batch
+num_workers = 4
+prefetch_factor = 2
+
+# Every rank gets every world_size-th video (or shard), so the ranks never train on the same recording
+if tar_shards_dir is not None:
+    # shuffling and per-worker shard assignment happen inside the dataset
+    dataset = TarSegmentDataset(tar_shards_dir, total_frames, num_segments_per_epoch, use_latents=tar_shards_use_latents, rank=rank, world_size=world_size)
+elif latent_cache_dir is not None:
+    dataset = CachedSegmentDataset(latent_cache_dir, total_frames, rank=rank, world_size=world_size)
+elif dataset_index_path is not None:
+    indexed_videos = DatasetIndex(dataset_index_path).videos()[rank::world_size]
+    dataset = VideoSegmentDataset.from_index(indexed_videos, total_frames)
+else:
+    video_files = sorted(glob.glob(os.path.join(data_dir, "replay_*.mp4")))[rank::world_size]
+    dataset = VideoSegmentDataset(data_dir, total_frames, video_files=video_files)
+# Note that I want to bias towards selecting frames from the end of the video
+# This is specifically for my training set since the end of every video contains the part where the player gets damaged/killed
+if tar_shards_dir is not None:
+    sampler = None
+elif dataset_index_path is not None and latent_cache_dir is None:
+    sampler = AliasSegmentSampler(
+        *segment_weights(
+            dataset.lengths,
+            [video["brightness"] for video in indexed_videos],
+            total_frames,
+            damage=[np.union1d(video["damage"], video["deaths"]) for video in indexed_videos],
+            damage_weight=damage_weight,
+            n_prompt_frames=n_prompt_frames,
+        ),
+        num_samples=num_segments_per_epoch * len(dataset),
+    )
+else:
+    sampler = EndWeightedSegmentSampler(dataset.lengths, total_frames, num_segments_per_epoch, shuffle=training_mode == "diffusion_forcing")
+loader = DataLoader(
+    dataset,
+    batch_size=B,
+    sampler=sampler,
+    num_workers=num_workers,
+    collate_fn=collate_segments,
+    pin_memory=device.type == "cuda",
+    prefetch_factor=prefetch_factor if num_workers > 0 else None,
+    # the tar dataset reshuffles its shards through set_epoch, which only reaches freshly started workers
+    persistent_workers=num_workers > 0 and tar_shards_dir is None,
+)
+
+
+@torch.no_grad()
+def encode_frames(frames):
+    """
+    VAE-encodes a (B, T, H, W, C) uint8 batch of frames into (B, T, C, H, W) latents.
+    """
+    x = frames.float() / 255
+    b, t = x.shape[:2]
+    x_flat = rearrange(x, "b t h w c -> (b t) c h w")  # Shape: (B*T, C, H, W)
+    H, W = x_flat.shape[-2:]
+    x_flat = vae.encode(x_flat * 2 - 1).mean * scaling_factor  # VAE encoding
+    # Reshape back to (B, T, C, H, W)
+    return rearrange(x_flat, "(b t) (h w) c -> b t c h w", b=b, t=t, h=H // vae.patch_size, w=W // vae.patch_size)
+
+
+def diffusion_forcing_step(x_encoded, actions_curr):
+    """
+    Trains on every frame of a (B, total_frames, C, H, W) batch in a single pass. Causal temporal attention
+    means frame i only sees frames <= i, so each target frame is denoised from its (noisy) past like in
+    the per-frame loop, just with its own noise level instead of a shared context level.
+    Returns the loss.
+    """
+    x_curr = x_encoded.to(device, non_blocking=True)
+    B, T, C, H, W = x_curr.shape
+    assert T <= model.max_frames, f"segments of {T} frames do not fit in the {model.max_frames} frame window"
+
+    # Independent noise levels per frame, the prompt frames only get context-level noise
+    noise_idx = torch.randint(1, ddim_noise_steps + 1, (B, T), device=device)
+    noise_idx[:, :n_prompt_frames] = torch.randint(1, ctx_max_noise_idx + 1, (B, n_prompt_frames), device=device)
+    t = noise_range[noise_idx]
+
+    noise = torch.randn_like(x_curr)
+    noise = torch.clamp(noise, -noise_abs_max, +noise_abs_max)
+    x_noisy = (alphas_cumprod[t].sqrt() * x_curr + (1 - alphas_cumprod[t]).sqrt() * noise).float()  # alphas_cumprod is float64
+
+    with autocast(device_type=device.type, dtype=amp_dtype, enabled=device.type == "cuda"):
+        v = ddp_model(x_noisy, t, actions_curr)
+        # Compute loss on all target frames
+        loss = torch.nn.functional.mse_loss(v[:, n_prompt_frames:], noise[:, n_prompt_frames:])
+
+    optimizer.zero_grad()
+    scaler.scale(loss).backward()
+    scaler.step(optimizer)
+    scaler.update()
+    return loss.item()
+
 
 # Training loop
 for epoch in range(num_epochs):
     epoch_loss = 0.0
     total_steps = 0
-
-    for video_path in tqdm(video_files, desc=f"📁 Epoch {epoch + 1}: Processing videos", leave=True):
-        video_id = os.path.basename(video_path).split("replay_")[1].split(".mp4")[0]
-        actions_path = os.path.join(data_dir, f"actions_{video_id}.pt")
-        
-        if not os.path.exists(actions_path):
-            print(f"⚠️ Skipping {video_id}: missing actions file.")
-            continue
-
-        #print(f"\n🔁 Training on pair: {video_id}")
-
-        # Load video and actions
-        video = read_video(video_path, pts_unit="sec")[0].float() / 255
-        actions = one_hot_actions(torch.load(actions_path, map_location=device, weights_only=False))
-
-        N = video.shape[0]
-        if N < total_frames:
-            print(f"⚠️ Skipping {video_id}: not enough frames ({N} < {total_frames})")
-            continue
-
-        # Randomly select segment starts for this epoch
-        max_start = N - total_frames
-        # Note that I want to bias towards selecting frames from the end of the video
-        # This is specifically for my training set since the end of every video contains the part where the player gets damaged/killed
-        weights = np.linspace(1, max_start + 1, max_start + 1) ** 2  # Quadratic bias
-        weights = weights / weights.sum()  # Normalize to get probabilities
-        segment_starts = np.random.choice(np.arange(max_start + 1), size=num_segments_per_epoch, p=weights).tolist()
-
-        # Iterate over each segment
-        for segment_start in segment_starts:
-            # Get segment
-            x_segment = video[segment_start:segment_start + total_frames].unsqueeze(0)  # Shape: (1, total_frames, H, W, 3)
-            if x_segment.mean()<0.25: # We ignore video that is too dark
+    if tar_shards_dir is not None:
+        dataset.set_epoch(epoch)
+
+    # Ranks can run out of batches at different times (different videos, dark segments are dropped). Join lets
+    # the finished ranks keep answering the gradient all-reduces of the others instead of deadlocking them.
+    with Join([ddp_model]) if distributed else nullcontext():
+        for batch in tqdm(loader, desc=f"📁 Epoch {epoch + 1}: Processing segments", leave=True, disable=not is_main):
+            if batch is None:  # every segment of the batch was too dark
+                continue
+            x_batch, actions_batch = batch
+            actions_curr = actions_batch.to(device, non_blocking=True)
+            if pre_encoded:
+                x_encoded = x_batch
+            else:
+                x_encoded = encode_frames(x_batch.to(device, non_blocking=True)).to('cpu')  # Move to CPU to save GPU memory
+            del x_batch, actions_batch
+
+            if training_mode == "diffusion_forcing":
+                epoch_loss += diffusion_forcing_step(x_encoded, actions_curr)
+                total_steps += 1
                 continue
-
-            actions_segment = actions[segment_start:segment_start + total_frames].unsqueeze(0)  # Shape: (1, total_frames, action_dim)
-
-            # Move data to device
-            x = x_segment.to(device)  # Shape: (B, T, H, W, C)
-            actions_curr = actions_segment.to(device)
-
-            # VAE encoding for the segment
-            scaling_factor = 0.07843137255
-            x_flat = rearrange(x, "b t h w c -> (b t) c h w")  # Shape: (B*T, C, H, W)
-            H, W = x_flat.shape[-2:]
-
-            with torch.no_grad():
-                x_flat = vae.encode(x_flat * 2 - 1).mean * scaling_factor  # VAE encoding
-
-            # Reshape back to (B, T, C, H, W)
-            x_encoded = rearrange(
-                x_flat,
-                "(b t) (h w) c -> b t c h w",
-                b=B,
-                t=total_frames,
-                h=H // vae.patch_size,
-                w=W // vae.patch_size
-            ).to('cpu')  # Move to CPU to save GPU memory
-
-            # Clean up segment-level inputs after encoding
-            del x_segment, actions_segment, x, x_flat
-            torch.cuda.empty_cache()
 
             # Iterate over frames from n_prompt_frames to total_frames within the segment
             for i in range(n_prompt_frames, total_frames):
@@ -188,33 +290,42 @@ for epoch in range(num_epochs):
                 )
 
                 del x_curr
-                torch.cuda.empty_cache()
-                with autocast(device_type="cuda"):
+                with autocast(device_type=device.type, dtype=amp_dtype, enabled=device.type == "cuda"):
                     # Model prediction
-                    v = model(x_noisy, t, actions_curr_slice)
+                    v = ddp_model(x_noisy, t, actions_curr_slice)
                     # Compute loss (only on the current frame)
                     loss = torch.nn.functional.mse_loss(v[:, -1:], noise)
                 del noise
 
                 # Backpropagation and optimization
                 optimizer.zero_grad()
-                loss.backward()
-                optimizer.step()
+                scaler.scale(loss).backward()
+                scaler.step(optimizer)
+                scaler.update()
 
                 epoch_loss += loss.item()
                 total_steps += 1
                 del x_noisy, t, actions_curr_slice, v, loss
-                torch.cuda.empty_cache()
 
             # Clean up segment data
             x_encoded = x_encoded.to('cpu')
             del x_encoded, actions_curr
-            torch.cuda.empty_cache()
-
-    # Compute average loss for the epoch
-    avg_loss = epoch_loss / (num_segments_per_epoch * (total_frames - n_prompt_frames) * total_steps)
-    print(f"Epoch {epoch + 1}/{num_epochs} completed. Average Loss: {avg_loss:.4f}")
 
-# Save the trained model
-torch.save(model.state_dict(), 'finetuned_model1.pt')
-print("Model saved to models/finetuned_model1.pt.")
\ No newline at end of file
+    # Compute average loss for the epoch (over all ranks)
+    if distributed:
+        totals = torch.tensor([epoch_loss, total_steps], dtype=torch.float64, device=device)
+        dist.all_reduce(totals)
+        epoch_loss, total_steps = totals[0].item(), int(totals[1].item())
+    if training_mode == "diffusion_forcing":
+        avg_loss = epoch_loss / max(total_steps, 1)
+    else:
+        avg_loss = epoch_loss / (num_segments_per_epoch * (total_frames - n_prompt_frames) * total_steps)
+    if is_main:
+        print(f"Epoch {epoch + 1}/{num_epochs} completed. Average Loss: {avg_loss:.4f}")
+
+# Save the trained model (the weights are the same on every rank)
+if is_main:
+    torch.save(model.state_dict(), 'finetuned_model1.pt')
+    print("Model saved to models/finetuned_model1.pt.")
+if distributed:
+    dist.destroy_process_group()
\ No newline at end of file